@@ -1,10 +1,37 @@
-import gradio as gr
 import os
+import sys
+import argparse
 import requests
 import json
+import hashlib
+import zlib
+import pickle
+import sqlite3
+import threading
+import random
+import uuid
+import ctypes
+import ctypes.util
+import select
+import struct
+import functools
+import inspect
+import logging
+from contextlib import asynccontextmanager, contextmanager
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+import math
+import unicodedata
+import heapq
+from collections import Counter, defaultdict
+from itertools import zip_longest
+from difflib import SequenceMatcher
 from pathlib import Path
 import asyncio
-from paperqa import Docs
+import atexit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import time
 import re
 from typing import Dict, List, Optional
@@ -16,31 +43,2410 @@ load_dotenv()
 # Configuración desde variables de entorno
 PAPERS_DIR = os.getenv("PAPERS_DIR", "./zotero_papers")  # Directorio papers Zotero
 LOCAL_PAPERS_DIR = os.getenv("LOCAL_PAPERS_DIR", "./mis_papers")  # Directorio papers locales
+INDEX_DIR = os.getenv("PAPERMIND_INDEX_DIR", "./papermind_index")  # Índice Paper-QA persistente
+HTTP_TIMEOUT = float(os.getenv("PAPERMIND_HTTP_TIMEOUT", "30"))  # Timeout de lectura (s) para Zotero/Crossref
+CROSSREF_MAILTO = os.getenv("CROSSREF_MAILTO")  # Email para el "polite pool" de Crossref
+CROSSREF_CACHE_DB = os.getenv("PAPERMIND_CROSSREF_CACHE", os.path.join(INDEX_DIR, "crossref_cache.sqlite"))
+CROSSREF_CACHE_TTL = float(os.getenv("PAPERMIND_CROSSREF_TTL_DAYS", "30")) * 86400  # Caducidad de la caché (s)
+ANSWER_CACHE_DB = os.getenv("PAPERMIND_ANSWER_CACHE", os.path.join(INDEX_DIR, "answer_cache.sqlite"))
+ANSWER_CACHE_SIZE = int(os.getenv("PAPERMIND_ANSWER_CACHE_SIZE", "1000"))  # Respuestas guardadas (LRU)
+ANSWER_CACHE_TTL = float(os.getenv("PAPERMIND_ANSWER_CACHE_TTL_HOURS", "168")) * 3600  # Caducidad (s)
+STAGE_CACHE_DB = os.getenv("PAPERMIND_STAGE_CACHE", os.path.join(INDEX_DIR, "stage_cache.sqlite"))  # Texto, fragmentos y embeddings
+STAGE_CACHE_MB = float(os.getenv("PAPERMIND_STAGE_CACHE_MB", "2048"))  # Tamaño máximo en disco (LRU)
+ZOTERO_WRITE_BATCH = 50  # Máximo de items por petición de escritura en la API de Zotero
+QUERY_CONCURRENCY = int(os.getenv("PAPERMIND_QUERY_CONCURRENCY", "4"))  # Consultas simultáneas
+INGEST_CONCURRENCY = int(os.getenv("PAPERMIND_INGEST_CONCURRENCY", "8"))  # PDFs procesándose a la vez
+PARSE_WORKERS = int(os.getenv("PAPERMIND_PARSE_WORKERS", str(os.cpu_count() or 1)))  # Procesos para parsear PDFs
+DOWNLOAD_CONCURRENCY = int(os.getenv("PAPERMIND_DOWNLOAD_CONCURRENCY", "4"))  # Adjuntos Zotero descargándose a la vez
+DOWNLOAD_CHUNK = 1024 * 1024  # Bloque de escritura al descargar (bytes)
+WATCH_DIRS = os.getenv("PAPERMIND_WATCH", "0").lower() in ("1", "true", "yes")  # Vigilar directorios de PDFs
+WATCH_DEBOUNCE = float(os.getenv("PAPERMIND_WATCH_DEBOUNCE", "2"))  # Segundos sin eventos antes de procesar un archivo
+WATCH_POLL_INTERVAL = float(os.getenv("PAPERMIND_WATCH_POLL", "5"))  # Intervalo de sondeo (s) si no hay inotify
+CHECKPOINT_SECONDS = float(os.getenv("PAPERMIND_CHECKPOINT_SECONDS", "30"))  # Guardado periódico del índice durante una carga
+METADATA_DB = os.getenv("PAPERMIND_METADATA_DB", os.path.join(INDEX_DIR, "zotero_metadata.sqlite"))  # Metadatos Zotero
+SHARDS_DIR = os.path.join(INDEX_DIR, "shards")  # Un índice por biblioteca (personal, grupos Zotero y local)
+MAX_LOADED_SHARDS = int(os.getenv("PAPERMIND_MAX_LOADED_SHARDS", "4"))  # Bibliotecas en memoria a la vez (0 = sin límite)
+ZOTERO_GROUPS = os.getenv("PAPERMIND_ZOTERO_GROUPS", "")  # Grupos a indexar: vacío = todos, "0" = ninguno o lista de IDs
+PREFILTER_K = int(os.getenv("PAPERMIND_PREFILTER_K", "6"))  # Fragmentos a resumir por consulta (0 = desactivar)
+FALLBACK_K = int(os.getenv("PAPERMIND_FALLBACK_K", "10"))  # Fragmentos de la recuperación de Paper-QA por consulta (su k)
+# Presupuesto de la recopilación de evidencia (0 = sin límite)
+SUMMARY_MAX_CALLS = int(os.getenv("PAPERMIND_SUMMARY_MAX_CALLS", "0"))  # Llamadas de resumen por consulta
+SUMMARY_MAX_TOKENS = int(os.getenv("PAPERMIND_SUMMARY_MAX_TOKENS", "0"))  # Tokens de resumen por consulta
+SUMMARY_DEADLINE = float(os.getenv("PAPERMIND_SUMMARY_DEADLINE", "0"))  # Segundos para reunir evidencia
+SUMMARY_CONCURRENCY = int(os.getenv("PAPERMIND_SUMMARY_CONCURRENCY", "4"))  # Resúmenes en paralelo por consulta
+EVIDENCE_TARGET = int(os.getenv("PAPERMIND_EVIDENCE_TARGET", "0"))  # Parar al reunir tantas evidencias buenas
+EVIDENCE_MIN_SCORE = int(os.getenv("PAPERMIND_EVIDENCE_MIN_SCORE", "8"))  # Puntuación (0-10) de una evidencia buena
+BUDGET_LIMITS = {
+    'llamadas': "máximo de llamadas",
+    'tokens': "máximo de tokens",
+    'plazo': "plazo de tiempo",
+    'evidencia_suficiente': "evidencia suficiente",
+}
+DEDUP_THRESHOLD = float(os.getenv("PAPERMIND_DEDUP_THRESHOLD", "0.6"))  # Similitud (Jaccard) para tratar dos PDFs como el mismo documento (1 = solo idénticos)
+VECTOR_DTYPE = os.getenv("PAPERMIND_VECTOR_DTYPE", "float32")  # Formato de los embeddings en disco: float32, float16 o int8
+HYBRID_FETCH_K = int(os.getenv("PAPERMIND_HYBRID_FETCH_K", "30"))  # Candidatos por BM25 y por similitud vectorial
+RRF_K = 60  # Constante de la fusión por rangos recíprocos
+METRICS_PORT = int(os.getenv("PAPERMIND_METRICS_PORT", "9464"))  # Endpoint Prometheus /metrics (0 = desactivado)
+EVENTS_LOG = os.getenv("PAPERMIND_EVENTS_LOG", os.path.join(INDEX_DIR, "events.jsonl"))  # Log de eventos JSON
+# Precios (USD por millón de tokens: entrada, salida) para estimar el coste de cada consulta
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+CHUNK_CHARS = int(os.getenv("PAPERMIND_CHUNK_CHARS", "3000"))  # Tamaño de fragmento (igual que Paper-QA)
+CHUNK_OVERLAP = int(os.getenv("PAPERMIND_CHUNK_OVERLAP", "100"))  # Caracteres compartidos entre fragmentos
 ZOTERO_API_KEY = os.getenv("ZOTERO_API_KEY")
 ZOTERO_USER_ID = None  # Se detectará automáticamente
+ZOTERO_API_URL = os.getenv("ZOTERO_API_URL", "https://api.zotero.org").rstrip("/")
+CROSSREF_API_URL = os.getenv("CROSSREF_API_URL", "https://api.crossref.org").rstrip("/")
 
-# Validar que las API keys estén configuradas
-if not os.getenv("OPENAI_API_KEY"):
-    raise ValueError("❌ OPENAI_API_KEY no encontrada. Configura tu archivo .env")
-if not ZOTERO_API_KEY:
-    raise ValueError("❌ ZOTERO_API_KEY no encontrada. Configura tu archivo .env")
+def check_api_keys(require_zotero: bool = True):
+    """Validar que las API keys estén configuradas (al arrancar, no al importar el módulo)"""
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("❌ OPENAI_API_KEY no encontrada. Configura tu archivo .env")
+    if require_zotero and not ZOTERO_API_KEY:
+        raise ValueError("❌ ZOTERO_API_KEY no encontrada. Configura tu archivo .env")
 
 # Crear directorios si no existen
 os.makedirs(PAPERS_DIR, exist_ok=True)
 os.makedirs(LOCAL_PAPERS_DIR, exist_ok=True)
+os.makedirs(INDEX_DIR, exist_ok=True)
+
+def parse_pdf_pages(path: str) -> Dict[str, str]:
+    """Extraer el texto por página de un PDF (se ejecuta en el pool de procesos)"""
+    from paperqa import Doc
+    from paperqa.readers import read_doc
+    return read_doc(Path(path), Doc(docname="", citation="", dockey=""), parsed_text_only=True).content
+
+def chunk_pages(pages: Dict[str, str]) -> List[List[str]]:
+    """Trocear el texto por página como Paper-QA: [[rango de páginas, texto], ...].
+    
+    No depende del documento (el nombre de cada fragmento se compone al indexar),
+    así que el resultado se puede guardar en caché por contenido.
+    """
+    from paperqa import Doc
+    from paperqa.readers import chunk_pdf
+    from paperqa.types import ParsedMetadata, ParsedText
+    parsed = ParsedText(
+        content=pages,
+        metadata=ParsedMetadata(parsing_libraries=[], total_parsed_text_length=sum(len(text) for text in pages.values()))
+    )
+    texts = chunk_pdf(parsed, Doc(docname="", citation="", dockey=""), chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP)
+    return [[text.name.rsplit(" pages ", 1)[1], text.text] for text in texts]
+
+def make_docname(citation: str) -> str:
+    """Nombre corto estilo Paper-QA (Apellido + año) a partir de la citación"""
+    author = re.search(r"([A-Z][a-z]+)", citation)
+    year = re.search(r"(\d{4})", citation)
+    return f"{author.group(1) if author else 'Doc'}{year.group(1) if year else ''}"
+
+def clean_filename(filename: str) -> str:
+    """Limpiar nombre de archivo para sistema de archivos"""
+    # Remover caracteres no válidos
+    filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    # Limitar longitud
+    if len(filename) > 100:
+        filename = filename[:95] + ".pdf"
+    return filename
+
+def merge_shard_texts(ranked: List[list]) -> list:
+    """Intercalar por rango los fragmentos de varias bibliotecas.
+    
+    Se descartan los fragmentos repetidos (mismo documento y texto) y, si dos bibliotecas
+    usan el mismo nombre de fragmento, el segundo se distingue con su dockey: Paper-QA
+    identifica las evidencias y las citas por ese nombre.
+    """
+    merged, seen, names = [], set(), set()
+    for texts in zip_longest(*ranked):
+        for text in texts:
+            if text is None or (text.doc.dockey, text.text) in seen:
+                continue
+            seen.add((text.doc.dockey, text.text))
+            if text.name in names:
+                text = text.model_copy(update={'name': f"{text.name} [{text.doc.dockey[:6]}]"})
+            names.add(text.name)
+            merged.append(text)
+    return merged
+
+def header_seconds(value: Optional[str]) -> Optional[float]:
+    """Segundos indicados por una cabecera Backoff/Retry-After (número o fecha HTTP)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class Metrics:
+    """Contadores, gauges e histogramas en memoria, exportados en formato Prometheus"""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    COST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+    HELP = {
+        "papermind_stage_seconds": "Duración de cada etapa (carga, sync, parseo, embeddings, consulta...)",
+        "papermind_errors_total": "Errores por etapa",
+        "papermind_http_seconds": "Duración de las peticiones HTTP a Zotero y Crossref",
+        "papermind_http_retries_total": "Reintentos HTTP por servicio",
+        "papermind_llm_tokens_total": "Tokens LLM por modelo y tipo",
+        "papermind_llm_cost_usd_total": "Coste LLM estimado acumulado (USD)",
+        "papermind_query_cost_usd": "Coste LLM estimado por consulta (USD)",
+        "papermind_evidence_stop_total": "Recopilaciones de evidencia por motivo de parada",
+        "papermind_answer_cache_total": "Consultas a la caché de respuestas por resultado",
+        "papermind_stage_cache_total": "Consultas a la caché de etapas de ingesta por etapa y resultado",
+        "papermind_documents_total": "PDFs procesados en las cargas por resultado",
+        "papermind_download_bytes_total": "Bytes de PDFs descargados (adjuntos Zotero y PDFs por DOI)",
+        "papermind_attachments_total": "Adjuntos Zotero procesados en la sincronización por biblioteca y resultado",
+        "papermind_index_documents": "Documentos en el índice de cada biblioteca",
+        "papermind_index_chunks": "Fragmentos en el índice de cada biblioteca",
+        "papermind_shards_loaded": "Bibliotecas con el índice cargado en memoria",
+    }
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)  # (nombre, etiquetas) → valor
+        self.gauges = {}
+        self.histograms = {}  # (nombre, etiquetas) → [límites, cuentas acumuladas, suma, total]
+    
+    @staticmethod
+    def key(name: str, labels: Dict) -> tuple:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+    
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self.lock:
+            self.counters[self.key(name, labels)] += value
+    
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+    
+    def observe(self, name: str, value: float, buckets: tuple = BUCKETS, **labels):
+        with self.lock:
+            histogram = self.histograms.setdefault(self.key(name, labels), [buckets, [0] * len(buckets), 0.0, 0])
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+    
+    @staticmethod
+    def format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        escaped = (
+            k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            for k, v in labels
+        )
+        return "{" + ",".join(escaped) + "}"
+    
+    def render(self) -> str:
+        """Exposición en formato de texto Prometheus"""
+        lines = []
+        
+        def header(name: str, kind: str):
+            lines.append(f"# HELP {name} {self.HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        with self.lock:
+            for kind, samples in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in samples}):
+                    header(name, kind)
+                    for (sample, labels), value in sorted(samples.items()):
+                        if sample == name:
+                            lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+            for name in sorted({name for name, _ in self.histograms}):
+                header(name, "histogram")
+                for (sample, labels), (bounds, counts, total, count) in sorted(self.histograms.items()):
+                    if sample != name:
+                        continue
+                    for bound, bucket_count in zip(bounds, counts):
+                        lines.append(f"{name}_bucket{self.format_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self.format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self.format_labels(labels)} {total:g}")
+                    lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+event_logger = logging.getLogger("papermind.events")
+
+def log_event(event: str, **fields):
+    """Evento estructurado (una línea JSON) en el log de eventos"""
+    if event_logger.handlers:
+        event_logger.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str))
+
+@contextmanager
+def track(stage: str, **fields):
+    """Medir una etapa: histograma de duración, contador de errores y evento JSON.
+    
+    El diccionario devuelto admite campos extra para el evento ('error' la marca como fallida).
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield fields
+    except (asyncio.CancelledError, GeneratorExit):
+        status = "cancelado"
+        raise
+    except Exception as e:
+        fields['error'] = str(e)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        if fields.get('error'):
+            status = "error"
+            metrics.inc("papermind_errors_total", stage=stage)
+        metrics.observe("papermind_stage_seconds", seconds, stage=stage)
+        log_event(stage, seconds=round(seconds, 4), status=status, **fields)
+
+def mark_result(event: Dict, result):
+    """Los métodos de la integración informan de los fallos con mensajes '❌'"""
+    if isinstance(result, str) and result.startswith("❌"):
+        event['error'] = result.split("\n")[0][:200]
+
+def tracked(stage: str):
+    """Decorador de track() para funciones, corrutinas y generadores asíncronos"""
+    def decorate(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with track(stage) as event:
+                    generator = func(*args, **kwargs)
+                    result = None
+                    try:
+                        async for result in generator:
+                            yield result
+                    finally:
+                        await generator.aclose()
+                    mark_result(event, result)
+        elif inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with track(stage) as event:
+                    result = await func(*args, **kwargs)
+                    mark_result(event, result)
+                    return result
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with track(stage) as event:
+                    result = func(*args, **kwargs)
+                    mark_result(event, result)
+                    return result
+        return wrapper
+    return decorate
+
+def token_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Coste estimado en USD según MODEL_PRICES (0 para modelos desconocidos)"""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def merge_token_counts(target: Optional[Dict], source: Dict) -> int:
+    """Sumar a target los tokens [entrada, salida] por modelo de source (Answer.token_counts).
+    
+    Devuelve el total de tokens de source; con target None solo se cuentan.
+    """
+    total = 0
+    for model, (prompt_tokens, completion_tokens) in source.items():
+        if target is not None:
+            counts = target.setdefault(model, [0, 0])
+            counts[0] += prompt_tokens
+            counts[1] += completion_tokens
+        total += prompt_tokens + completion_tokens
+    return total
+
+def answer_cost(answer) -> float:
+    return sum(token_cost(model, *counts) for model, counts in answer.token_counts.items())
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int = 0, kind: str = "chat"):
+    metrics.inc("papermind_llm_tokens_total", prompt_tokens, model=model, kind=f"{kind}_entrada")
+    if completion_tokens:
+        metrics.inc("papermind_llm_tokens_total", completion_tokens, model=model, kind=f"{kind}_salida")
+    metrics.inc("papermind_llm_cost_usd_total", token_cost(model, prompt_tokens, completion_tokens))
+
+def start_observability(serve_metrics: bool = True):
+    """Log de eventos JSON (rotativo) y endpoint /metrics en un hilo aparte"""
+    handler = RotatingFileHandler(EVENTS_LOG, maxBytes=10 * 1024 * 1024, backupCount=3, encoding='utf-8')
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    event_logger.addHandler(handler)
+    event_logger.setLevel(logging.INFO)
+    event_logger.propagate = False
+    
+    if not METRICS_PORT or not serve_metrics:
+        return
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("localhost", METRICS_PORT), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Métricas Prometheus en http://localhost:{METRICS_PORT}/metrics · eventos en {EVENTS_LOG}")
+
+def file_md5(path: Path) -> str:
+    """Hash MD5 de un archivo leído por bloques"""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def stream_to_file(response, path: Path, append: bool = False, digest=None) -> int:
+    """Escribir el cuerpo de una respuesta por bloques, sin cargarlo entero en memoria"""
+    written = 0
+    with open(path, 'ab' if append else 'wb') as f:
+        for block in response.iter_content(DOWNLOAD_CHUNK):
+            f.write(block)
+            if digest is not None:
+                digest.update(block)
+            written += len(block)
+    metrics.inc("papermind_download_bytes_total", written)
+    return written
+
+class HttpClient:
+    """Sesión HTTP compartida: pool de conexiones, timeouts y reintentos con backoff.
+    
+    Respeta las cabeceras Backoff y Retry-After de Zotero y, opcionalmente,
+    un límite de peticiones por segundo y de peticiones simultáneas (Crossref).
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    
+    def __init__(self, headers: Dict = None, params: Dict = None, max_concurrent: int = 4,
+                 max_per_second: float = None, max_retries: int = 5, timeout: float = HTTP_TIMEOUT,
+                 name: str = "http"):
+        self.name = name
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrent)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+        self.session.params = params or {}
+        self.timeout = (5, timeout)
+        self.max_retries = max_retries
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.min_interval = 1 / max_per_second if max_per_second else 0
+        self.lock = threading.Lock()
+        self.next_request_at = 0.0
+    
+    def defer(self, seconds: float):
+        """No enviar más peticiones durante los próximos segundos"""
+        with self.lock:
+            self.next_request_at = max(self.next_request_at, time.monotonic() + seconds)
+    
+    def wait_turn(self):
+        """Esperar a que termine el backoff y respetar el ritmo máximo"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request_at)
+            self.next_request_at = max(self.next_request_at, start + self.min_interval)
+        if start > now:
+            time.sleep(start - now)
+    
+    def backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial con jitter completo"""
+        return random.uniform(0, min(60, 2 ** attempt))
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            self.wait_turn()
+            try:
+                with self.slots:
+                    start = time.perf_counter()
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.observe("papermind_http_seconds", time.perf_counter() - start, service=self.name, status="error")
+                if attempt == self.max_retries:
+                    raise
+                metrics.inc("papermind_http_retries_total", service=self.name)
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            metrics.observe("papermind_http_seconds", time.perf_counter() - start, service=self.name, status=response.status_code)
+            
+            # Zotero pide espaciar las siguientes peticiones aunque esta haya ido bien
+            backoff = header_seconds(response.headers.get("Backoff"))
+            if backoff:
+                self.defer(backoff)
+            
+            if response.status_code not in self.RETRY_STATUS or attempt == self.max_retries:
+                return response
+            
+            metrics.inc("papermind_http_retries_total", service=self.name)
+            response.close()
+            retry_after = header_seconds(response.headers.get("Retry-After"))
+            self.defer(retry_after if retry_after is not None else self.backoff_delay(attempt))
+        return response
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+    
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+DOI_PATTERN = re.compile(r'10\.\d{4,9}/[^\s"\'<>{}]+')
+
+def extract_dois(text: str) -> List[str]:
+    """Extraer DOIs de una lista, un BibTeX o un RIS (sin duplicados, en orden)"""
+    # Campos DOI explícitos de BibTeX y RIS; si no hay, buscar en todo el texto
+    fields = re.findall(r'^\s*doi\s*=\s*[{"]\s*([^}"]+)', text, flags=re.IGNORECASE | re.MULTILINE)
+    fields += re.findall(r'^DO  - (.+)$', text, flags=re.MULTILINE)
+    
+    dois = []
+    seen = set()
+    for chunk in fields or [text]:
+        for match in DOI_PATTERN.findall(chunk):
+            doi = match.rstrip('.,;)')
+            if doi.lower() not in seen:
+                seen.add(doi.lower())
+                dois.append(doi)
+    return dois
+
+class CrossrefCache:
+    """Caché en disco (SQLite) de metadatos Crossref con caducidad"""
+    NEGATIVE_TTL = 86400  # Los DOIs no encontrados se reintentan al día siguiente
+    
+    def __init__(self, db_path: str, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS works (doi TEXT PRIMARY KEY, fetched_at REAL NOT NULL, data TEXT)"
+            )
+    
+    def get(self, doi: str):
+        """Devuelve (encontrado, metadatos); metadatos None si Crossref no conoce el DOI"""
+        with self.lock:
+            row = self.conn.execute("SELECT fetched_at, data FROM works WHERE doi = ?", (doi.lower(),)).fetchone()
+        if row is None:
+            return False, None
+        fetched_at, data = row
+        ttl = self.ttl if data is not None else self.NEGATIVE_TTL
+        if time.time() - fetched_at > ttl:
+            return False, None
+        return True, json.loads(data) if data is not None else None
+    
+    def put(self, doi: str, metadata: Optional[Dict]):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO works (doi, fetched_at, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(doi) DO UPDATE SET fetched_at = excluded.fetched_at, data = excluded.data",
+                (doi.lower(), time.time(), json.dumps(metadata, ensure_ascii=False) if metadata is not None else None)
+            )
+
+class AnswerCache:
+    """Caché persistente (SQLite) de respuestas con caducidad y expulsión LRU"""
+    
+    def __init__(self, db_path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, created_at REAL NOT NULL, last_used REAL NOT NULL, response TEXT NOT NULL, "
+                "details TEXT)"
+            )
+            # Cachés creadas antes de guardar la respuesta estructurada
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(answers)")}
+            if "details" not in columns:
+                self.conn.execute("ALTER TABLE answers ADD COLUMN details TEXT")
+    
+    @staticmethod
+    def make_key(question: str, collection_filter: str, tag_filter: str, index_version: str) -> str:
+        """Clave por pregunta normalizada, filtros activos y versión del índice"""
+        normalized = ' '.join(re.findall(r'\w+', unicodedata.normalize('NFKC', question).casefold()))
+        raw = json.dumps([normalized, collection_filter or '', tag_filter or '', index_version])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str, details: Dict = None) -> Optional[str]:
+        """Respuesta Markdown guardada; si se pasa `details`, se completa con la versión estructurada"""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT created_at, response, details FROM answers WHERE key = ?", (key,)).fetchone()
+            if row and now - row[0] <= self.ttl:
+                self.conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                metrics.inc("papermind_answer_cache_total", result="acierto")
+                if details is not None and row[2]:
+                    details.update(json.loads(row[2]))
+                return row[1]
+            self.misses += 1
+            metrics.inc("papermind_answer_cache_total", result="fallo")
+        return None
+    
+    def put(self, key: str, response: str, details: Dict = None):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO answers (key, created_at, last_used, response, details) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET created_at = excluded.created_at, "
+                "last_used = excluded.last_used, response = excluded.response, details = excluded.details",
+                (key, now, now, response, json.dumps(details, ensure_ascii=False, default=str) if details else None)
+            )
+            # Expulsar caducadas y, por encima del límite, las menos usadas recientemente
+            self.conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM answers WHERE key IN "
+                "(SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+    
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0.0
+        return f"tasa de aciertos {rate:.0f}% ({self.hits}/{total})"
+
+class StageCache:
+    """Caché persistente (SQLite) de las etapas de ingesta, por contenido.
+    
+    Guarda el texto extraído (por hash del PDF), los fragmentos (hash + parámetros del
+    troceado), las citaciones y los embeddings (fragmentos + modelo), comprimidos.
+    Reconstruir el índice con otra configuración reutiliza las etapas que no cambian.
+    Por encima del tamaño máximo se expulsan las entradas menos usadas recientemente.
+    """
+    
+    def __init__(self, db_path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS stages (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (kind, key)
+                );
+                CREATE INDEX IF NOT EXISTS stages_last_used ON stages (last_used);
+            """)
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM stages").fetchone()[0]
+    
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT data FROM stages WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if row is None:
+                self.misses[kind] += 1
+                metrics.inc("papermind_stage_cache_total", stage=kind, result="fallo")
+                return None
+            self.conn.execute("UPDATE stages SET last_used = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+        self.hits[kind] += 1
+        metrics.inc("papermind_stage_cache_total", stage=kind, result="acierto")
+        return zlib.decompress(row[0])
+    
+    def put(self, kind: str, key: str, data: bytes):
+        blob = zlib.compress(data, 1)
+        with self.lock, self.conn:
+            previous = self.conn.execute("SELECT size FROM stages WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            self.conn.execute(
+                "INSERT INTO stages (kind, key, last_used, size, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET last_used = excluded.last_used, "
+                "size = excluded.size, data = excluded.data",
+                (kind, key, time.time(), len(blob), blob)
+            )
+            self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            # Expulsar las menos usadas hasta quedar holgadamente por debajo del límite
+            while self.total_bytes > self.max_bytes:
+                oldest = self.conn.execute(
+                    "SELECT kind, key, size FROM stages ORDER BY last_used LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                for old_kind, old_key, size in oldest:
+                    self.conn.execute("DELETE FROM stages WHERE kind = ? AND key = ?", (old_kind, old_key))
+                    self.total_bytes -= size
+                    if self.total_bytes <= 0.9 * self.max_bytes:
+                        break
+    
+    def get_json(self, kind: str, key: str):
+        data = self.get(kind, key)
+        return json.loads(data) if data is not None else None
+    
+    def put_json(self, kind: str, key: str, value):
+        self.put(kind, key, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+    
+    # Versiones para la ingesta: SQLite y zlib en un hilo, sin bloquear el event loop
+    async def aget(self, kind: str, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self.get, kind, key)
+    
+    async def aput(self, kind: str, key: str, data: bytes):
+        await asyncio.to_thread(self.put, kind, key, data)
+    
+    async def aget_json(self, kind: str, key: str):
+        return await asyncio.to_thread(self.get_json, kind, key)
+    
+    async def aput_json(self, kind: str, key: str, value):
+        await asyncio.to_thread(self.put_json, kind, key, value)
+    
+    def stats(self) -> str:
+        return ", ".join(
+            f"{kind} {self.hits[kind]}/{self.hits[kind] + self.misses[kind]}"
+            for kind in sorted(set(self.hits) | set(self.misses))
+        ) or "sin consultas"
+
+def item_metadata(data: Dict) -> Dict:
+    """Metadatos enriquecidos a partir del campo 'data' de un item Zotero"""
+    authors = []
+    for creator in data.get('creators', []):
+        name = creator.get('name') or f"{creator.get('firstName', '')} {creator.get('lastName', '')}".strip()
+        authors.append(name)
+    return {
+        'key': data.get('key', ''),
+        'title': data.get('title', 'Sin título'),
+        'authors': authors,
+        'year': data.get('date', ''),
+        'doi': data.get('DOI', ''),
+        'tags': [tag.get('tag', '') for tag in data.get('tags', [])],
+        'collections': data.get('collections', [])
+    }
+
+def manifest_dockey(entry: Dict) -> str:
+    """Documento del índice que representa a un archivo del manifiesto.
+    
+    Es el hash del propio PDF salvo en los casi duplicados, que apuntan al documento ya indexado.
+    """
+    return entry.get('dockey', entry['hash'])
+
+def merge_metadata(copies: List[Dict]) -> Dict:
+    """Metadatos de un documento con varias copias (p. ej. preprint y versión publicada).
+    
+    Manda la copia más completa (con DOI antes que sin él); los campos vacíos se completan
+    con las demás y colecciones y etiquetas se unen para que los filtros encuentren el documento.
+    """
+    copies = [metadata for metadata in copies if metadata]
+    if len(copies) < 2:
+        return copies[0] if copies else {}
+    copies.sort(key=lambda metadata: (not metadata.get('doi'), not metadata.get('year')))
+    merged = dict(copies[0])
+    for metadata in copies[1:]:
+        for field, value in metadata.items():
+            if field in ('collections', 'tags'):
+                merged[field] = list(dict.fromkeys(merged.get(field, []) + value))
+            elif not merged.get(field):
+                merged[field] = value
+    return merged
+
+STOPWORDS = {
+    "the", "and", "for", "with", "from", "into", "using", "via", "its", "are", "was", "not",
+    "del", "las", "los", "una", "con", "por", "para", "que", "sus", "como", "entre", "sobre",
+    "pdf", "paper", "article"
+}
+
+def normalize_doi(doi: str) -> str:
+    """DOI comparable con nombres de archivo ('/' y símbolos pasan a '_')"""
+    doi = doi.strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return re.sub(r'[^a-z0-9.]+', '_', doi).strip('_.')
+
+def title_tokens(text: str) -> List[str]:
+    """Tokens normalizados (sin acentos ni palabras vacías) de un título o nombre de archivo"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [t for t in re.split(r'[^a-z0-9]+', text) if len(t) > 2 and t not in STOPWORDS]
+
+class PdfMatcher:
+    """Índice para emparejar items Zotero con PDFs locales.
+    
+    Se construye una vez por sincronización: búsqueda exacta por DOI normalizado
+    y un índice invertido de tokens de título con puntuación difusa.
+    """
+    THRESHOLD = 0.6  # Puntuación mínima para aceptar una coincidencia por título
+    MARGIN = 0.05  # Diferencia mínima con la segunda opción para no ser ambigua
+    SEED_TOKENS = 4  # Tokens más raros del título usados para generar candidatos
+    MAX_RERANK = 10  # Candidatos a los que se calcula la similitud de secuencia
+    
+    def __init__(self, pdf_files):
+        self.files = list(pdf_files)
+        self.by_doi = defaultdict(set)
+        self.file_tokens = []
+        self.file_text = []
+        self.postings = defaultdict(list)
+        doi_pattern = re.compile(r'10\.\d{4,9}[_/]')
+        
+        for i, pdf_file in enumerate(self.files):
+            stem = pdf_file.stem.lower()
+            doi_match = doi_pattern.search(stem)
+            if doi_match:
+                # El nombre puede llevar texto tras el DOI: registrar cada corte posible
+                candidate = normalize_doi(stem[doi_match.start():])
+                for j, char in enumerate(candidate):
+                    if char in '_.' and j >= 8:
+                        self.by_doi[candidate[:j]].add(i)
+                self.by_doi[candidate].add(i)
+                stem = stem[:doi_match.start()]
+            
+            tokens = title_tokens(stem)
+            self.file_text.append(' '.join(tokens))
+            self.file_tokens.append(set(tokens))
+            for token in self.file_tokens[-1]:
+                self.postings[token].append(i)
+        
+        self.token_idf = {t: math.log(1 + len(self.files) / (1 + len(ids))) for t, ids in self.postings.items()}
+        self.file_weight = [sum(self.token_idf[t] for t in tokens) for tokens in self.file_tokens]
+    
+    def idf(self, token: str) -> float:
+        return self.token_idf.get(token) or math.log(1 + len(self.files))
+    
+    def match(self, title: str, doi: str = ""):
+        """Buscar el PDF de un item.
+        
+        Devuelve (estado, archivo, puntuación, alternativas) con estado
+        'doi', 'titulo', 'ambiguo' o 'sin_coincidencia'.
+        """
+        candidate_ids = doi_ids = None
+        if doi:
+            doi_ids = self.by_doi.get(normalize_doi(doi))
+            if doi_ids and len(doi_ids) == 1:
+                return 'doi', self.files[next(iter(doi_ids))], 1.0, []
+            candidate_ids = doi_ids
+        
+        tokens = title_tokens(title)
+        if not tokens:
+            return 'sin_coincidencia', None, 0.0, []
+        weights = {t: self.idf(t) for t in set(tokens)}
+        total = sum(weights.values())
+        
+        if candidate_ids is None:
+            seeds = sorted(weights, key=weights.get, reverse=True)[:self.SEED_TOKENS]
+            candidate_ids = set()
+            for token in seeds:
+                candidate_ids.update(self.postings.get(token, ()))
+        
+        # Dice ponderado por IDF entre tokens del título y del archivo
+        scored = []
+        token_set = set(weights)
+        for i in candidate_ids:
+            shared = sum(weights[t] for t in token_set & self.file_tokens[i])
+            if shared:
+                scored.append((2 * shared / (total + self.file_weight[i]), i))
+        scored = sorted(scored, reverse=True)[:self.MAX_RERANK]
+        
+        # Reordenar los mejores con similitud de secuencia; se omiten los candidatos
+        # cuya cota superior (ratio = 1) ya no puede alcanzar al mejor
+        sequence = SequenceMatcher(None)
+        sequence.set_seq2(' '.join(tokens))
+        reranked = []
+        for dice, i in scored:
+            upper = 0.6 * dice + 0.4
+            if upper < self.THRESHOLD or (reranked and upper < max(reranked)[0] - self.MARGIN):
+                break
+            sequence.set_seq1(self.file_text[i])
+            reranked.append((0.6 * dice + 0.4 * sequence.ratio(), i))
+        reranked.sort(reverse=True)
+        if not reranked or reranked[0][0] < self.THRESHOLD:
+            if doi_ids:
+                # Varios PDFs con el mismo DOI y ninguno destaca por título
+                return 'ambiguo', None, 0.0, [self.files[i] for i in doi_ids]
+            return 'sin_coincidencia', None, 0.0, []
+        
+        best_score, best_id = reranked[0]
+        close = [self.files[i] for score, i in reranked if best_score - score < self.MARGIN]
+        if len(close) > 1:
+            return 'ambiguo', None, best_score, close
+        return 'titulo', self.files[best_id], best_score, []
+
+LEXICAL_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+
+def lexical_terms(text: str) -> List[str]:
+    """Términos para BM25: conserva genes, siglas y DOIs completos y también sus partes"""
+    terms = []
+    for token in LEXICAL_TOKEN.findall(text.casefold()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = re.split(r'[-./]', token)
+        if len(parts) > 1:
+            terms.extend(p for p in parts if len(p) > 1 and p not in STOPWORDS)
+    return terms
+
+class Bm25Index:
+    """Índice invertido BM25 sobre los fragmentos indexados.
+    
+    Se actualiza incrementalmente al añadir o eliminar documentos y se fusiona
+    con la similitud vectorial para preseleccionar los fragmentos a resumir.
+    """
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self.postings = defaultdict(dict)  # término → {fragmento: frecuencia}
+        self.lengths = {}  # fragmento → número de términos
+        self.chunk_terms = {}  # fragmento → términos distintos (para eliminarlo)
+        self.chunk_dockey = {}
+        self.dockey_chunks = defaultdict(set)
+        self.total_length = 0
+    
+    def dockeys(self) -> set:
+        return set(self.dockey_chunks)
+    
+    def add_texts(self, texts):
+        for text in texts:
+            if text.name in self.lengths:
+                continue
+            terms = lexical_terms(text.text)
+            counts = Counter(terms)
+            for term, count in counts.items():
+                self.postings[term][text.name] = count
+            self.lengths[text.name] = len(terms)
+            self.chunk_terms[text.name] = tuple(counts)
+            self.chunk_dockey[text.name] = text.doc.dockey
+            self.dockey_chunks[text.doc.dockey].add(text.name)
+            self.total_length += len(terms)
+    
+    def remove_dockey(self, dockey: str):
+        for name in self.dockey_chunks.pop(dockey, ()):
+            for term in self.chunk_terms.pop(name):
+                postings = self.postings[term]
+                del postings[name]
+                if not postings:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(name)
+            del self.chunk_dockey[name]
+    
+    def search(self, query: str, k: int, dockeys: set = None) -> List[tuple]:
+        """Los k fragmentos con mayor puntuación BM25: [(nombre, puntuación)]"""
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(lexical_terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for name, tf in postings.items():
+                if dockeys is not None and self.chunk_dockey[name] not in dockeys:
+                    continue
+                norm = tf + self.K1 * (1 - self.B + self.B * self.lengths[name] / avg_length)
+                scores[name] += idf * tf * (self.K1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+class ZoteroMetadataStore:
+    """Almacén local SQLite de metadatos Zotero para sincronizaciones incrementales"""
+    
+    def __init__(self, db_path: str):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS items (
+                    key TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS pdf_links (
+                    path TEXT PRIMARY KEY,
+                    item_key TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS attachments (
+                    key TEXT PRIMARY KEY,
+                    parent TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    md5 TEXT,
+                    version INTEGER NOT NULL,
+                    local_size INTEGER,
+                    local_mtime INTEGER,
+                    local_version INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS collections (
+                    key TEXT PRIMARY KEY,
+                    name TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    library TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+            """)
+            # Almacenes creados antes de recordar la versión descargada de cada adjunto
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(attachments)")}
+            if "local_version" not in columns:
+                self.conn.execute("ALTER TABLE attachments ADD COLUMN local_version INTEGER")
+    
+    def get_version(self, library: str) -> int:
+        """Última versión de biblioteca sincronizada (0 si nunca se sincronizó)"""
+        with self.lock:
+            row = self.conn.execute("SELECT version FROM sync_state WHERE library = ?", (library,)).fetchone()
+        return row[0] if row else 0
+    
+    def set_version(self, library: str, version: int):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO sync_state (library, version) VALUES (?, ?) "
+                "ON CONFLICT(library) DO UPDATE SET version = excluded.version",
+                (library, version)
+            )
+    
+    def upsert_items(self, items: List[Dict]):
+        """Insertar o actualizar items tal como los devuelve la API de Zotero"""
+        rows = [(item['key'], item.get('version', 0), json.dumps(item['data'], ensure_ascii=False)) for item in items]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO items (key, version, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET version = excluded.version, data = excluded.data",
+                rows
+            )
+    
+    def delete_items(self, keys: List[str]):
+        """Eliminar items borrados en Zotero junto con sus enlaces a PDFs y sus adjuntos"""
+        rows = [(key,) for key in keys]
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM items WHERE key = ?", rows)
+            self.conn.executemany("DELETE FROM pdf_links WHERE item_key = ?", rows)
+            self.conn.executemany("DELETE FROM attachments WHERE key = ?", rows)
+            self.conn.executemany("DELETE FROM attachments WHERE parent = ?", rows)
+    
+    def upsert_attachments(self, attachments: List[Dict]):
+        """Guardar adjuntos PDF (campo 'data' de la API); un md5 distinto obliga a descargar de nuevo.
+        
+        Sin md5 (archivo aún sin subir a Zotero) lo que cuenta es la versión del adjunto.
+        """
+        rows = [(data['key'], data['parentItem'], data.get('filename') or f"{data['key']}.pdf",
+                 data.get('md5'), data.get('version', 0)) for data in attachments]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO attachments (key, parent, filename, md5, version) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET parent = excluded.parent, filename = excluded.filename, "
+                "local_size = CASE WHEN md5 IS excluded.md5 AND (md5 IS NOT NULL OR version = excluded.version) "
+                "THEN local_size END, "
+                "local_mtime = CASE WHEN md5 IS excluded.md5 AND (md5 IS NOT NULL OR version = excluded.version) "
+                "THEN local_mtime END, "
+                "md5 = excluded.md5, version = excluded.version",
+                rows
+            )
+    
+    def attachments(self, parents: set) -> List[Dict]:
+        """Adjuntos PDF de los items indicados"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, parent, filename, md5, version, local_size, local_mtime, local_version FROM attachments"
+            ).fetchall()
+        columns = ('key', 'parent', 'filename', 'md5', 'version', 'local_size', 'local_mtime', 'local_version')
+        return [dict(zip(columns, row)) for row in rows if row[1] in parents]
+    
+    def mark_downloaded(self, key: str, size: int, mtime: int, version: int):
+        """Recordar tamaño, mtime y versión del archivo verificado (evita recalcular su MD5)"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE attachments SET local_size = ?, local_mtime = ?, local_version = ? WHERE key = ?",
+                (size, mtime, version, key)
+            )
+    
+    def all_items(self) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM items").fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    def existing_dois(self) -> set:
+        """DOIs (en minúsculas) de los items ya presentes en la biblioteca"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT lower(json_extract(data, '$.DOI')) FROM items WHERE json_extract(data, '$.DOI') != ''"
+            ).fetchall()
+        return {row[0] for row in rows if row[0]}
+    
+    def count_items(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    
+    def save_collections(self, collections: Dict[str, str]):
+        """Reemplazar las colecciones guardadas (nombre → clave)"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM collections")
+            self.conn.executemany(
+                "INSERT INTO collections (key, name) VALUES (?, ?)",
+                [(key, name) for name, key in collections.items()]
+            )
+    
+    def collections(self) -> Dict[str, str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT name, key FROM collections ORDER BY name").fetchall()
+        return dict(rows)
+    
+    def link_pdfs(self, links: Dict[str, str]):
+        """Guardar enlaces ruta de PDF → item Zotero"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO pdf_links (path, item_key) VALUES (?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET item_key = excluded.item_key",
+                list(links.items())
+            )
+    
+    def linked_metadata(self) -> Dict[str, Dict]:
+        """Metadatos enriquecidos indexados por ruta de PDF"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT pdf_links.path, items.data FROM pdf_links JOIN items ON items.key = pdf_links.item_key"
+            ).fetchall()
+        return {path: item_metadata(json.loads(data)) for path, data in rows}
+
+class Inotify:
+    """Acceso mínimo a inotify (Linux) mediante ctypes"""
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (seguido del nombre)
+    
+    def __init__(self, directories: List[str]):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watches = {}
+        try:
+            for directory in directories:
+                self.add(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+    
+    def add(self, directory: str):
+        """Vigilar un directorio más (se puede llamar con el vigilante en marcha)"""
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch: {directory}")
+        self.watches[wd] = directory
+    
+    def read(self, timeout: float) -> List[str]:
+        """Rutas afectadas por los eventos pendientes (espera como mucho timeout segundos)"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name and wd in self.watches:
+                paths.append(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return paths
+    
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """Vigila los directorios de PDFs y entrega los cambios agrupados.
+    
+    Usa inotify si está disponible y, si no, compara tamaño y mtime cada cierto intervalo.
+    Un archivo se entrega cuando lleva WATCH_DEBOUNCE segundos sin eventos, su tamaño ya no
+    cambia y el PDF está completo (termina en %%EOF); los borrados se entregan tal cual.
+    """
+    MAX_WAIT = 120  # Segundos máximos esperando a que un PDF termine de escribirse
+    
+    def __init__(self, directories: List[str], on_changes, debounce: float = WATCH_DEBOUNCE,
+                 poll_interval: float = WATCH_POLL_INTERVAL):
+        self.directories = [str(Path(directory)) for directory in directories]
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.pending = {}  # ruta → (primer evento, último evento, tamaño observado)
+        self.snapshot = {}
+        self.inotify = None
+        self.mode = "sondeo"
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        try:
+            self.inotify = Inotify(self.directories)
+            self.mode = "inotify"
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ inotify no disponible ({e}); se usará sondeo cada {self.poll_interval:g} s")
+            self.snapshot = self.scan()
+        self.thread = threading.Thread(target=self.run, name="papermind-watcher", daemon=True)
+        self.thread.start()
+        print(f"👀 Vigilando {', '.join(self.directories)} ({self.mode})")
+    
+    def add_directory(self, directory: str):
+        """Vigilar un directorio creado después de arrancar (p. ej. un grupo Zotero nuevo)"""
+        directory = str(Path(directory))
+        if directory in self.directories:
+            return
+        if self.inotify:
+            try:
+                self.inotify.add(directory)
+            except OSError as e:
+                print(f"⚠️ No se pudo vigilar {directory}: {e}")
+                return
+        # En modo sondeo sus PDFs aparecen como nuevos en la siguiente pasada
+        self.directories = self.directories + [directory]
+        print(f"👀 Vigilando también {directory} ({self.mode})")
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.inotify:
+            self.inotify.close()
+    
+    def scan(self) -> Dict[str, tuple]:
+        """Tamaño y mtime de los PDFs de los directorios vigilados"""
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(".pdf") and entry.is_file():
+                            stat = entry.stat()
+                            snapshot[os.path.join(directory, entry.name)] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                continue
+        return snapshot
+    
+    def collect(self) -> List[str]:
+        """Rutas de PDFs con cambios desde la llamada anterior"""
+        if self.inotify:
+            paths = self.inotify.read(timeout=min(self.debounce / 2, 1.0))
+            return [path for path in paths if path.lower().endswith(".pdf")]
+        self.stop_event.wait(min(self.poll_interval, self.debounce) if self.pending else self.poll_interval)
+        current = self.scan()
+        changed = [path for path, signature in current.items() if self.snapshot.get(path) != signature]
+        changed += [path for path in self.snapshot if path not in current]
+        self.snapshot = current
+        return changed
+    
+    @staticmethod
+    def file_size(path: str) -> Optional[int]:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+    
+    @staticmethod
+    def is_complete_pdf(path: str) -> bool:
+        """El PDF termina con el marcador %%EOF (los escritores lo añaden al final)"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(max(0, os.path.getsize(path) - 2048))
+                return b"%%EOF" in f.read()
+        except OSError:
+            return False
+    
+    def ready_paths(self) -> List[str]:
+        """Rutas sin eventos durante el debounce con archivos estables (o ya borrados)"""
+        now = time.monotonic()
+        ready = []
+        for path, (first, last, size) in list(self.pending.items()):
+            if now - last < self.debounce:
+                continue
+            current = self.file_size(path)
+            stable = current is None or (current == size and self.is_complete_pdf(path))
+            if stable or now - first > self.MAX_WAIT:
+                ready.append(path)
+                del self.pending[path]
+            else:
+                # Sigue escribiéndose: esperar otro intervalo de debounce
+                self.pending[path] = (first, now, current)
+        return ready
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                now = time.monotonic()
+                for path in self.collect():
+                    first = self.pending[path][0] if path in self.pending else now
+                    self.pending[path] = (first, now, self.file_size(path))
+                ready = self.ready_paths()
+                if ready:
+                    self.on_changes(ready)
+            except Exception as e:
+                print(f"⚠️ Error en el vigilante de directorios: {e}")
+                self.stop_event.wait(self.poll_interval)
+
+class JobCancelled(Exception):
+    """La tarea en segundo plano se canceló desde la interfaz"""
+
+class Job:
+    """Operación larga (sincronización, carga) con progreso, ETA y cancelación cooperativa.
+    
+    El trabajo comprueba `cancelled` entre documentos: lo que está en curso termina y
+    se conserva. `advance` se puede llamar desde hilos (descargas en paralelo).
+    """
+    
+    def __init__(self, kind: str, description: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.kind = kind
+        self.description = description
+        self.status = 'en_curso'
+        self.stage = ''
+        self.done = 0
+        self.total = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stage_started = time.monotonic()
+        self.result = ''
+        self.task = None
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+    
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+    
+    def start_stage(self, stage: str, total: int = 0):
+        with self.lock:
+            self.stage, self.done, self.total = stage, 0, total
+            self.stage_started = time.monotonic()
+    
+    def advance(self, count: int = 1):
+        with self.lock:
+            self.done += count
+    
+    def finish(self, status: str, result: str):
+        self.status, self.result, self.finished_at = status, result, time.time()
+    
+    def progress(self) -> str:
+        """Línea de estado: etapa, documentos hechos, ritmo y tiempo restante estimado"""
+        elapsed = time.time() - self.started_at
+        if self.status != 'en_curso':
+            icon = {'completado': '✅', 'cancelado': '⏹️', 'error': '❌', 'interrumpido': '⚠️'}.get(self.status, '•')
+            end = self.finished_at or time.time()
+            return f"{icon} {self.description}: {self.status} ({format_duration(end - self.started_at)})"
+        line = f"⏳ {self.description} · {self.stage or 'preparando'}"
+        if self.cancelled:
+            line += " · cancelando (terminando lo que está en curso)..."
+        if self.total:
+            line += f": {self.done}/{self.total} ({100 * self.done / self.total:.0f}%)"
+            stage_elapsed = time.monotonic() - self.stage_started
+            rate = self.done / stage_elapsed if stage_elapsed > 0 else 0.0
+            if rate > 0:
+                line += f" · {rate:.1f}/s · ETA {format_duration((self.total - self.done) / rate)}"
+        return line + f" · {format_duration(elapsed)} transcurridos"
+    
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id, 'kind': self.kind, 'description': self.description, 'status': self.status,
+            'stage': self.stage, 'done': self.done, 'total': self.total,
+            'started_at': self.started_at, 'finished_at': self.finished_at,
+        }
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+class JobManager:
+    """Tareas en segundo plano en el event loop del servidor, con historial en disco.
+    
+    Las tareas siguen aunque se cierre la pestaña del navegador. Si el proceso muere,
+    al arrancar se marcan como interrumpidas; una nueva carga retoma desde el último
+    punto de guardado (y la caché de etapas evita repetir parseo y embeddings).
+    """
+    HISTORY = 20
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.jobs = []
+        self.interrupted = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                previous = json.load(f)
+            for entry in previous:
+                if entry['status'] == 'en_curso':
+                    entry['status'] = 'interrumpido'
+                    self.interrupted.append(entry)
+            self.history = previous[-self.HISTORY:]
+        except (OSError, ValueError, KeyError):
+            self.history = []
+    
+    def running(self, kind: str) -> Optional[Job]:
+        return next((job for job in self.jobs if job.kind == kind and job.status == 'en_curso'), None)
+    
+    def start(self, kind: str, description: str, work) -> Job:
+        """Lanzar `work(job)` (corrutina) si no hay otra tarea del mismo tipo en curso"""
+        job = self.running(kind)
+        if job:
+            return job
+        job = Job(kind, description)
+        # Historial acotado, sin perder de vista las tareas que siguen en curso
+        self.jobs = [j for j in self.jobs[:-self.HISTORY] if j.status == 'en_curso'] + self.jobs[-self.HISTORY:]
+        self.jobs.append(job)
+        self.interrupted = [entry for entry in self.interrupted if entry['kind'] != kind]
+        
+        async def run():
+            try:
+                result = await work(job)
+                job.finish('cancelado' if job.cancelled else 'completado', result)
+            except JobCancelled:
+                job.finish('cancelado', f"⏹️ {job.description} cancelada")
+            except Exception as e:
+                job.finish('error', f"❌ Error: {str(e)}")
+            finally:
+                self.save()
+        
+        job.task = asyncio.get_running_loop().create_task(run())
+        self.save()
+        return job
+    
+    def cancel(self, kind: str) -> str:
+        job = self.running(kind)
+        if job is None:
+            return "ℹ️ No hay ninguna tarea de ese tipo en curso"
+        job.cancel_event.set()
+        return f"⏹️ Cancelando: {job.description} (lo ya procesado se conserva)"
+    
+    def latest(self, kind: str) -> Optional[Job]:
+        return next((job for job in reversed(self.jobs) if job.kind == kind), None)
+    
+    def status(self, kind: str) -> str:
+        """Progreso de la tarea en curso, resultado de la última o aviso de una interrumpida"""
+        job = self.latest(kind)
+        if job:
+            return job.progress() if job.status == 'en_curso' else job.result
+        for entry in self.interrupted:
+            if entry['kind'] == kind:
+                done = f" en {entry['stage']} ({entry['done']}/{entry['total']})" if entry.get('total') else ""
+                return f"⚠️ {entry['description']} se interrumpió{done}. Vuelve a lanzarla para continuar donde se quedó."
+        return ""
+    
+    def save(self):
+        """Guardar el historial (al empezar, al terminar y en cada punto de guardado)"""
+        entries = self.history + [job.to_dict() for job in self.jobs]
+        try:
+            tmp = self.path.with_suffix('.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entries[-self.HISTORY:], f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el historial de tareas: {e}")
+
+class DedupRegistry:
+    """Deduplicación entre bibliotecas: consulta las firmas MinHash de todos los shards.
+    
+    Cada shard conserva sus firmas en memoria aunque su índice esté descargado (unos cientos
+    de bytes por documento), así que un PDF que ya está indexado en otra biblioteca, idéntico
+    o casi, no se vuelve a embeber: su entrada del manifiesto apunta al documento del otro shard.
+    """
+    
+    def __init__(self, shards):
+        self.shards = shards  # Callable → shards actuales (el diccionario cambia al detectar grupos)
+    
+    def owner(self, dockey: str) -> Optional["LibraryShard"]:
+        """Shard que tiene indexado el documento"""
+        return next((shard for shard in self.shards().values() if shard.holds_signature(dockey)), None)
+    
+    def find(self, signature, exclude=()) -> Optional[tuple]:
+        """Documento más parecido de cualquier biblioteca: (shard, dockey, similitud) o None"""
+        best = None
+        for shard in self.shards().values():
+            if shard.near_duplicates is None:
+                continue
+            match = shard.near_duplicates.find(signature, exclude)
+            if match and (best is None or match[1] > best[2]):
+                best = (shard, *match)
+        return best
+    
+    def linked_metadata(self, dockey: str, exclude: str) -> List[Dict]:
+        """Metadatos Zotero que otras bibliotecas aportan a un documento (sus copias apuntan a él)"""
+        return [
+            shard.linked[dockey] for shard in self.shards().values()
+            if shard.id != exclude and dockey in shard.linked
+        ]
+
+class LibraryShard:
+    """Una biblioteca indexada por separado: la personal de Zotero, un grupo de Zotero o la carpeta local.
+    
+    Cada shard guarda en su directorio su índice Paper-QA, manifiesto, BM25, firmas MinHash
+    y embeddings, y las bibliotecas Zotero tienen además su almacén de metadatos. El índice
+    solo ocupa memoria mientras está cargado (load); unload lo libera y el resumen guardado
+    (documentos, etiquetas, versión) sigue describiendo la biblioteca.
+    """
+    
+    def __init__(self, shard_id: str, kind: str, name: str, library: str = None, stage_cache=None,
+                 registry: DedupRegistry = None):
+        self.id = shard_id
+        self.kind = kind  # 'personal', 'grupo' o 'local'
+        self.name = name
+        self.library = library  # Prefijo de la API Zotero: users/<id> o groups/<id>
+        self.source = 'local' if kind == 'local' else 'zotero'
+        if kind == 'local':
+            self.papers_dir = Path(LOCAL_PAPERS_DIR)
+        elif kind == 'personal':
+            self.papers_dir = Path(PAPERS_DIR)
+        else:
+            self.papers_dir = Path(PAPERS_DIR) / shard_id
+        self.papers_dir.mkdir(parents=True, exist_ok=True)
+        self.index_dir = Path(SHARDS_DIR) / shard_id
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.index_dir / "docs.pkl"
+        self.manifest_path = self.index_dir / "manifest.json"
+        self.lexical_path = self.index_dir / "lexical.pkl"
+        self.near_duplicates_path = self.index_dir / "minhash.pkl"
+        self.vectors_dir = self.index_dir / "vectors"
+        self.summary_path = self.index_dir / "summary.json"
+        self.stage_cache = stage_cache
+        # Sin registro compartido, el shard solo se deduplica contra sí mismo
+        self.registry = registry or DedupRegistry(lambda: {self.id: self})
+        if self.source == 'zotero':
+            # La biblioteca personal conserva su base de metadatos (y su estado de sincronización)
+            self.store = ZoteroMetadataStore(METADATA_DB if kind == 'personal' else str(self.index_dir / "zotero_metadata.sqlite"))
+            self.collections = self.store.collections()
+        else:
+            self.store = None
+            self.collections = {}
+        self.summary = self.load_summary()
+        # Firmas MinHash (load_signatures) y metadatos aportados a documentos de otros shards:
+        # se conservan aunque el índice se descargue, para deduplicar entre bibliotecas
+        self.near_duplicates = None
+        self.linked = self.summary.get('linked', {})  # dockey de otro shard → metadatos de la copia
+        # Estado en memoria, solo mientras el shard está cargado
+        self.loaded = False
+        self.docs = None
+        self.manifest = {}
+        self.lexical = None
+        self.items_metadata = {}
+        self.sources = {}
+        self.collection_index = defaultdict(set)
+        self.tag_index = defaultdict(set)
+        self.index_version = self.summary.get('version', "")
+        self.index_needs_save = False
+        self.last_checkpoint = time.monotonic()
+        self.load_lock = threading.Lock()
+        self.users = 0  # Consultas y cargas que lo están usando: no se descarga mientras tanto
+        self.last_used = 0.0
+    
+    def load_summary(self) -> Dict:
+        try:
+            with open(self.summary_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def stats(self) -> Dict:
+        """Documentos, fragmentos, archivos, etiquetas y versión (del índice cargado o del último guardado)"""
+        if not self.loaded:
+            return self.summary
+        return {
+            'documents': len(self.docs.docs),
+            'chunks': len(self.docs.texts),
+            'files': len(self.manifest),
+            'tags': self.tag_names(),
+            'version': self.index_version,
+            'linked': self.linked,
+        }
+    
+    def load(self):
+        """Cargar el índice en memoria (una sola vez aunque lo pidan varias tareas a la vez)"""
+        with self.load_lock:
+            if self.loaded:
+                return
+            with track("shard_load", library=self.id) as event:
+                self.docs, self.manifest = self.load_index()
+                self.lexical = self.load_lexical_index()
+                self.near_duplicates = self.load_near_duplicates()
+                self.items_metadata = self.store.linked_metadata() if self.store else {}
+                self.refresh_sources()
+                # Metadatos sincronizados mientras el shard no estaba en memoria
+                if self.apply_zotero_citations():
+                    self.update_index_version()
+                    self.index_needs_save = True
+                if self.index_needs_save:
+                    self.save_index()
+                    self.index_needs_save = False
+                self.loaded = True
+                event['documents'] = len(self.docs.docs)
+    
+    def unload(self) -> bool:
+        """Liberar la memoria del índice (se vuelve a cargar al usarlo)"""
+        with self.load_lock:
+            if not self.loaded or self.users:
+                return False
+            self.summary = self.stats()
+            self.loaded = False
+            self.docs = None
+            self.manifest = {}
+            self.lexical = None
+            self.items_metadata = {}
+            self.sources = {}
+            self.collection_index = defaultdict(set)
+            self.tag_index = defaultdict(set)
+        print(f"💤 {self.name} descargada de memoria")
+        return True
+    
+    def new_docs(self):
+        """Crear un índice Paper-QA vacío (embeddings en archivos mapeados en memoria)"""
+        from paperqa import Docs
+        from papermind_vectors import MmapVectorStore
+        texts_index = MmapVectorStore(dtype=VECTOR_DTYPE).attach(self.vectors_dir, fresh=True)
+        return Docs(llm="gpt-4o-mini", summary_llm="gpt-4o-mini", texts_index=texts_index)
+    
+    def attach_vector_store(self, docs):
+        """Conectar el almacén vectorial del índice cargado con sus archivos.
+        
+        Los índices guardados con el almacén en memoria de Paper-QA se migran una vez
+        (sus vectores pasan al archivo y dejan de ocupar RAM en cada Text).
+        """
+        from papermind_vectors import MmapVectorStore
+        store = docs.texts_index
+        if isinstance(store, MmapVectorStore):
+            store.attach(self.vectors_dir)
+            if store.dtype != VECTOR_DTYPE:
+                print(f"🔁 Convirtiendo embeddings de {store.dtype} a {VECTOR_DTYPE}...")
+                store = store.astype(VECTOR_DTYPE)
+        else:
+            print(f"🔁 Migrando {len(docs.texts)} embeddings a {self.vectors_dir}...")
+            store = MmapVectorStore(embedding_model=store.embedding_model, mmr_lambda=store.mmr_lambda, dtype=VECTOR_DTYPE)
+            store.attach(self.vectors_dir, fresh=True)
+            # Solo los fragmentos vigentes (como tras rebuild_vector_indexes)
+            store.add_texts_and_embeddings(docs.texts)
+        migrated = store is not docs.texts_index
+        docs.texts_index = store
+        return migrated
+    
+    def load_index(self):
+        """Cargar índice Paper-QA y manifiesto guardados en disco"""
+        if self.index_path.exists() and self.manifest_path.exists():
+            try:
+                with open(self.index_path, 'rb') as f:
+                    docs = pickle.load(f)
+                # Los clientes OpenAI no se serializan: recrearlos
+                docs.set_client()
+                # Tras migrar o convertir los embeddings hay que guardar el índice
+                self.index_needs_save = self.attach_vector_store(docs)
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f).get('files', {})
+                print(f"💾 Índice cargado ({self.name}): {len(docs.docs)} documentos, {len(manifest)} archivos")
+                return docs, manifest
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el índice guardado, se crea uno nuevo: {e}")
+        return self.new_docs(), {}
+    
+    def save_index(self):
+        """Guardar índice Paper-QA y manifiesto (escritura atómica)"""
+        # Las filas nuevas de embeddings deben estar en disco antes que el índice que las referencia
+        self.docs.texts_index.flush()
+        tmp_index = self.index_path.with_suffix('.pkl.tmp')
+        with open(tmp_index, 'wb') as f:
+            pickle.dump(self.docs, f)
+        os.replace(tmp_index, self.index_path)
+        self.docs.texts_index.remove_stale()
+        
+        tmp_manifest = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': self.manifest}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_manifest, self.manifest_path)
+        
+        tmp_lexical = self.lexical_path.with_suffix('.pkl.tmp')
+        with open(tmp_lexical, 'wb') as f:
+            pickle.dump(self.lexical, f)
+        os.replace(tmp_lexical, self.lexical_path)
+        
+        tmp_near_duplicates = self.near_duplicates_path.with_suffix('.pkl.tmp')
+        with open(tmp_near_duplicates, 'wb') as f:
+            pickle.dump(self.near_duplicates, f)
+        os.replace(tmp_near_duplicates, self.near_duplicates_path)
+        
+        # Resumen pequeño para describir el shard sin cargarlo (interfaz, versión de caché)
+        self.summary = self.stats()
+        tmp_summary = self.summary_path.with_suffix('.json.tmp')
+        with open(tmp_summary, 'w', encoding='utf-8') as f:
+            json.dump(self.summary, f, ensure_ascii=False)
+        os.replace(tmp_summary, self.summary_path)
+    
+    def load_lexical_index(self) -> Bm25Index:
+        """Cargar el índice BM25 guardado o reconstruirlo a partir de los fragmentos"""
+        if self.lexical_path.exists():
+            try:
+                with open(self.lexical_path, 'rb') as f:
+                    lexical = pickle.load(f)
+                if lexical.dockeys() == set(self.docs.docs):
+                    return lexical
+            except Exception as e:
+                print(f"⚠️ No se pudo cargar el índice BM25, se reconstruye: {e}")
+        lexical = Bm25Index()
+        lexical.add_texts(self.docs.texts)
+        return lexical
+    
+    def load_signatures(self):
+        """Leer las firmas MinHash guardadas sin cargar el índice (deduplicación entre shards)"""
+        from papermind_dedup import MinHashIndex
+        if self.near_duplicates is not None:
+            return
+        near_duplicates = MinHashIndex(DEDUP_THRESHOLD)
+        if self.near_duplicates_path.exists():
+            try:
+                with open(self.near_duplicates_path, 'rb') as f:
+                    near_duplicates = pickle.load(f)
+                near_duplicates.threshold = DEDUP_THRESHOLD
+            except Exception as e:
+                print(f"⚠️ No se pudieron leer las firmas MinHash de {self.name}: {e}")
+        self.near_duplicates = near_duplicates
+    
+    def holds_signature(self, dockey: str) -> bool:
+        return self.near_duplicates is not None and dockey in self.near_duplicates.signatures
+    
+    def holds(self, entry: Dict) -> bool:
+        """Si sigue indexado el documento de una entrada del manifiesto (en este shard o en el que apunta)"""
+        if 'shard' not in entry:
+            return manifest_dockey(entry) in self.docs.docs
+        owner = self.registry.shards().get(entry['shard'])
+        return owner is not None and owner.holds_signature(manifest_dockey(entry))
+    
+    def owner_of(self, dockey: str) -> Optional["LibraryShard"]:
+        """Shard que tiene indexado un documento, empezando por este"""
+        return self if self.holds_signature(dockey) else self.registry.owner(dockey)
+    
+    def load_near_duplicates(self):
+        """Firmas MinHash del índice cargado: las guardadas si coinciden con sus documentos o recalculadas"""
+        from papermind_dedup import MinHashIndex
+        self.load_signatures()
+        if self.near_duplicates.dockeys() == set(self.docs.docs):
+            return self.near_duplicates
+        near_duplicates = MinHashIndex(DEDUP_THRESHOLD)
+        near_duplicates.add_texts(self.docs.texts)
+        # Recalcularlas cuesta una pasada por todo el texto: se guardan al terminar la carga
+        self.index_needs_save = self.index_needs_save or bool(self.docs.docs)
+        return near_duplicates
+    
+    def refresh_sources(self):
+        """Mapa dockey (hash del PDF) → (origen, metadatos Zotero, ruta) para atribuir fuentes"""
+        self.refresh_linked()
+        copies = defaultdict(list)
+        for path, entry in self.manifest.items():
+            if 'shard' not in entry:
+                copies[manifest_dockey(entry)].append((entry['source'], self.items_metadata.get(path, {}), path))
+        sources = {}
+        for dockey, entries in copies.items():
+            # Con copias duplicadas se prefiere la que tiene metadatos Zotero, completados con los de las demás
+            # y con los de las copias de otras bibliotecas
+            source, metadata, path = max(entries, key=lambda copy: (bool(copy[1]), copy[0] == 'zotero'))
+            shared = self.registry.linked_metadata(dockey, exclude=self.id)
+            sources[dockey] = (source, merge_metadata([copy[1] for copy in entries] + shared), path)
+        self.sources = sources
+        self.update_index_version()
+        metrics.set("papermind_index_documents", len(self.docs.docs), library=self.id)
+        metrics.set("papermind_index_chunks", len(self.docs.texts), library=self.id)
+        
+        # Índices colección/etiqueta → dockeys para filtrar antes de recuperar
+        self.collection_index = defaultdict(set)
+        self.tag_index = defaultdict(set)
+        for dockey, (source, metadata, path) in sources.items():
+            for collection_key in metadata.get('collections', []):
+                self.collection_index[collection_key].add(dockey)
+            for tag in metadata.get('tags', []):
+                self.tag_index[tag].add(dockey)
+    
+    def refresh_linked(self):
+        """Metadatos de las copias cuyo documento está indexado en otra biblioteca (se aportan a ese shard)"""
+        linked = defaultdict(list)
+        for path, entry in self.manifest.items():
+            if 'shard' in entry:
+                linked[manifest_dockey(entry)].append(self.items_metadata.get(path, {}))
+        self.linked = {dockey: merge_metadata(copies) for dockey, copies in linked.items()}
+    
+    def update_index_version(self):
+        """Versión del shard: cambia al añadir o quitar documentos o al cambiar sus citaciones"""
+        digest = hashlib.md5()
+        for dockey in sorted(self.docs.docs):
+            digest.update(dockey.encode())
+            digest.update(self.docs.docs[dockey].citation.encode('utf-8'))
+        # Las consultas también recorren los documentos de otras bibliotecas enlazados desde este shard
+        for dockey in sorted(self.linked):
+            digest.update(f"→{dockey}".encode())
+        self.index_version = digest.hexdigest()
+    
+    def tag_names(self) -> List[str]:
+        """Etiquetas presentes en los documentos indexados y en las copias enlazadas a otras bibliotecas"""
+        tags = {tag for tag, dockeys in self.tag_index.items() if dockeys}
+        tags.update(tag for metadata in self.linked.values() for tag in metadata.get('tags', []))
+        return sorted(tags)
+    
+    def filter_dockeys(self, collection_filter: str = None, tag_filter: str = None) -> Optional[set]:
+        """Documentos que cumplen los filtros (None si no hay filtros)"""
+        dockeys = None
+        if collection_filter:
+            # El nombre se resuelve en todas las bibliotecas: las copias enlazadas aportan sus colecciones
+            collection_keys = {
+                shard.collections[collection_filter] for shard in self.registry.shards().values()
+                if collection_filter in shard.collections
+            } or {collection_filter}
+            dockeys = set().union(*(self.collection_index.get(key, ()) for key in collection_keys))
+        if tag_filter:
+            tagged = self.tag_index.get(tag_filter, set())
+            dockeys = set(tagged) if dockeys is None else dockeys & tagged
+        if dockeys is not None:
+            dockeys &= self.docs.docs.keys()
+        return dockeys
+    
+    def scoped_docs(self, dockeys: set):
+        """Vista del índice restringida a un subconjunto de documentos.
+        
+        La búsqueda vectorial y los resúmenes de evidencia solo ven esos fragmentos.
+        """
+        texts = [t for t in self.docs.texts if t.doc.dockey in dockeys]
+        texts_index = self.docs.texts_index.view(texts)
+        return self.docs.model_copy(update={'texts': texts, 'texts_index': texts_index})
+    
+    def query_scope(self, collection_filter: str = None, tag_filter: str = None, within: set = None):
+        """Índice del shard a consultar según los filtros: (docs, dockeys candidatos, key_filter).
+        
+        `within` limita la consulta a esos documentos (los que otras bibliotecas enlazan).
+        """
+        dockeys = self.filter_dockeys(collection_filter, tag_filter)
+        if within is not None:
+            dockeys = (dockeys if dockeys is not None else set(self.docs.docs)) & within
+        if dockeys is None:
+            return self.docs, None, None
+        # Con filtros la vista ya está acotada: no hace falta preseleccionar documentos
+        return self.scoped_docs(dockeys), dockeys, False
+    
+    async def hybrid_candidates(self, docs, question: str, dockeys: set = None) -> list:
+        """Fragmentos a resumir: fusión por rangos recíprocos de BM25 y similitud vectorial"""
+        vector_texts, _ = await docs.texts_index.similarity_search(docs._embedding_client, question, HYBRID_FETCH_K)
+        lexical = self.lexical.search(question, HYBRID_FETCH_K, dockeys)
+        
+        scores = defaultdict(float)
+        for rank, text in enumerate(vector_texts):
+            scores[text.name] += 1 / (RRF_K + rank + 1)
+        for rank, (name, _) in enumerate(lexical):
+            scores[name] += 1 / (RRF_K + rank + 1)
+        
+        by_name = {text.name: text for text in vector_texts}
+        missing = {name for name, _ in lexical} - by_name.keys()
+        if missing:
+            by_name.update((text.name, text) for text in docs.texts if text.name in missing)
+        ranked = [by_name[name] for name in sorted(scores, key=scores.get, reverse=True) if name in by_name]
+        return [text for text in ranked if text.doc.dockey not in docs.deleted_dockeys][:PREFILTER_K]
+    
+    async def vector_candidates(self, docs, question: str, dockey_filter: set = None, k: int = 10) -> list:
+        """Fragmentos que recuperaría Paper-QA (MMR vectorial, como aget_evidence) sin resumirlos"""
+        # Con filtro de documentos se piden más para poder descartar, como hace Paper-QA
+        fetch_k = k * 10 if dockey_filter is not None else k
+        matches, _ = await docs.texts_index.max_marginal_relevance_search(
+            docs._embedding_client, question, k=fetch_k, fetch_k=5 * fetch_k
+        )
+        return [
+            text for text in matches
+            if (dockey_filter is None or text.doc.dockey in dockey_filter) and text.doc.dockey not in docs.deleted_dockeys
+        ][:k]
+    
+    def zotero_citation(self, metadata: Dict, fallback: str) -> str:
+        """Citación a partir de los metadatos Zotero"""
+        return f"{', '.join(metadata.get('authors', [])[:3])} ({metadata.get('year', 'S/F')}). {metadata.get('title', fallback)}"
+    
+    def apply_zotero_citations(self) -> int:
+        """Actualizar la citación de documentos ya indexados que ahora tienen metadatos Zotero"""
+        updated = 0
+        for dockey, (source, metadata, path) in self.sources.items():
+            doc = self.docs.docs.get(dockey)
+            if doc is None or not metadata:
+                continue
+            citation = self.zotero_citation(metadata, Path(path).name)
+            if doc.citation != citation:
+                # Los fragmentos comparten el objeto Doc, así que heredan la citación
+                doc.citation = citation
+                updated += 1
+        return updated
+    
+    def file_hash(self, pdf_file: Path) -> str:
+        """Hash MD5 del contenido (reutiliza el del manifiesto si tamaño y mtime no cambiaron)"""
+        stat = pdf_file.stat()
+        entry = self.manifest.get(str(pdf_file))
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime_ns:
+            return entry['hash']
+        return file_md5(pdf_file)
+    
+    def remove_from_index(self, dockey: str):
+        """Eliminar un documento del índice si ningún archivo del manifiesto lo referencia"""
+        if any(manifest_dockey(entry) == dockey for entry in self.manifest.values()):
+            return False
+        doc = self.docs.docs.get(dockey)
+        if doc is None:
+            return False
+        self.docs.delete(dockey=dockey)
+        self.docs.docnames.discard(doc.docname)
+        self.lexical.remove_dockey(dockey)
+        self.near_duplicates.remove(dockey)
+        return True
+    
+    def rebuild_vector_indexes(self):
+        """Reconstruir los índices vectoriales tras eliminar documentos"""
+        # Los embeddings de fragmentos solo están en el archivo: se compacta sin re-embeber
+        self.docs.texts_index.compact(self.docs.texts)
+        self.docs.docs_index.clear()
+        self.docs.docs_index.add_texts_and_embeddings(list(self.docs.docs.values()))
+        # Ya no quedan textos borrados en los índices; permite re-añadir esas claves
+        self.docs.deleted_dockeys.clear()
+    
+    async def generate_citation(self, first_chunk: str, pdf_file: Path) -> str:
+        """Generar la citación con el LLM a partir del primer fragmento (como Paper-QA)"""
+        cite_chain = self.docs.llm_model.make_chain(
+            client=self.docs._client,
+            prompt=self.docs.prompts.cite,
+            skip_system=True
+        )
+        result = await cite_chain({"text": first_chunk}, None)
+        record_llm_usage(result.model, result.prompt_count, result.completion_count)
+        citation = result.text
+        if len(citation) < 3 or "Unknown" in citation or "insufficient" in citation:
+            citation = f"Unknown, {pdf_file.name}, {time.strftime('%Y')}"
+        return citation
+    
+    async def add_pdf(self, pdf_file: Path, citation: Optional[str], dockey: str, pool=None, replaces: str = None) -> Optional[str]:
+        """Parsear (en el pool de procesos), trocear y embeber un PDF.
+        
+        Antes de generar la citación y los embeddings se busca un documento ya indexado
+        (o indexándose) con el mismo contenido o casi (MinHash); si lo hay, no se embebe
+        y se devuelve su dockey. `replaces` es la versión anterior del mismo archivo,
+        que no cuenta como duplicado. Devuelve None si el PDF se añadió.
+        """
+        from paperqa import Doc, Text
+        from paperqa.utils import maybe_is_text
+        from papermind_dedup import minhash_signature
+        chunks = await self.extract_chunks(pdf_file, dockey, pool)
+        if not chunks or len(chunks[0][1]) < 10 or not maybe_is_text(chunks[0][1]):
+            raise ValueError(f"No parece un documento de texto: {pdf_file.name}")
+        
+        with track("dedup", file=pdf_file.name) as event:
+            # Mismo troceado que el índice: la firma coincide con la que se recalcularía desde los fragmentos
+            signature = await asyncio.to_thread(minhash_signature, " ".join(text for _, text in chunks))
+            # Se busca en todas las bibliotecas: un PDF indexado en otro shard tampoco se embebe
+            match = self.registry.find(signature, exclude={replaces} if replaces else ())
+            if match:
+                event['duplicate_of'], event['similarity'] = match[1], round(match[2], 3)
+                if match[0] is not self:
+                    event['library'] = match[0].id
+                return match[1]
+            # Se registra ya: otra copia que llegue mientras se embebe esta la encontrará
+            self.near_duplicates.add(dockey, signature)
+        
+        try:
+            chunk_key = f"{dockey}:{CHUNK_CHARS}:{CHUNK_OVERLAP}"
+            if citation is None:
+                cache_key = f"{chunk_key}:{self.docs.llm}"
+                citation = await self.stage_cache.aget_json("citation", cache_key)
+                if citation is None:
+                    with track("citation", file=pdf_file.name):
+                        citation = await self.generate_citation(chunks[0][1], pdf_file)
+                    await self.stage_cache.aput_json("citation", cache_key, citation)
+            
+            doc = Doc(docname=self.docs._get_unique_name(make_docname(citation)), citation=citation, dockey=dockey)
+            texts = [Text(text=text, name=f"{doc.docname} pages {pages}", doc=doc) for pages, text in chunks]
+            
+            # Los embeddings de cada documento se piden en paralelo con los demás;
+            # con embeddings ya calculados para estos fragmentos y este modelo, Paper-QA no los pide
+            embedded = await self.embed_chunks(texts, f"{chunk_key}:{self.docs.texts_index.embedding_model.name}", pdf_file)
+            added = await self.docs.aadd_texts(texts, doc)
+        except BaseException:
+            self.near_duplicates.remove(dockey)
+            raise
+        if not added:
+            return dockey
+        if embedded:
+            # Aproximación de tokens de embeddings (~4 caracteres por token)
+            record_llm_usage(self.docs.texts_index.embedding_model.name, sum(len(t.text) for t in texts) // 4, kind="embedding")
+        self.lexical.add_texts(texts)
+        return None
+    
+    async def extract_chunks(self, pdf_file: Path, file_hash: str, pool=None) -> List[List[str]]:
+        """Fragmentos [[páginas, texto]] del PDF, reutilizando el texto extraído y el troceado en caché"""
+        chunk_key = f"{file_hash}:{CHUNK_CHARS}:{CHUNK_OVERLAP}"
+        chunks = await self.stage_cache.aget_json("chunks", chunk_key)
+        if chunks is not None:
+            return chunks
+        pages = await self.stage_cache.aget_json("pages", file_hash)
+        if pages is None:
+            loop = asyncio.get_running_loop()
+            with track("parse", file=pdf_file.name):
+                pages = await loop.run_in_executor(pool, parse_pdf_pages, str(pdf_file))
+            await self.stage_cache.aput_json("pages", file_hash, pages)
+        with track("chunk", file=pdf_file.name) as event:
+            chunks = await asyncio.to_thread(chunk_pages, pages)
+            event['chunks'] = len(chunks)
+        await self.stage_cache.aput_json("chunks", chunk_key, chunks)
+        return chunks
+    
+    async def embed_chunks(self, texts: list, cache_key: str, pdf_file: Path) -> bool:
+        """Asignar a los fragmentos sus embeddings (de la caché o pidiéndolos); True si se pidieron"""
+        import numpy as np
+        data = await self.stage_cache.aget("embeddings", cache_key)
+        if data is not None:
+            vectors = np.frombuffer(data, dtype=np.float32).reshape(len(texts), -1)
+            embedded = False
+        else:
+            with track("embed", file=pdf_file.name, chunks=len(texts)):
+                vectors = np.asarray(await self.docs.texts_index.embedding_model.embed_documents(
+                    self.docs._embedding_client, texts=[t.text for t in texts]
+                ), dtype=np.float32)
+            await self.stage_cache.aput("embeddings", cache_key, vectors.tobytes())
+            embedded = True
+        for text, vector in zip(texts, vectors):
+            text.embedding = vector.tolist()
+        return embedded
+    
+    def file_citation(self, pdf_file: Path):
+        """Citación (None = generarla con el LLM) y texto a mostrar para un PDF"""
+        if self.source == 'zotero':
+            # Obtener metadatos enriquecidos de Zotero
+            metadata = self.items_metadata.get(str(pdf_file), {})
+            
+            if metadata:
+                return self.zotero_citation(metadata, pdf_file.name), f"→ {metadata.get('title', pdf_file.name)[:50]}..."
+            return None, f"→ {pdf_file.name[:50]}..."
+        # Cargar paper local con identificación clara
+        return f"Documento Local: {pdf_file.stem}", "[PAPEL LOCAL]"
+    
+    async def index_pdf(self, pdf_file: Path, citation: Optional[str], pool=None) -> str:
+        """Indexar un PDF solo si es nuevo o cambió su contenido.
+        
+        Devuelve 'nuevo', 'actualizado', 'sin_cambios', 'duplicado' o 'casi_duplicado'.
+        """
+        path = str(pdf_file)
+        file_hash = await asyncio.to_thread(self.file_hash, pdf_file)
+        entry = self.manifest.get(path)
+        
+        if entry and entry['hash'] == file_hash and self.holds(entry):
+            return 'sin_cambios'
+        
+        dockey = file_hash
+        if file_hash in self.docs.docs or self.registry.owner(file_hash):
+            # Mismo contenido ya indexado desde otro archivo (de esta biblioteca o de otra)
+            status = 'duplicado'
+        else:
+            # La versión anterior del propio archivo no cuenta como duplicado: se sustituye
+            canonical = await self.add_pdf(pdf_file, citation, file_hash, pool, replaces=entry['hash'] if entry else None)
+            if canonical is None:
+                status = 'actualizado' if entry else 'nuevo'
+            elif canonical == file_hash:
+                status = 'duplicado'
+            else:
+                # Otra versión del mismo trabajo (p. ej. preprint y publicado): se reutiliza su documento
+                status, dockey = 'casi_duplicado', canonical
+                print(f"🪞 {pdf_file.name} es casi idéntico a un documento ya indexado: no se embebe")
+        
+        stat = pdf_file.stat()
+        self.manifest[path] = {
+            'hash': file_hash,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'source': self.source
+        }
+        if dockey != file_hash:
+            self.manifest[path]['dockey'] = dockey
+        owner = self.owner_of(dockey)
+        if owner is not None and owner is not self:
+            self.manifest[path]['shard'] = owner.id
+        if entry and manifest_dockey(entry) != dockey:
+            self.remove_from_index(manifest_dockey(entry))
+        return status
+        
+    def attachment_path(self, attachment: Dict) -> Path:
+        """Ruta local estable de un adjunto (la clave evita colisiones de nombre)"""
+        stem = Path(attachment['filename']).stem[:80]
+        return self.papers_dir / clean_filename(f"{stem}_{attachment['key']}.pdf")
+    
+    def checkpoint(self, on_checkpoint=None):
+        """Guardar el índice a mitad de una carga larga (como mucho cada CHECKPOINT_SECONDS)"""
+        if time.monotonic() - self.last_checkpoint < CHECKPOINT_SECONDS:
+            return
+        with track("checkpoint", library=self.id, documents=len(self.docs.docs)):
+            self.save_index()
+        self.last_checkpoint = time.monotonic()
+        if on_checkpoint:
+            on_checkpoint()
+    
+    def remove_orphans(self) -> int:
+        """Quitar documentos que ningún archivo del manifiesto referencia (carga interrumpida tras un guardado)"""
+        referenced = {manifest_dockey(entry) for entry in self.manifest.values()}
+        orphans = [dockey for dockey in self.docs.docs if dockey not in referenced]
+        for dockey in orphans:
+            self.remove_from_index(dockey)
+        return len(orphans)
+    
+    async def update_from_disk(self, files: List[Path], pool, job: Job = None, on_checkpoint=None):
+        """Sincronizar el índice del shard con sus PDFs en disco.
+        
+        Solo se procesan archivos nuevos o modificados; los eliminados se quitan del índice.
+        El índice se guarda periódicamente: si el proceso muere, la siguiente carga continúa
+        desde el último guardado (y la caché de etapas evita repetir parseo y embeddings).
+        Devuelve (líneas de resultado, contador por estado, archivos procesados).
+        """
+        loaded_count = 0
+        counts = {'nuevo': 0, 'actualizado': 0, 'sin_cambios': 0, 'duplicado': 0, 'casi_duplicado': 0}
+        
+        # Quitar del índice los archivos que ya no existen
+        current_paths = {str(f) for f in files}
+        removed_paths = [path for path in self.manifest if path not in current_paths]
+        removed_entries = [self.manifest.pop(path) for path in removed_paths]
+        orphans = self.remove_orphans()
+        
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+        self.last_checkpoint = time.monotonic()
+        
+        async def ingest(pdf_file: Path):
+            """Indexar un archivo aislando sus errores del resto de la carga"""
+            nonlocal loaded_count
+            async with semaphore:
+                # Al cancelar, los archivos pendientes se omiten y los que están en curso terminan
+                if job and job.cancelled:
+                    return None
+                try:
+                    citation, display = self.file_citation(pdf_file)
+                    status = await self.index_pdf(pdf_file, citation, pool)
+                    counts[status] += 1
+                    loaded_count += 1
+                    if status == 'sin_cambios':
+                        return None
+                    print(f"📖 Procesado {self.source} ({self.name}): {pdf_file.name} ({status})")
+                    self.checkpoint(on_checkpoint)
+                    return f"  ✅ {pdf_file.name} {display} [{status}]"
+                
+                except Exception as e:
+                    return f"  ❌ {pdf_file.name}: {str(e)}"
+                finally:
+                    if job:
+                        job.advance()
+        
+        try:
+            lines = await asyncio.gather(*(ingest(f) for f in files))
+        finally:
+            # Se eliminan al final para no re-embeber archivos que solo se renombraron
+            for entry in removed_entries:
+                self.remove_from_index(manifest_dockey(entry))
+            # Cualquier documento quitado (borrado, reemplazado o ahora casi duplicado de otro)
+            # deja filas en los índices vectoriales hasta reconstruirlos
+            if self.docs.deleted_dockeys:
+                self.rebuild_vector_indexes()
+            self.refresh_sources()
+            self.save_index()
+            counts['eliminado'] = len(removed_paths)
+            counts['huerfano'] = orphans
+            for status, count in counts.items():
+                metrics.inc("papermind_documents_total", count, status=status)
+        return [line for line in lines if line], counts, loaded_count
+    
+    async def apply_file_changes(self, paths: List[str], pool) -> Counter:
+        """Añadir, reemplazar o quitar del índice solo los PDFs indicados (sin recorrer el directorio)"""
+        counts = Counter()
+        removed_entries = []
+        
+        async def ingest(pdf_file: Path):
+            if not pdf_file.exists():
+                entry = self.manifest.pop(str(pdf_file), None)
+                if entry:
+                    removed_entries.append(entry)
+                    counts['eliminado'] += 1
+                return
+            try:
+                citation, _ = self.file_citation(pdf_file)
+                counts[await self.index_pdf(pdf_file, citation, pool)] += 1
+            except Exception as e:
+                counts['error'] += 1
+                print(f"❌ {pdf_file.name}: {e}")
+        
+        try:
+            await asyncio.gather(*(ingest(Path(path)) for path in paths))
+        finally:
+            # Como en la carga completa: los borrados al final para detectar renombrados
+            for entry in removed_entries:
+                self.remove_from_index(manifest_dockey(entry))
+            if self.docs.deleted_dockeys:
+                self.rebuild_vector_indexes()
+            self.refresh_sources()
+            self.save_index()
+            for status, count in counts.items():
+                metrics.inc("papermind_documents_total", count, status=status)
+        return counts
 
 class ZoteroPaperQAIntegration:
     def __init__(self):
         print("🔧 Configurando Zotero + Paper-QA...")
         self.api_key = ZOTERO_API_KEY
         self.user_id = None
-        self.base_url = "https://api.zotero.org"
-        self.docs = Docs(llm="gpt-4o-mini", summary_llm="gpt-4o-mini")
-        self.processed_files = []
-        self.collections = {}
-        self.items_metadata = {}
+        self.base_url = ZOTERO_API_URL
+        self.zotero = HttpClient(headers=self.get_headers(), name="zotero")
+        self.crossref_cache = CrossrefCache(CROSSREF_CACHE_DB, CROSSREF_CACHE_TTL)
+        # Crossref: el "polite pool" (con mailto) admite más ritmo y concurrencia
+        if CROSSREF_MAILTO:
+            self.crossref = HttpClient(
+                headers={"User-Agent": f"PaperMind/1.0 (mailto:{CROSSREF_MAILTO})"},
+                params={"mailto": CROSSREF_MAILTO},
+                max_concurrent=3, max_per_second=10, name="crossref"
+            )
+        else:
+            self.crossref = HttpClient(headers={"User-Agent": "PaperMind/1.0"}, max_concurrent=1, max_per_second=5, name="crossref")
+        self.shards_path = Path(INDEX_DIR) / "shards.json"
+        # Los shards se cargan en segundo plano (start_warm_up) o al usarlos:
+        # la interfaz arranca sin esperar y las operaciones que los necesitan esperan a wait_ready()
+        self.ready = threading.Event()
+        self.warm_up_lock = threading.Lock()
+        self.warm_up_thread = None
+        self.warm_up_error = None
+        self.warm_up_seconds = 0.0
+        # El índice vive en el event loop de Gradio: las mutaciones ocurren entre awaits,
+        # así que las consultas ven estados consistentes; el lock serializa las cargas
+        self.index_lock = asyncio.Lock()
+        self.query_semaphore = asyncio.Semaphore(QUERY_CONCURRENCY)
+        self.pending_answers = {}  # clave de caché → consulta en curso (preguntas repetidas la comparten)
+        self.jobs = JobManager(Path(INDEX_DIR) / "jobs.json")
+        self.answer_cache = AnswerCache(ANSWER_CACHE_DB, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+        self.stage_cache = StageCache(STAGE_CACHE_DB, int(STAGE_CACHE_MB * 1024 * 1024))
+        # Firmas MinHash de todas las bibliotecas: un PDF ya indexado en otra no se vuelve a embeber
+        self.registry = DedupRegistry(lambda: self.shards)
+        self.shards = self.load_shards()  # id → LibraryShard: personal, grupos y local
+        self.watcher = None
+        # Procesos de parseo de PDFs compartidos por la carga completa y el vigilante (parse_executor)
+        self.parse_pool = None
+        atexit.register(self.shutdown_parse_pool)
         print("✅ Zotero + Paper-QA configurado")
+    
+    def parse_executor(self) -> ProcessPoolExecutor:
+        """Pool de procesos de parseo, creado al primer uso y reutilizado entre cargas y cambios"""
+        # Si un proceso murió (p. ej. un PDF que tumba el parser) el pool queda inservible: se recrea
+        if self.parse_pool is None or self.parse_pool._broken:
+            self.parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return self.parse_pool
+    
+    def shutdown_parse_pool(self):
+        """Terminar los procesos de parseo (al parar el servidor o salir)"""
+        pool, self.parse_pool = self.parse_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def start_warm_up(self):
+        """Cargar Paper-QA y el índice guardado en un hilo aparte (solo la primera vez)"""
+        with self.warm_up_lock:
+            if self.warm_up_thread is None:
+                self.warm_up_thread = threading.Thread(target=self.warm_up, name="papermind-warm-up", daemon=True)
+                self.warm_up_thread.start()
+    
+    def warm_up(self):
+        start = time.perf_counter()
+        try:
+            with track("warm_up") as event:
+                # Las firmas MinHash de todas las bibliotecas quedan en memoria para deduplicar entre ellas
+                for shard in self.shards.values():
+                    shard.load_signatures()
+                # Solo se precarga la biblioteca personal; los grupos y la carpeta local se cargan
+                # al consultarlos o indexarlos (use_shards) y los menos usados se descargan
+                personal = self.shards['personal']
+                personal.load()
+                personal.last_used = time.monotonic()
+                metrics.set("papermind_shards_loaded", sum(shard.loaded for shard in self.shards.values()))
+                event['documents'] = sum(shard.stats().get('documents', 0) for shard in self.shards.values())
+        except Exception as e:
+            self.warm_up_error = str(e)
+            print(f"❌ Error cargando el índice: {e}")
+        finally:
+            self.warm_up_seconds = time.perf_counter() - start
+            self.ready.set()
+    
+    async def wait_ready(self) -> Optional[str]:
+        """Esperar a que termine la carga en segundo plano; mensaje de error si falló"""
+        if not self.ready.is_set():
+            self.start_warm_up()
+            await asyncio.to_thread(self.ready.wait)
+        if self.warm_up_error:
+            return f"❌ No se pudo cargar el índice: {self.warm_up_error}"
+        return None
+    
+    def readiness(self) -> str:
+        """Estado de la carga en segundo plano para la interfaz"""
+        if not self.ready.is_set():
+            return "⏳ Cargando Paper-QA y el índice guardado en segundo plano... Ya puedes configurar Zotero."
+        if self.warm_up_error:
+            return f"❌ No se pudo cargar el índice: {self.warm_up_error}"
+        stats = [shard.stats() for shard in self.shards.values()]
+        loaded = sum(shard.loaded for shard in self.shards.values())
+        return (f"✅ Índice listo: {sum(stat.get('documents', 0) for stat in stats)} documentos, "
+                f"{sum(stat.get('chunks', 0) for stat in stats)} fragmentos en {len(stats)} bibliotecas "
+                f"({loaded} en memoria, cargadas en {self.warm_up_seconds:.1f} s)")
+    
+    def load_shards(self) -> Dict[str, "LibraryShard"]:
+        """Bibliotecas conocidas: la personal, los grupos registrados (shards.json) y la carpeta local"""
+        self.migrate_single_index()
+        entries = []
+        if self.shards_path.exists():
+            try:
+                with open(self.shards_path, encoding='utf-8') as f:
+                    entries = json.load(f).get('groups', [])
+            except (OSError, ValueError) as e:
+                print(f"⚠️ No se pudo leer {self.shards_path}: {e}")
+        shards = {'personal': LibraryShard('personal', 'personal', "Biblioteca personal",
+                                           stage_cache=self.stage_cache, registry=self.registry)}
+        for entry in entries:
+            shards[entry['id']] = LibraryShard(entry['id'], 'grupo', entry['name'], entry['library'],
+                                               self.stage_cache, self.registry)
+        shards['local'] = LibraryShard('local', 'local', "Papers locales", stage_cache=self.stage_cache, registry=self.registry)
+        return shards
+    
+    def save_shards(self):
+        """Guardar el registro de grupos Zotero (la biblioteca personal y la local siempre existen)"""
+        groups = [
+            {'id': shard.id, 'name': shard.name, 'library': shard.library}
+            for shard in self.shards.values() if shard.kind == 'grupo'
+        ]
+        tmp_path = self.shards_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'groups': groups}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.shards_path)
+    
+    def migrate_single_index(self):
+        """Mover el índice único de versiones anteriores al shard de la biblioteca personal.
         
+        Sus PDFs locales salen de ese shard en la siguiente carga y se indexan en el shard
+        local reutilizando la caché de etapas (sin volver a parsear ni embeber).
+        """
+        legacy = Path(INDEX_DIR)
+        target = Path(SHARDS_DIR) / "personal"
+        if not (legacy / "docs.pkl").exists() or (target / "docs.pkl").exists():
+            return
+        target.mkdir(parents=True, exist_ok=True)
+        for name in ("docs.pkl", "manifest.json", "lexical.pkl", "minhash.pkl", "vectors"):
+            if (legacy / name).exists():
+                os.replace(legacy / name, target / name)
+        print(f"📦 Índice único migrado a {target}")
+    
+    def zotero_shards(self) -> List["LibraryShard"]:
+        return [shard for shard in self.shards.values() if shard.source == 'zotero']
+    
+    def select_shards(self, libraries: List[str] = None) -> List["LibraryShard"]:
+        """Shards a consultar por id o nombre (todos si no se indica ninguno)"""
+        if not libraries:
+            return list(self.shards.values())
+        by_name = {shard.name.casefold(): shard for shard in self.shards.values()}
+        selected = []
+        for library in libraries:
+            shard = self.shards.get(library) or by_name.get(library.casefold())
+            if shard is None:
+                raise ValueError(f"❌ Biblioteca desconocida: {library}")
+            if shard not in selected:
+                selected.append(shard)
+        return selected
+    
+    def shard_for_path(self, path: str) -> Optional["LibraryShard"]:
+        """Shard al que pertenece un PDF según su directorio"""
+        parent = Path(path).parent
+        return next((shard for shard in self.shards.values() if shard.papers_dir == parent), None)
+    
+    @asynccontextmanager
+    async def use_shards(self, shards: List["LibraryShard"]):
+        """Cargar en paralelo los shards que no estén en memoria y retenerlos mientras se usan"""
+        for shard in shards:
+            shard.users += 1
+        try:
+            await asyncio.gather(*(asyncio.to_thread(shard.load) for shard in shards if not shard.loaded))
+            self.evict_shards()
+            yield shards
+        finally:
+            for shard in shards:
+                shard.users -= 1
+                shard.last_used = time.monotonic()
+    
+    def evict_shards(self):
+        """Descargar los shards sin uso menos recientes si hay más de MAX_LOADED_SHARDS en memoria"""
+        loaded = [shard for shard in self.shards.values() if shard.loaded]
+        if MAX_LOADED_SHARDS and len(loaded) > MAX_LOADED_SHARDS:
+            idle = sorted((shard for shard in loaded if not shard.users), key=lambda shard: shard.last_used)
+            for shard in idle[:len(loaded) - MAX_LOADED_SHARDS]:
+                shard.unload()
+        metrics.set("papermind_shards_loaded", sum(shard.loaded for shard in self.shards.values()))
+    
+    @property
+    def index_version(self) -> str:
+        """Versión de todas las bibliotecas (cambia si cambia cualquiera)"""
+        return self.index_version_of(self.shards.values())
+    
+    def index_version_of(self, shards) -> str:
+        # También cuentan las bibliotecas que tienen indexados documentos enlazados desde estas
+        shards = list(shards)
+        shards += list(self.linked_documents(shards))
+        digest = hashlib.md5()
+        for shard in shards:
+            digest.update(f"{shard.id}:{shard.stats().get('version', '')};".encode())
+        return digest.hexdigest()
+    
+    def linked_documents(self, shards: List["LibraryShard"]) -> Dict["LibraryShard", set]:
+        """Documentos de estos shards indexados en otras bibliotecas (copias deduplicadas): shard → dockeys"""
+        linked = defaultdict(set)
+        for shard in shards:
+            for dockey in shard.linked:
+                owner = self.registry.owner(dockey)
+                if owner is not None and owner not in shards:
+                    linked[owner].add(dockey)
+        return dict(linked)
+    
+    def share_metadata(self):
+        """Aplicar a los shards cargados los metadatos de sus copias en otras bibliotecas"""
+        loaded = [shard for shard in self.shards.values() if shard.loaded]
+        # Primero las copias enlazadas de todos: las fuentes de cada shard leen las de los demás
+        for shard in loaded:
+            shard.refresh_linked()
+        for shard in loaded:
+            shard.refresh_sources()
+            if shard.apply_zotero_citations():
+                shard.update_index_version()
+                shard.save_index()
+    
+    @property
+    def store(self) -> ZoteroMetadataStore:
+        """Metadatos de la biblioteca personal (destino de las importaciones por DOI)"""
+        return self.shards['personal'].store
+    
+    @property
+    def collections(self) -> Dict[str, str]:
+        return self.shards['personal'].collections
+    
+    def collection_names(self) -> List[str]:
+        """Colecciones de todas las bibliotecas Zotero (para filtrar)"""
+        return sorted({name for shard in self.zotero_shards() for name in shard.collections})
+    
+    def tag_names(self) -> List[str]:
+        """Etiquetas presentes en los documentos indexados de todas las bibliotecas"""
+        return sorted({tag for shard in self.shards.values() for tag in shard.stats().get('tags', [])})
+    
+    def library_choices(self) -> List[tuple]:
+        """(nombre, id) de cada biblioteca para la interfaz"""
+        return [(shard.name, shard.id) for shard in self.shards.values()]
+    
+    def source_of(self, dockey: str) -> tuple:
+        """Shard y (origen, metadatos Zotero, ruta) de un documento; entre copias, la que tiene metadatos"""
+        found = [(shard, shard.sources[dockey]) for shard in self.shards.values() if shard.loaded and dockey in shard.sources]
+        if not found:
+            return None, ('local', {}, '')
+        return max(found, key=lambda item: bool(item[1][1]))
+    
     def get_headers(self):
         """Headers para requests a Zotero API"""
         return {
@@ -51,43 +2457,86 @@ class ZoteroPaperQAIntegration:
     def detect_user_id(self):
         """Detectar automáticamente el User ID de Zotero"""
         try:
-            response = requests.get(
-                f"{self.base_url}/keys/{self.api_key}",
-                headers=self.get_headers()
-            )
+            response = self.zotero.get(f"{self.base_url}/keys/{self.api_key}")
             if response.status_code == 200:
                 key_info = response.json()
                 self.user_id = key_info.get('userID')
-                return f"✅ Usuario Zotero detectado: {self.user_id}"
+                self.shards['personal'].library = f"users/{self.user_id}"
+                return f"✅ Usuario Zotero detectado: {self.user_id}" + self.detect_groups()
             else:
                 return f"❌ Error detectando usuario: {response.status_code}"
         except Exception as e:
             return f"❌ Error conectando con Zotero: {str(e)}"
     
+    def detect_groups(self) -> str:
+        """Registrar como shards los grupos Zotero accesibles (filtrados por ZOTERO_GROUPS)"""
+        if ZOTERO_GROUPS.lower() in ("0", "no", "ninguno"):
+            return ""
+        wanted = {group.strip() for group in ZOTERO_GROUPS.split(",") if group.strip()}
+        try:
+            groups = self.fetch_all(f"{self.base_url}/users/{self.user_id}/groups")
+        except Exception as e:
+            return f"\n⚠️ No se pudieron consultar los grupos: {e}"
+        
+        shards = {shard_id: shard for shard_id, shard in self.shards.items() if shard_id != 'local'}
+        names = []
+        for group in groups:
+            group_id = str(group.get('id') or group['data']['id'])
+            if wanted and group_id not in wanted:
+                continue
+            shard_id = f"grupo_{group_id}"
+            name = group.get('data', {}).get('name') or shard_id
+            if shard_id in shards:
+                shards[shard_id].name = name
+            else:
+                shards[shard_id] = LibraryShard(shard_id, 'grupo', name, f"groups/{group_id}", self.stage_cache, self.registry)
+                shards[shard_id].load_signatures()
+                if self.watcher:
+                    self.watcher.add_directory(str(shards[shard_id].papers_dir))
+            names.append(name)
+        # La carpeta local va siempre al final; el diccionario se sustituye de una vez
+        shards['local'] = self.shards['local']
+        self.shards = shards
+        self.save_shards()
+        if not names:
+            return ""
+        return f"\n👥 Grupos Zotero: {len(names)} ({', '.join(names)})"
+    
+    def fetch_all(self, url: str, params: Dict = None) -> List[Dict]:
+        """Todas las páginas de un listado de la API de Zotero"""
+        response = self.zotero.get(url, params={"limit": 100, **(params or {})})
+        if response.status_code != 200:
+            raise RuntimeError(f"Zotero respondió {response.status_code}")
+        results = response.json()
+        next_url = response.links.get('next', {}).get('url')
+        while next_url:
+            response = self.zotero.get(next_url)
+            if response.status_code != 200:
+                raise RuntimeError(f"Zotero respondió {response.status_code}")
+            results += response.json()
+            next_url = response.links.get('next', {}).get('url')
+        return results
+    
     def get_collections(self):
-        """Obtener colecciones de Zotero"""
+        """Obtener las colecciones de cada biblioteca Zotero"""
         if not self.user_id:
             return "❌ Primero detecta el usuario de Zotero"
         
-        try:
-            response = requests.get(
-                f"{self.base_url}/users/{self.user_id}/collections",
-                headers=self.get_headers()
-            )
+        result = ""
+        for shard in self.zotero_shards():
+            try:
+                collections = self.fetch_all(f"{self.base_url}/{shard.library}/collections")
+            except Exception as e:
+                return result + f"❌ Error obteniendo colecciones de {shard.name}: {str(e)}"
+            shard.collections = {col['data']['name']: col['data']['key'] for col in collections}
+            shard.store.save_collections(shard.collections)
             
-            if response.status_code == 200:
-                collections = response.json()
-                self.collections = {col['data']['name']: col['data']['key'] for col in collections}
-                
-                result = f"📚 Encontradas {len(self.collections)} colecciones:\n"
-                for name, key in self.collections.items():
-                    result += f"• {name} ({key})\n"
-                return result
-            else:
-                return f"❌ Error obteniendo colecciones: {response.status_code}"
-        except Exception as e:
-            return f"❌ Error: {str(e)}"
+            result += f"📚 {shard.name}: encontradas {len(shard.collections)} colecciones:\n"
+            for name, key in shard.collections.items():
+                result += f"• {name} ({key})\n"
+        return result
     
+    @tracked("add_by_doi")
     def add_item_by_doi(self, doi: str, collection_name: str = None):
         """Añadir artículo a Zotero por DOI"""
         if not self.user_id:
@@ -107,21 +2556,13 @@ class ZoteroPaperQAIntegration:
             if collection_name and collection_name in self.collections:
                 collection_key = self.collections[collection_name]
             
-            item_data = {
-                "itemType": "journalArticle",
-                "title": metadata.get("title", ""),
-                "creators": [{"creatorType": "author", "name": author} for author in metadata.get("authors", [])],
-                "date": metadata.get("year", ""),
-                "DOI": doi,
-                "url": metadata.get("url", ""),
-                "abstractNote": metadata.get("abstract", ""),
-                "collections": [collection_key] if collection_key else []
-            }
+            item_data = self.build_item_data(doi, metadata, collection_key)
             
             # Enviar a Zotero
-            response = requests.post(
+            # El write token hace idempotentes los reintentos del POST
+            response = self.zotero.post(
                 f"{self.base_url}/users/{self.user_id}/items",
-                headers={**self.get_headers(), "Content-Type": "application/json"},
+                headers={"Content-Type": "application/json", "Zotero-Write-Token": uuid.uuid4().hex},
                 json=[item_data]
             )
             
@@ -135,14 +2576,102 @@ class ZoteroPaperQAIntegration:
                 return f"✅ Artículo añadido a Zotero\n📄 Título: {metadata.get('title', 'Sin título')}\n{pdf_result}"
             else:
                 return f"❌ Error añadiendo a Zotero: {response.status_code} - {response.text}"
-                
+        
         except Exception as e:
             return f"❌ Error: {str(e)}"
     
+    def build_item_data(self, doi: str, metadata: Dict, collection_key: str = None) -> Dict:
+        """Item Zotero (journalArticle) a partir de los metadatos Crossref"""
+        return {
+            "itemType": "journalArticle",
+            "title": metadata.get("title", ""),
+            "creators": [{"creatorType": "author", "name": author} for author in metadata.get("authors", [])],
+            "date": metadata.get("year", ""),
+            "DOI": doi,
+            "url": metadata.get("url", ""),
+            "abstractNote": metadata.get("abstract", ""),
+            "collections": [collection_key] if collection_key else []
+        }
+    
+    @tracked("import_dois")
+    def import_dois(self, dois: List[str], collection_name: str = None):
+        """Importación masiva: metadatos Crossref en paralelo y escrituras Zotero por lotes"""
+        if not self.user_id:
+            return "❌ Primero detecta el usuario de Zotero"
+        if not dois:
+            return "❌ No se encontraron DOIs"
+        
+        collection_key = self.collections.get(collection_name) if collection_name else None
+        results = []
+        
+        # Saltar los DOIs que ya están en la biblioteca sincronizada
+        existing = self.store.existing_dois()
+        pending = [doi for doi in dois if doi.lower() not in existing]
+        skipped = len(dois) - len(pending)
+        
+        # Resolver metadatos en paralelo (el cliente Crossref limita ritmo y concurrencia)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            metadata_list = list(pool.map(self.get_metadata_from_doi, pending))
+        
+        items = []
+        item_dois = []
+        for doi, metadata in zip(pending, metadata_list):
+            if metadata:
+                items.append(self.build_item_data(doi, metadata, collection_key))
+                item_dois.append(doi)
+            else:
+                results.append(f"❌ {doi}: sin metadatos en Crossref")
+        
+        added = 0
+        for start in range(0, len(items), ZOTERO_WRITE_BATCH):
+            batch = items[start:start + ZOTERO_WRITE_BATCH]
+            batch_dois = item_dois[start:start + ZOTERO_WRITE_BATCH]
+            try:
+                response = self.zotero.post(
+                    f"{self.base_url}/users/{self.user_id}/items",
+                    headers={"Content-Type": "application/json", "Zotero-Write-Token": uuid.uuid4().hex},
+                    json=batch
+                )
+            except Exception as e:
+                results.extend(f"❌ {doi}: {str(e)}" for doi in batch_dois)
+                continue
+            if response.status_code != 200:
+                results.extend(f"❌ {doi}: Zotero respondió {response.status_code}" for doi in batch_dois)
+                continue
+            
+            # La respuesta indexa cada item del lote por su posición
+            result_data = response.json()
+            successful = result_data.get('successful', {})
+            unchanged = result_data.get('unchanged', {})
+            failed = result_data.get('failed', {})
+            for index, doi in enumerate(batch_dois):
+                if str(index) in successful:
+                    added += 1
+                    results.append(f"✅ {doi} → {successful[str(index)]['key']}")
+                elif str(index) in unchanged:
+                    results.append(f"➖ {doi}: sin cambios")
+                elif str(index) in failed:
+                    error = failed[str(index)]
+                    results.append(f"❌ {doi}: {error.get('message', error.get('code'))}")
+        
+        summary = f"📚 Importación masiva: {added}/{len(dois)} DOIs añadidos a Zotero\n"
+        summary += f"⏭️ Ya existentes en la biblioteca: {skipped}\n"
+        summary += f"❌ Con errores: {sum(1 for line in results if line.startswith('❌'))}\n\n"
+        summary += "\n".join(results[:50])
+        if len(results) > 50:
+            summary += f"\n... y {len(results) - 50} más"
+        return summary
+    
     def get_metadata_from_doi(self, doi: str) -> Optional[Dict]:
-        """Obtener metadatos desde DOI usando Crossref"""
+        """Obtener metadatos desde DOI usando Crossref (con caché en disco)"""
+        cached, metadata = self.crossref_cache.get(doi)
+        if cached:
+            return metadata
+        
         try:
-            response = requests.get(f"https://api.crossref.org/works/{doi}")
+            response = self.crossref.get(f"{CROSSREF_API_URL}/works/{doi}")
+            if response.status_code == 404:
+                self.crossref_cache.put(doi, None)
             if response.status_code == 200:
                 data = response.json()['message']
                 
@@ -153,7 +2682,7 @@ class ZoteroPaperQAIntegration:
                         if 'given' in author and 'family' in author:
                             authors.append(f"{author['given']} {author['family']}")
                 
-                return {
+                metadata = {
                     "title": data.get('title', [''])[0],
                     "authors": authors,
                     "year": str(data.get('published-print', {}).get('date-parts', [['']])[0][0]),
@@ -161,6 +2690,8 @@ class ZoteroPaperQAIntegration:
                     "url": data.get('URL', ''),
                     "abstract": data.get('abstract', '')
                 }
+                self.crossref_cache.put(doi, metadata)
+                return metadata
         except Exception as e:
             print(f"Error obteniendo metadatos: {e}")
         return None
@@ -171,162 +2702,385 @@ class ZoteroPaperQAIntegration:
             # Intentar desde Sci-Hub (usar con precaución y según normativas locales)
             pdf_url = f"https://sci-hub.se/{doi}"
             
-            response = requests.get(pdf_url, timeout=10)
-            if response.status_code == 200 and 'application/pdf' in response.headers.get('content-type', ''):
-                # Generar nombre de archivo limpio
-                title = metadata.get('title', 'documento')
-                filename = self.clean_filename(f"{title}_{doi}.pdf")
-                filepath = Path(PAPERS_DIR) / filename
-                
-                with open(filepath, 'wb') as f:
-                    f.write(response.content)
-                
-                return f"📥 PDF descargado: {filename}"
-            else:
-                return f"⚠️ PDF no disponible automáticamente para DOI: {doi}"
-                
+            with requests.get(pdf_url, timeout=10, stream=True) as response:
+                if response.status_code == 200 and 'application/pdf' in response.headers.get('content-type', ''):
+                    # Generar nombre de archivo limpio
+                    title = metadata.get('title', 'documento')
+                    filename = clean_filename(f"{title}_{doi}.pdf")
+                    filepath = Path(PAPERS_DIR) / filename
+                    
+                    # Se escribe por bloques en un .part y se renombra al terminar
+                    partial = filepath.with_name(filepath.name + ".part")
+                    stream_to_file(response, partial)
+                    os.replace(partial, filepath)
+                    
+                    return f"📥 PDF descargado: {filename}"
+                else:
+                    return f"⚠️ PDF no disponible automáticamente para DOI: {doi}"
+        
         except Exception as e:
             return f"⚠️ Error descargando PDF: {str(e)}"
     
-    def clean_filename(self, filename: str) -> str:
-        """Limpiar nombre de archivo para sistema de archivos"""
-        # Remover caracteres no válidos
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        # Limitar longitud
-        if len(filename) > 100:
-            filename = filename[:95] + ".pdf"
-        return filename
-    
-    def sync_zotero_to_paperqa(self, collection_name: str = None):
-        """Sincronizar papers de Zotero con Paper-QA"""
+    def fetch_library_changes(self, shard: "LibraryShard"):
+        """Descargar (paginando) solo los items modificados desde la última sincronización.
+        
+        Devuelve (items cambiados, items eliminados, versión de la biblioteca).
+        """
+        library = shard.library
+        since = shard.store.get_version(library)
+        
+        response = self.zotero.get(
+            f"{self.base_url}/{library}/items",
+            headers={"If-Modified-Since-Version": str(since)},
+            params={"since": since, "itemType": "-attachment", "format": "json", "limit": 100}
+        )
+        if response.status_code == 304:
+            return 0, 0, since
+        if response.status_code != 200:
+            raise RuntimeError(f"Error obteniendo items: {response.status_code}")
+        
+        # Versión de la primera página: si algo cambia durante la paginación,
+        # la próxima sincronización (since=version) lo volverá a traer
+        version = int(response.headers.get("Last-Modified-Version", since))
+        changed = 0
+        while True:
+            items = [item for item in response.json() if item['data'].get('itemType') != 'note']
+            shard.store.upsert_items(items)
+            changed += len(items)
+            
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                break
+            response = self.zotero.get(next_url)
+            if response.status_code != 200:
+                raise RuntimeError(f"Error obteniendo items: {response.status_code}")
+        
+        deleted = 0
+        if since:
+            response = self.zotero.get(f"{self.base_url}/{library}/deleted", params={"since": since})
+            if response.status_code == 200:
+                deleted_keys = response.json().get('items', [])
+                shard.store.delete_items(deleted_keys)
+                deleted = len(deleted_keys)
+        
+        shard.store.set_version(library, version)
+        return changed, deleted, version
+    
+    def fetch_attachment_changes(self, shard: "LibraryShard") -> int:
+        """Descargar (paginando) los adjuntos PDF guardados en Zotero que cambiaron desde la última sincronización"""
+        library = shard.library
+        # Versión propia: las bibliotecas ya sincronizadas traen todos sus adjuntos la primera vez
+        state = f"{library}/attachments"
+        since = shard.store.get_version(state)
+        
+        response = self.zotero.get(
+            f"{self.base_url}/{library}/items",
+            headers={"If-Modified-Since-Version": str(since)},
+            params={"since": since, "itemType": "attachment", "format": "json", "limit": 100}
+        )
+        if response.status_code == 304:
+            return 0
+        if response.status_code != 200:
+            raise RuntimeError(f"Error obteniendo adjuntos: {response.status_code}")
+        
+        version = int(response.headers.get("Last-Modified-Version", since))
+        changed = 0
+        while True:
+            # Solo archivos PDF almacenados en Zotero (no enlaces a archivos ni URLs) con item padre
+            attachments = [
+                item['data'] for item in response.json()
+                if item['data'].get('linkMode') in ('imported_file', 'imported_url')
+                and item['data'].get('contentType') == 'application/pdf'
+                and item['data'].get('parentItem')
+            ]
+            shard.store.upsert_attachments(attachments)
+            changed += len(attachments)
+            
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                break
+            response = self.zotero.get(next_url)
+            if response.status_code != 200:
+                raise RuntimeError(f"Error obteniendo adjuntos: {response.status_code}")
+        
+        shard.store.set_version(state, version)
+        return changed
+    
+    def download_attachment(self, shard: "LibraryShard", attachment: Dict, path: Path) -> str:
+        """Descargar un adjunto por la API de archivos de Zotero, en streaming y reanudable.
+        
+        Devuelve 'sin_cambios' si el archivo local ya tiene el MD5 del adjunto (o, si Zotero
+        no lo da, es la versión del adjunto ya descargada), 'reanudado' si continuó una
+        descarga interrumpida o 'descargado'.
+        """
+        expected = attachment['md5']
+        if path.exists():
+            stat = path.stat()
+            unchanged = (stat.st_size, stat.st_mtime_ns) == (attachment['local_size'], attachment['local_mtime'])
+            if expected is None:
+                # Sin MD5 (p. ej. aún sin subir) no se puede verificar: basta con la versión descargada
+                up_to_date = unchanged or attachment['local_version'] == attachment['version']
+            else:
+                up_to_date = unchanged or file_md5(path) == expected
+            if up_to_date:
+                shard.store.mark_downloaded(attachment['key'], stat.st_size, stat.st_mtime_ns, attachment['version'])
+                return 'sin_cambios'
+        
+        url = f"{self.base_url}/{shard.library}/items/{attachment['key']}/file"
+        partial = path.with_name(path.name + ".part")
+        resumed = False
+        for attempt in range(3):
+            # Lo ya descargado se conserva entre intentos (y entre sincronizaciones)
+            offset = partial.stat().st_size if partial.exists() else 0
+            digest = hashlib.md5()
+            headers = {}
+            if offset:
+                with open(partial, 'rb') as f:
+                    for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b''):
+                        digest.update(block)
+                headers["Range"] = f"bytes={offset}-"
+            try:
+                with self.zotero.get(url, headers=headers, stream=True) as response:
+                    if response.status_code == 206:
+                        resumed = True
+                        stream_to_file(response, partial, append=True, digest=digest)
+                    elif response.status_code == 200:
+                        digest = hashlib.md5()
+                        stream_to_file(response, partial, digest=digest)
+                    elif response.status_code != 416:  # 416: la parte ya estaba completa
+                        raise RuntimeError(f"Zotero respondió {response.status_code}")
+            except requests.RequestException:
+                if attempt == 2:
+                    raise
+                time.sleep(self.zotero.backoff_delay(attempt))
+                continue
+            
+            if expected and digest.hexdigest() != expected:
+                # Parte corrupta o de otra versión del archivo: repetir desde cero
+                partial.unlink(missing_ok=True)
+                if attempt == 2:
+                    raise ValueError("el MD5 descargado no coincide con el de Zotero")
+                continue
+            os.replace(partial, path)
+            stat = path.stat()
+            shard.store.mark_downloaded(attachment['key'], stat.st_size, stat.st_mtime_ns, attachment['version'])
+            return 'reanudado' if resumed else 'descargado'
+    
+    @tracked("download_attachments")
+    def download_attachments(self, shard: "LibraryShard", parents: set, job: Job = None):
+        """Descargar en paralelo los adjuntos PDF de los items indicados.
+        
+        Devuelve (enlaces ruta → item padre, contador por estado, líneas con errores).
+        """
+        attachments = shard.store.attachments(parents)
+        if job:
+            job.start_stage("descargando adjuntos", len(attachments))
+        
+        def download(attachment: Dict):
+            path = shard.attachment_path(attachment)
+            if job and job.cancelled:
+                return attachment, path, 'cancelado', None
+            try:
+                return attachment, path, self.download_attachment(shard, attachment, path), None
+            except Exception as e:
+                return attachment, path, 'error', str(e)
+            finally:
+                if job:
+                    job.advance()
+        
+        links = {}
+        counts = Counter()
+        errors = []
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as pool:
+            for attachment, path, status, error in pool.map(download, attachments):
+                counts[status] += 1
+                if error:
+                    errors.append(f"❌ Adjunto {attachment['filename']}: {error}")
+                elif status != 'cancelado':
+                    links[str(path)] = attachment['parent']
+        for status, count in counts.items():
+            metrics.inc("papermind_attachments_total", count, status=status, library=shard.id)
+        return links, counts, errors
+    
+    @tracked("sync")
+    def sync_zotero_to_paperqa(self, collection_name: str = None, job: Job = None):
+        """Sincronizar papers de Zotero con Paper-QA (biblioteca personal y grupos)"""
         if not self.user_id:
             return "❌ Primero detecta el usuario de Zotero"
         
+        # Una colección solo existe en su biblioteca: las demás no se emparejan
+        shards = self.zotero_shards()
+        if collection_name:
+            shards = [shard for shard in shards if collection_name in shard.collections] or shards
         try:
-            # Obtener items de Zotero
-            url = f"{self.base_url}/users/{self.user_id}/items"
-            params = {"itemType": "journalArticle", "limit": 100}
+            return "\n\n".join(self.sync_library(shard, collection_name, job) for shard in shards)
+        except JobCancelled:
+            return "⏹️ Sincronización cancelada: los adjuntos ya descargados se conservan y la próxima sincronización continúa"
+    
+    def sync_library(self, shard: "LibraryShard", collection_name: str = None, job: Job = None):
+        """Sincronizar una biblioteca Zotero: cambios, adjuntos y emparejamiento con sus PDFs"""
+        try:
+            # Traer solo los cambios desde la última sincronización
+            if job:
+                job.start_stage("consultando cambios en Zotero")
+            with track("zotero_changes") as event:
+                changed, deleted, version = self.fetch_library_changes(shard)
+                attachments_changed = self.fetch_attachment_changes(shard)
+                event.update(library=shard.id, changed=changed, deleted=deleted, version=version, attachments=attachments_changed)
             
-            if collection_name and collection_name in self.collections:
-                collection_key = self.collections[collection_name]
-                url = f"{self.base_url}/users/{self.user_id}/collections/{collection_key}/items"
+            items = shard.store.all_items()
+            if collection_name and collection_name in shard.collections:
+                collection_key = shard.collections[collection_name]
+                items = [data for data in items if collection_key in data.get('collections', [])]
             
-            response = requests.get(url, headers=self.get_headers(), params=params)
+            # Los PDFs guardados en Zotero se descargan y quedan enlazados a su item sin emparejar
+            links, download_counts, results = self.download_attachments(shard, {data['key'] for data in items}, job)
+            # Las descargas completas se conservan; las pendientes se reanudan en la próxima sincronización
+            if job:
+                job.check_cancelled()
+                job.start_stage("emparejando PDFs con items", len(items))
+            pdf_count = len(links)
+            ambiguous_count = 0
+            attached_items = set(links.values())
             
-            if response.status_code == 200:
-                items = response.json()
-                
-                results = []
-                pdf_count = 0
-                
-                for item in items:
-                    data = item['data']
-                    title = data.get('title', 'Sin título')
-                    doi = data.get('DOI', '')
-                    
-                    # Buscar PDF local correspondiente
-                    pdf_files = list(Path(PAPERS_DIR).glob("*.pdf"))
-                    matching_pdf = None
-                    
-                    for pdf_file in pdf_files:
-                        if doi and doi.lower() in pdf_file.name.lower():
-                            matching_pdf = pdf_file
-                            break
-                        if any(word in pdf_file.name.lower() for word in title.lower().split()[:3] if len(word) > 3):
-                            matching_pdf = pdf_file
-                            break
-                    
-                    if matching_pdf:
-                        # Guardar metadatos enriquecidos
-                        self.items_metadata[str(matching_pdf)] = {
-                            'title': title,
-                            'authors': [creator.get('name', '') for creator in data.get('creators', [])],
-                            'year': data.get('date', ''),
-                            'doi': doi,
-                            'tags': [tag.get('tag', '') for tag in data.get('tags', [])],
-                            'collections': data.get('collections', [])
-                        }
-                        
-                        results.append(f"✅ {matching_pdf.name} → {title}")
-                        pdf_count += 1
-                    else:
-                        results.append(f"⚠️ No PDF local para: {title}")
-                
-                sync_result = f"🔄 Sincronización completada:\n"
-                sync_result += f"📄 {pdf_count} PDFs con metadatos enriquecidos\n\n"
-                sync_result += "\n".join(results[:10])  # Mostrar solo los primeros 10
-                
-                if len(results) > 10:
-                    sync_result += f"\n... y {len(results) - 10} más"
+            # Índice de PDFs locales construido una sola vez por sincronización
+            matcher = PdfMatcher(f for f in shard.papers_dir.glob("*.pdf") if str(f) not in links)
+            claims = defaultdict(list)
+            
+            for data in items:
+                if job:
+                    job.check_cancelled()
+                    job.advance()
+                if data['key'] in attached_items:
+                    continue
+                title = data.get('title', 'Sin título')
+                status, matching_pdf, score, alternatives = matcher.match(title, data.get('DOI', ''))
                 
-                return sync_result
-            else:
-                return f"❌ Error obteniendo items: {response.status_code}"
+                if matching_pdf:
+                    claims[matching_pdf].append((score, status, data))
+                elif status == 'ambiguo':
+                    ambiguous_count += 1
+                    options = ", ".join(f.name for f in alternatives[:3])
+                    results.append(f"❓ Coincidencia ambigua para: {title} ({options})")
+                else:
+                    results.append(f"⚠️ No PDF local para: {title}")
+            
+            # Un PDF pertenece a un solo item: si varios lo reclaman con puntuación similar, se reporta
+            for matching_pdf, item_claims in claims.items():
+                item_claims.sort(key=lambda claim: claim[0], reverse=True)
+                score, status, data = item_claims[0]
+                if len(item_claims) > 1 and score - item_claims[1][0] < PdfMatcher.MARGIN:
+                    ambiguous_count += 1
+                    titles = " / ".join(claim[2].get('title', 'Sin título')[:40] for claim in item_claims[:3])
+                    results.append(f"❓ {matching_pdf.name} coincide con varios items: {titles}")
+                    continue
                 
+                links[str(matching_pdf)] = data['key']
+                method = "DOI" if status == 'doi' else f"título {score:.2f}"
+                results.append(f"✅ {matching_pdf.name} → {data.get('title', 'Sin título')} [{method}]")
+                pdf_count += 1
+            
+            # Guardar metadatos enriquecidos (el índice los aplica en el event loop o al cargarse)
+            shard.store.link_pdfs(links)
+            
+            sync_result = f"🔄 Sincronización completada ({shard.name}):\n"
+            sync_result += f"📡 Cambios desde Zotero: {changed} items actualizados, {deleted} eliminados (versión {version})\n"
+            sync_result += f"🗄️ {shard.store.count_items()} items en el almacén local\n"
+            sync_result += f"📥 Adjuntos Zotero: {download_counts['descargado']} descargados, {download_counts['reanudado']} reanudados, "
+            sync_result += f"{download_counts['sin_cambios']} sin cambios, {download_counts['error']} con errores\n"
+            sync_result += f"📄 {pdf_count} PDFs con metadatos enriquecidos\n"
+            sync_result += f"❓ {ambiguous_count} coincidencias ambiguas sin asignar\n\n"
+            sync_result += "\n".join(results[:10])  # Mostrar solo los primeros 10
+            
+            if len(results) > 10:
+                sync_result += f"\n... y {len(results) - 10} más"
+            
+            return sync_result
+        
+        except JobCancelled:
+            raise
         except Exception as e:
-            return f"❌ Error en sincronización: {str(e)}"
+            return f"❌ Error en sincronización ({shard.name}): {str(e)}"
     
-    async def load_papers_to_paperqa(self):
+    async def sync_zotero_and_update_index(self, collection_name: str = None, job: Job = None):
+        """Sincronizar Zotero (HTTP en un hilo) y aplicar los metadatos al índice"""
+        error = await self.wait_ready()
+        if error:
+            return error
+        status = await asyncio.to_thread(self.sync_zotero_to_paperqa, collection_name, job)
+        # De vuelta en el event loop y con el lock del índice: una carga en curso termina antes
+        # de actualizar fuentes y citaciones; los shards que no están en memoria las aplican al cargarse
+        async with self.index_lock:
+            for shard in self.zotero_shards():
+                if shard.loaded:
+                    shard.items_metadata = shard.store.linked_metadata()
+            self.share_metadata()
+        return status
+    
+    async def load_papers_to_paperqa(self, job: Job = None):
         """Cargar papers con metadatos enriquecidos a Paper-QA (Zotero + Locales)"""
-        # Obtener PDFs de ambos directorios
-        zotero_files = list(Path(PAPERS_DIR).glob("*.pdf"))
-        local_files = list(Path(LOCAL_PAPERS_DIR).glob("*.pdf"))
+        error = await self.wait_ready()
+        if error:
+            return error
+        if self.index_lock.locked():
+            return "⏳ Ya hay una carga de la biblioteca en curso. Espera a que termine."
+        async with self.index_lock:
+            return await self.update_index_from_disk(job)
+    
+    @tracked("load")
+    async def update_index_from_disk(self, job: Job = None):
+        """Sincronizar el índice de cada biblioteca con sus PDFs en disco.
         
-        total_files = len(zotero_files) + len(local_files)
-        if total_files == 0:
+        Las bibliotecas se procesan de una en una (cada una se carga solo mientras se indexa
+        si no cabe con las demás) y comparten el pool de procesos de parseo.
+        """
+        shard_files = [(shard, list(shard.papers_dir.glob("*.pdf"))) for shard in self.shards.values()]
+        total_files = sum(len(files) for _, files in shard_files)
+        if total_files == 0 and not any(shard.stats().get('files') for shard in self.shards.values()):
             return "❌ No hay PDFs en ningún directorio"
         
         results = []
         loaded_count = 0
+        counts = Counter()
+        if job:
+            job.start_stage("indexando PDFs", total_files)
         
-        # Procesar papers de Zotero (con metadatos enriquecidos)
-        if zotero_files:
-            results.append(f"📚 **PAPERS DE ZOTERO** ({len(zotero_files)} archivos):")
-            
-            for pdf_file in zotero_files:
-                try:
-                    print(f"📖 Procesando Zotero: {pdf_file.name}")
-                    
-                    # Obtener metadatos enriquecidos de Zotero
-                    metadata = self.items_metadata.get(str(pdf_file), {})
-                    
-                    if metadata:
-                        citation = f"{', '.join(metadata.get('authors', [])[:3])} ({metadata.get('year', 'S/F')}). {metadata.get('title', pdf_file.name)}"
-                        await self.docs.aadd(str(pdf_file), citation=citation)
-                        title_display = metadata.get('title', pdf_file.name)
-                    else:
-                        await self.docs.aadd(str(pdf_file))
-                        title_display = pdf_file.name
-                    
-                    self.processed_files.append(str(pdf_file))
-                    loaded_count += 1
-                    results.append(f"  ✅ {pdf_file.name} → {title_display[:50]}...")
-                    
-                except Exception as e:
-                    results.append(f"  ❌ {pdf_file.name}: {str(e)}")
+        pool = self.parse_executor()
+        for shard, files in shard_files:
+            if job and job.cancelled:
+                break
+            # Sin archivos y sin nada indexado no hace falta cargar el shard
+            if not files and not shard.stats().get('files'):
+                continue
+            async with self.use_shards([shard]):
+                lines, shard_counts, shard_loaded = await shard.update_from_disk(files, pool, job, self.jobs.save)
+            counts.update(shard_counts)
+            loaded_count += shard_loaded
+            if files:
+                icon = "📁" if shard.source == 'local' else "📚"
+                separator = "\n" if results else ""
+                results.append(f"{separator}{icon} **{shard.name.upper()}** ({len(files)} archivos):")
+                results.extend(lines)
+        # Las copias enlazadas entre bibliotecas completan los metadatos de su documento
+        self.share_metadata()
         
-        # Procesar papers locales (sin metadatos Zotero)
-        if local_files:
-            results.append(f"\n📁 **PAPERS LOCALES** ({len(local_files)} archivos):")
-            
-            for pdf_file in local_files:
-                try:
-                    print(f"📖 Procesando Local: {pdf_file.name}")
-                    
-                    # Cargar paper local con identificación clara
-                    citation = f"Documento Local: {pdf_file.stem}"
-                    await self.docs.aadd(str(pdf_file), citation=citation)
-                    
-                    self.processed_files.append(str(pdf_file))
-                    loaded_count += 1
-                    results.append(f"  ✅ {pdf_file.name} [PAPEL LOCAL]")
-                    
-                except Exception as e:
-                    results.append(f"  ❌ {pdf_file.name}: {str(e)}")
+        if job and job.cancelled:
+            return (f"⏹️ Carga cancelada: {loaded_count}/{total_files} documentos procesados y guardados. "
+                    f"Vuelve a cargar para continuar con los {total_files - loaded_count} restantes.")
+        
+        zotero_count = sum(shard.stats().get('files', 0) for shard in self.zotero_shards())
+        local_count = self.shards['local'].stats().get('files', 0)
         
-        summary = f"📚 **BIBLIOTECA COMPLETA CARGADA**: {loaded_count}/{total_files} documentos\n"
-        summary += f"🔗 Zotero: {len(zotero_files)} papers con metadatos enriquecidos\n"
-        summary += f"📁 Locales: {len(local_files)} papers del directorio personal\n\n"
+        summary = f"📚 **BIBLIOTECA COMPLETA CARGADA**: {loaded_count}/{total_files} documentos en {len(self.shards)} bibliotecas\n"
+        summary += f"🔗 Zotero: {zotero_count} papers con metadatos enriquecidos\n"
+        summary += f"📁 Locales: {local_count} papers del directorio personal\n"
+        summary += f"🆕 Nuevos: {counts['nuevo']} | ♻️ Actualizados: {counts['actualizado']} | "
+        summary += f"⏭️ Sin cambios: {counts['sin_cambios']} | 🧬 Duplicados: {counts['duplicado']} | "
+        summary += f"🪞 Casi duplicados: {counts['casi_duplicado']} | "
+        summary += f"🗑️ Eliminados: {counts['eliminado']}"
+        if counts['huerfano']:
+            summary += f" | 🧹 Huérfanos quitados: {counts['huerfano']}"
+        summary += "\n\n"
         summary += "\n".join(results)
         
         if loaded_count > 0:
@@ -334,108 +3088,397 @@ class ZoteroPaperQAIntegration:
         
         return summary
     
-    async def ask_question_with_filters(self, question: str, collection_filter: str = None, tag_filter: str = None):
-        """Hacer pregunta con filtros de colección/etiquetas"""
-        if not self.processed_files:
-            return "❌ No hay documentos cargados. Usa 'Cargar Papers en Paper-QA' primero."
+    def start_watching(self) -> DirectoryWatcher:
+        """Vigilar los directorios de PDFs y aplicar los cambios en el event loop actual"""
+        loop = asyncio.get_running_loop()
         
-        try:
-            print(f"🤖 Pregunta: {question}")
-            if collection_filter:
-                print(f"📁 Filtro de colección: {collection_filter}")
-            if tag_filter:
-                print(f"🏷️ Filtro de etiqueta: {tag_filter}")
-            
-            # Hacer pregunta a Paper-QA
-            answer = await self.docs.aquery(question)
-            
-            # Contar fuentes por tipo
-            zotero_count = sum(1 for f in self.processed_files if PAPERS_DIR in f)
-            local_count = sum(1 for f in self.processed_files if LOCAL_PAPERS_DIR in f)
+        def on_changes(paths: List[str]):
+            future = asyncio.run_coroutine_threadsafe(self.apply_file_changes(paths), loop)
+            future.add_done_callback(
+                lambda f: f.exception() and print(f"❌ Error aplicando cambios de archivos: {f.exception()}")
+            )
+        
+        # Los grupos detectados más tarde se añaden al vigilante al crear su shard (detect_groups)
+        self.watcher = DirectoryWatcher([str(shard.papers_dir) for shard in self.shards.values()], on_changes)
+        self.watcher.start()
+        return self.watcher
+    
+    @tracked("watch")
+    async def apply_file_changes(self, paths: List[str]) -> str:
+        """Añadir, reemplazar o quitar del índice solo los PDFs indicados (sin recorrer los directorios)"""
+        error = await self.wait_ready()
+        if error:
+            return error
+        by_shard = defaultdict(list)
+        for path in paths:
+            shard = self.shard_for_path(path)
+            if shard:
+                by_shard[shard.id].append(path)
+        counts = Counter()
+        # El pool de parseo se crea (una vez) fuera del lock: las consultas no esperan a que arranque
+        pool = self.parse_executor()
+        
+        async with self.index_lock:
+            for shard_id, shard_paths in by_shard.items():
+                shard = self.shards[shard_id]
+                async with self.use_shards([shard]):
+                    counts.update(await shard.apply_file_changes(shard_paths, pool))
+            self.share_metadata()
+        
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()) if count)
+        print(f"👀 Cambios en {len(paths)} archivo(s) aplicados al índice ({summary or 'sin cambios'})")
+        return summary
+    
+    def format_source(self, context, number: int) -> str:
+        """Bloque Markdown de una fuente con su origen y metadatos"""
+        _, (source, metadata, path) = self.source_of(context.text.doc.dockey)
+        text_content = context.context
+        text_preview = text_content[:400] + "..." if len(text_content) > 400 else text_content
+        
+        if metadata:
+            # Fuente Zotero con metadatos completos
+            authors = ', '.join(metadata.get('authors', [])[:2])
+            if len(metadata.get('authors', [])) > 2:
+                authors += " et al."
             
-            # Formatear respuesta con metadatos enriquecidos
-            formatted_response = f"""
-## 🎯 Pregunta: {question}
-
-### 📝 Respuesta (Biblioteca Unificada):
+            return f"""
+**🔗 Paper Zotero - Fuente {number}:**
+*📖 {metadata.get('title', 'Sin título')}*
+*👥 Autores: {authors}*
+*📅 Año: {metadata.get('year', 'S/F')}*
+*🔗 DOI: {metadata.get('doi', 'No disponible')}*
+*📑 {context.text.name}*
 
-{answer.answer}
+{text_preview}
 
-### 📚 Información de la consulta:
-- **📊 Biblioteca total**: {len(self.processed_files)} documentos
-- **🔗 Papers Zotero**: {zotero_count} (con metadatos enriquecidos)
-- **📁 Papers locales**: {local_count} (documentos personales)
-- **🔍 Contextos utilizados**: {len(answer.context) if hasattr(answer, 'context') else 0}
+---
 """
-            
-            if collection_filter:
-                formatted_response += f"- **📁 Filtro colección**: {collection_filter}\n"
-            if tag_filter:
-                formatted_response += f"- **🏷️ Filtro etiqueta**: {tag_filter}\n"
-            
-            formatted_response += "\n### 🔍 Fuentes utilizadas:\n"
-            
-            # Mostrar contextos con identificación de origen
-            if hasattr(answer, 'context') and answer.context:
-                context_count = 0
-                for i, context in enumerate(answer.context):
-                    if context_count >= 3:
-                        break
-                    
-                    try:
-                        if hasattr(context, 'text'):
-                            text_content = context.text
-                        elif isinstance(context, str) and len(context) > 10:
-                            text_content = context
-                        else:
-                            continue
-                        
-                        # Determinar origen y metadatos
-                        source_metadata = None
-                        source_type = "📄 Paper Local"
-                        
-                        # Buscar si es de Zotero con metadatos
-                        for filepath, metadata in self.items_metadata.items():
-                            if any(word in text_content.lower() for word in metadata.get('title', '').lower().split()[:3] if len(word) > 3):
-                                source_metadata = metadata
-                                source_type = "🔗 Paper Zotero"
-                                break
-                        
-                        text_preview = text_content[:400] + "..." if len(text_content) > 400 else text_content
-                        
-                        if source_metadata:
-                            # Fuente Zotero con metadatos completos
-                            authors = ', '.join(source_metadata.get('authors', [])[:2])
-                            if len(source_metadata.get('authors', [])) > 2:
-                                authors += " et al."
-                            
-                            formatted_response += f"""
-**{source_type} - Fuente {context_count + 1}:**
-*📖 {source_metadata.get('title', 'Sin título')}*
-*👥 Autores: {authors}*
-*📅 Año: {source_metadata.get('year', 'S/F')}*
-*🔗 DOI: {source_metadata.get('doi', 'No disponible')}*
+        if source == 'zotero':
+            # PDF de Zotero aún sin metadatos sincronizados
+            return f"""
+**🔗 Paper Zotero - Fuente {number}:**
+*📄 {Path(path).name if path else context.text.doc.citation}*
+*📑 {context.text.name}*
 
 {text_preview}
 
 ---
 """
-                        else:
-                            # Fuente local o sin metadatos
-                            formatted_response += f"""
-**{source_type} - Fuente {context_count + 1}:**
-*📄 Documento de tu biblioteca personal*
+        # Fuente local
+        return f"""
+**📄 Paper Local - Fuente {number}:**
+*📄 Documento de tu biblioteca personal: {Path(path).name if path else context.text.doc.citation}*
+*📑 {context.text.name}*
 
 {text_preview}
 
 ---
 """
-                        context_count += 1
-                        
-                    except Exception as ctx_error:
-                        continue
-            
-            formatted_response += f"""
+    
+    @tracked("query")
+    async def ask_question_with_filters(self, question: str, collection_filter: str = None, tag_filter: str = None,
+                                        details: Dict = None, libraries: List[str] = None):
+        """Hacer pregunta con filtros de colección/etiquetas sobre las bibliotecas indicadas (todas por defecto).
+        
+        Si se pasa `details`, se completa con la respuesta y las fuentes en forma estructurada.
+        """
+        error = await self.wait_ready()
+        if error:
+            return error
+        try:
+            shards = self.select_shards(libraries)
+        except ValueError as e:
+            return str(e)
+        if not any(shard.stats().get('files') for shard in shards):
+            return "❌ No hay documentos cargados. Usa 'Cargar Papers en Paper-QA' primero."
+        
+        # Las respuestas repetidas salen de la caché sin esperar turno ni gastar tokens
+        cache_key = AnswerCache.make_key(question, collection_filter, tag_filter, self.index_version_of(shards))
+        cached = self.cached_answer(cache_key, details)
+        if cached:
+            return cached
+        
+        # La misma pregunta ya en curso (p. ej. repetida en un lote) no se consulta dos veces
+        pending = self.pending_answers.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(self.compute_answer(cache_key, question, collection_filter, tag_filter, shards))
+            self.pending_answers[cache_key] = pending
+            pending.add_done_callback(lambda _: self.pending_answers.pop(cache_key, None))
+        response, record = await asyncio.shield(pending)
+        if details is not None:
+            details.update(record)
+        return response
+    
+    async def compute_answer(self, cache_key: str, question: str, collection_filter: str = None, tag_filter: str = None,
+                             shards: List["LibraryShard"] = None):
+        """Consultar (respetando el límite de concurrencia) y guardar en caché: (Markdown, registro)"""
+        record = {}
+        # Limitar consultas simultáneas (llamadas LLM en paralelo)
+        async with self.query_semaphore:
+            response = await self.answer_question(question, collection_filter, tag_filter, record, shards)
+        if not response.startswith("❌"):
+            self.answer_cache.put(cache_key, response, record)
+        return response, record
+    
+    def cached_answer(self, cache_key: str, details: Dict = None) -> Optional[str]:
+        """Respuesta guardada para la clave, con una nota de caché al principio"""
+        start = time.perf_counter()
+        response = self.answer_cache.get(cache_key, details)
+        if response is None:
+            return None
+        if details is not None:
+            details['cached'] = True
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return f"> ⚡ *Respuesta desde caché en {elapsed_ms:.1f} ms · {self.answer_cache.stats()}*\n" + response
+    
+    def query_scopes(self, shards: List["LibraryShard"], collection_filter: str = None, tag_filter: str = None,
+                     linked: Dict["LibraryShard", set] = None):
+        """Índice a consultar en cada shard cargado: ([(shard, docs, dockeys, key_filter)], dockeys candidatos o None).
+        
+        `linked` (linked_documents) añade de otras bibliotecas solo los documentos enlazados desde estos shards.
+        """
+        scopes = [(shard, *shard.query_scope(collection_filter, tag_filter)) for shard in shards if shard.docs.docs]
+        scopes += [
+            (shard, *shard.query_scope(collection_filter, tag_filter, within=dockeys))
+            for shard, dockeys in (linked or {}).items()
+        ]
+        if not collection_filter and not tag_filter:
+            return [scope for scope in scopes if scope[2] is None or scope[2]], None
+        dockeys = set().union(*(scope[2] for scope in scopes))
+        return [scope for scope in scopes if scope[2]], dockeys
+    
+    async def gather_evidence(self, docs, question: str, candidates: list, get_callbacks=lambda name: None,
+                              spent: Dict = None):
+        """Resumir los fragmentos candidatos en orden de relevancia dentro del presupuesto.
+        
+        Los resúmenes se lanzan con SUMMARY_CONCURRENCY en paralelo y se deja de lanzar
+        al agotar las llamadas o los tokens; al vencer el plazo o reunir EVIDENCE_TARGET
+        evidencias con puntuación ≥ EVIDENCE_MIN_SCORE se cancelan los que sigan en curso.
+        `spent` es el presupuesto ya consumido en la misma consulta (se continúa desde él).
+        Devuelve (answer, presupuesto), con el motivo de parada en 'limited_by' (None si
+        se resumieron todos los candidatos).
+        """
+        from paperqa import Answer
+        answer = Answer(question=question)
+        spent = spent or {}
+        start = time.monotonic() - spent.get('seconds', 0.0)
+        deadline = start + SUMMARY_DEADLINE if SUMMARY_DEADLINE > 0 else None
+        pending = list(candidates)
+        running = set()
+        contexts = []
+        calls = spent.get('calls', 0)
+        tokens = spent.get('tokens', 0)
+        limited_by = None
+        
+        async def summarize(text):
+            view = docs.model_copy(update={'texts': [text]})
+            return await view.aget_evidence(
+                Answer(question=question, id=answer.id), k=1, max_sources=1,
+                get_callbacks=get_callbacks, disable_vector_search=True
+            )
+        
+        try:
+            while pending or running:
+                while pending and len(running) < max(1, SUMMARY_CONCURRENCY):
+                    if SUMMARY_MAX_CALLS and calls >= SUMMARY_MAX_CALLS:
+                        limited_by = 'llamadas'
+                        break
+                    if SUMMARY_MAX_TOKENS and tokens >= SUMMARY_MAX_TOKENS:
+                        limited_by = 'tokens'
+                        break
+                    running.add(asyncio.ensure_future(summarize(pending.pop(0))))
+                    calls += 1
+                if not running:
+                    break
+                
+                timeout = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    contexts.extend(result.contexts)
+                    tokens += merge_token_counts(answer.token_counts, result.token_counts)
+                
+                if not done:
+                    limited_by = 'plazo'
+                    break
+                if EVIDENCE_TARGET and sum(c.score >= EVIDENCE_MIN_SCORE for c in contexts) >= EVIDENCE_TARGET:
+                    if pending or running:
+                        limited_by = 'evidencia_suficiente'
+                    break
+        finally:
+            # Lo que siga en curso ya no cabe en el presupuesto
+            for task in running:
+                task.cancel()
+        
+        # Paper-QA ordena por puntuación, se queda con las mejores y compone el contexto
+        answer.contexts = contexts
+        answer = await docs.model_copy(update={'texts': []}).aget_evidence(answer, k=0, disable_vector_search=True)
+        budget = {
+            'candidates': spent.get('candidates', 0) + len(candidates),
+            'calls': calls,
+            'cancelled': spent.get('cancelled', 0) + len(running),
+            'tokens': tokens,
+            'seconds': round(time.monotonic() - start, 3),
+            'limited_by': limited_by,
+        }
+        metrics.inc("papermind_evidence_stop_total", reason=limited_by or "completo")
+        return answer, budget
+    
+    async def run_query(self, scopes: list, question: str, get_callbacks=lambda name: None, llm_result_callback=None):
+        """Consulta repartida entre bibliotecas con preselección híbrida.
+        
+        Cada shard preselecciona sus fragmentos en paralelo; los candidatos se intercalan por
+        rango y se resumen juntos dentro del presupuesto, así que las evidencias de todas las
+        bibliotecas compiten por la respuesta. Si la preselección no aporta evidencia (o está
+        desactivada) se recurre a la recuperación de Paper-QA en cada shard, salvo que la haya
+        cortado el presupuesto; sus fragmentos se resumen con el presupuesto que quede y
+        'fallback' lo indica. Devuelve (answer, presupuesto).
+        """
+        if llm_result_callback is not None:
+            # Copia superficial por consulta: el callback no se comparte ni se guarda con el índice
+            scopes = [
+                (shard, docs.model_copy(update={'llm_result_callback': llm_result_callback}), dockeys, key_filter)
+                for shard, docs, dockeys, key_filter in scopes
+            ]
+        docs = scopes[0][1]  # Modelos, prompts y callbacks comunes a todos los shards
+        answer = None
+        budget = None
+        candidates = []
+        if PREFILTER_K > 0:
+            with track("retrieve", libraries=len(scopes)) as event:
+                ranked = await asyncio.gather(*(
+                    shard.hybrid_candidates(shard_docs, question, dockeys) for shard, shard_docs, dockeys, _ in scopes
+                ))
+                # Mismo número de resúmenes que con un solo índice, repartido entre bibliotecas
+                candidates = merge_shard_texts(ranked)[:PREFILTER_K]
+                event['candidates'] = len(candidates)
+            if candidates:
+                print(f"🔎 Fragmentos preseleccionados (BM25 + vectorial) en {len(scopes)} biblioteca(s): {len(candidates)}")
+                view = docs.model_copy(update={'texts': candidates})
+                with track("summarize", candidates=len(candidates)) as event:
+                    answer, budget = await self.gather_evidence(view, question, candidates, get_callbacks)
+                    event.update(calls=budget['calls'], tokens=budget['tokens'], limited_by=budget['limited_by'], contexts=len(answer.contexts))
+                if budget['limited_by']:
+                    print(f"⏱️ Evidencia limitada por presupuesto ({budget['limited_by']}): "
+                          f"{budget['calls']}/{len(candidates)} resúmenes en {budget['seconds']:.1f} s")
+        
+        if answer is None or not (answer.contexts or budget['limited_by']):
+            with track("paperqa_query", libraries=len(scopes)) as event:
+                # Los fragmentos ya resumidos en la preselección no se vuelven a resumir
+                summarized = {(text.doc.dockey, text.text) for text in candidates}
+                fallback, matched = await self.fanout_evidence(scopes, question, get_callbacks, summarized)
+                view = docs.model_copy(update={'texts': fallback})
+                previous = answer
+                answer, budget = await self.gather_evidence(view, question, fallback, get_callbacks, budget)
+                budget['fallback'] = True
+                merge_token_counts(answer.token_counts, matched.token_counts)
+                if previous is not None:
+                    merge_token_counts(answer.token_counts, previous.token_counts)
+                event.update(candidates=len(fallback), calls=budget['calls'], tokens=budget['tokens'],
+                             limited_by=budget['limited_by'], contexts=len(answer.contexts))
+            print(f"🔁 Recuperación completa de Paper-QA en {len(scopes)} biblioteca(s): {len(fallback)} fragmentos, "
+                  f"{budget['calls']} resúmenes en la consulta")
+        
+        if answer.contexts:
+            with track("answer"):
+                answer = await docs.aquery(question, answer=answer, get_callbacks=get_callbacks)
+        elif budget is not None and budget['limited_by']:
+            # Sin evidencia dentro del presupuesto
+            answer.answer = "No se reunió evidencia suficiente dentro del presupuesto de la consulta."
+        else:
+            answer.answer = "No se encontró evidencia relevante en las bibliotecas consultadas."
+        
+        # Tokens y coste estimado de todas las llamadas LLM de la consulta
+        cost = answer_cost(answer)
+        for model, (prompt_tokens, completion_tokens) in answer.token_counts.items():
+            record_llm_usage(model, prompt_tokens, completion_tokens)
+        metrics.observe("papermind_query_cost_usd", cost, buckets=Metrics.COST_BUCKETS)
+        log_event("query_usage", tokens=answer.token_counts, total_tokens=merge_token_counts(None, answer.token_counts),
+                  cost_usd=round(cost, 6), fallback=bool(budget and budget.get('fallback')),
+                  limited_by=budget['limited_by'] if budget else None)
+        return answer, budget
+    
+    async def fanout_evidence(self, scopes: list, question: str, get_callbacks=lambda name: None, exclude: set = ()):
+        """Fragmentos de la recuperación completa de Paper-QA en todos los shards, sin resumir.
+        
+        Como con un solo índice: una preselección de documentos por el LLM sobre los de todas
+        las bibliotecas y FALLBACK_K fragmentos en total, intercalados por rango entre shards.
+        Los resume gather_evidence con el presupuesto de la consulta. Devuelve (fragmentos,
+        answer con los tokens de la preselección de documentos).
+        """
+        from paperqa import Answer
+        matched = Answer(question=question)
+        
+        # Como Docs.aquery: con muchos documentos, el LLM preselecciona los relevantes
+        # (los shards ya acotados por filtros, key_filter False, no lo necesitan)
+        matchable = [docs for _, docs, _, key_filter in scopes if key_filter is not False]
+        dockey_filter = None
+        if any(key_filter for *_, key_filter in scopes) or sum(len(docs.docs) for docs in matchable) > 10:
+            merged_docs = {dockey: doc for docs in matchable for dockey, doc in docs.docs.items()}
+            docs_index = matchable[0].docs_index.model_copy()
+            docs_index.clear()
+            docs_index.add_texts_and_embeddings(list(merged_docs.values()))
+            view = matchable[0].model_copy(update={
+                'docs': merged_docs,
+                'docs_index': docs_index,
+                'deleted_dockeys': set().union(*(docs.deleted_dockeys for docs in matchable)),
+            })
+            dockey_filter = await view.adoc_match(question, get_callbacks=get_callbacks, answer=matched) or None
+        
+        async def shard_candidates(shard, docs, key_filter):
+            texts = await shard.vector_candidates(docs, question, dockey_filter if key_filter is not False else None, FALLBACK_K)
+            return [text for text in texts if (text.doc.dockey, text.text) not in exclude]
+        
+        ranked = await asyncio.gather(*(shard_candidates(shard, docs, key_filter) for shard, docs, _, key_filter in scopes))
+        # Mismo número de resúmenes que con un solo índice, repartido entre bibliotecas
+        return merge_shard_texts(ranked)[:FALLBACK_K], matched
+    
+    def format_answer(self, question: str, answer, collection_filter: str = None, tag_filter: str = None, dockeys: set = None,
+                      budget: Dict = None, shards: List["LibraryShard"] = None) -> str:
+        """Respuesta final en Markdown con metadatos enriquecidos y fuentes"""
+        # Contar fuentes por tipo en las bibliotecas consultadas
+        shards = shards or list(self.shards.values())
+        zotero_count = sum(shard.stats().get('files', 0) for shard in shards if shard.source == 'zotero')
+        local_count = sum(shard.stats().get('files', 0) for shard in shards if shard.source == 'local')
+        
+        # Formatear respuesta con metadatos enriquecidos
+        formatted_response = f"""
+## 🎯 Pregunta: {question}
+
+### 📝 Respuesta (Biblioteca Unificada):
+
+{answer.answer}
+
+### 📚 Información de la consulta:
+- **📊 Biblioteca total**: {zotero_count + local_count} documentos
+- **🗂️ Bibliotecas consultadas**: {', '.join(shard.name for shard in shards)}
+- **🔗 Papers Zotero**: {zotero_count} (con metadatos enriquecidos)
+- **📁 Papers locales**: {local_count} (documentos personales)
+- **🔍 Contextos utilizados**: {len(answer.contexts)}
+- **💰 Tokens / coste estimado**: {merge_token_counts(None, answer.token_counts)} tokens · ${answer_cost(answer):.4f}
+"""
+        
+        if collection_filter:
+            formatted_response += f"- **📁 Filtro colección**: {collection_filter}\n"
+        if tag_filter:
+            formatted_response += f"- **🏷️ Filtro etiqueta**: {tag_filter}\n"
+        if dockeys is not None:
+            formatted_response += f"- **🎯 Documentos candidatos**: {len(dockeys)}\n"
+        if budget is not None:
+            formatted_response += f"- **⏱️ Evidencia**: {budget['calls']}/{budget['candidates']} fragmentos resumidos en {budget['seconds']:.1f} s"
+            if budget['limited_by']:
+                formatted_response += f" · limitada por **{BUDGET_LIMITS[budget['limited_by']]}**"
+            if budget.get('fallback'):
+                formatted_response += " · con recuperación completa de Paper-QA"
+            formatted_response += "\n"
+        
+        formatted_response += "\n### 🔍 Fuentes utilizadas:\n"
+        
+        # Mostrar contextos con identificación de origen (búsqueda directa por dockey)
+        for number, context in enumerate(answer.contexts[:3], start=1):
+            formatted_response += self.format_source(context, number)
+        
+        formatted_response += f"""
 ### 📋 Resumen de la consulta:
 - ✅ **Búsqueda en biblioteca unificada** (Zotero + Local)
 - 🔍 **Análisis semántico** con Paper-QA v4
@@ -444,173 +3487,565 @@ class ZoteroPaperQAIntegration:
 
 *Respuesta generada por PaperMind v1.0 - Biblioteca Académica Inteligente*
 """
+        
+        return formatted_response
+    
+    def answer_record(self, answer, dockeys: set = None, budget: Dict = None) -> Dict:
+        """Respuesta, fuentes y consumo en forma estructurada (salida JSONL del modo por lotes)"""
+        sources = []
+        for number, context in enumerate(answer.contexts, start=1):
+            shard, (source, metadata, path) = self.source_of(context.text.doc.dockey)
+            sources.append({
+                'number': number,
+                'origin': source,
+                'library': shard.id if shard else None,
+                'citation': context.text.doc.citation,
+                'chunk': context.text.name,
+                'score': context.score,
+                'summary': context.context,
+                'path': path,
+                'zotero_key': metadata.get('key'),
+                'title': metadata.get('title'),
+                'authors': metadata.get('authors', []),
+                'year': metadata.get('year'),
+                'doi': metadata.get('doi'),
+            })
+        return {
+            'answer': answer.answer,
+            'references': answer.references,
+            'sources': sources,
+            'candidates': len(dockeys) if dockeys is not None else None,
+            'tokens': answer.token_counts,
+            'cost_usd': round(answer_cost(answer), 6),
+            'evidence_budget': budget,
+        }
+    
+    async def answer_question(self, question: str, collection_filter: str = None, tag_filter: str = None, details: Dict = None,
+                              shards: List["LibraryShard"] = None):
+        """Ejecutar la consulta en las bibliotecas indicadas (todas por defecto) y formatear la respuesta"""
+        try:
+            print(f"🤖 Pregunta: {question}")
+            if collection_filter:
+                print(f"📁 Filtro de colección: {collection_filter}")
+            if tag_filter:
+                print(f"🏷️ Filtro de etiqueta: {tag_filter}")
             
-            return formatted_response
-            
+            shards = shards or list(self.shards.values())
+            linked = self.linked_documents(shards)
+            async with self.use_shards(shards + list(linked)):
+                # Aplicar filtros antes de la recuperación
+                scopes, dockeys = self.query_scopes(shards, collection_filter, tag_filter, linked)
+                if dockeys is not None:
+                    if not dockeys:
+                        return "❌ Ningún documento cargado coincide con los filtros seleccionados."
+                    print(f"🎯 Documentos candidatos: {len(dockeys)}/{sum(len(shard.docs.docs) for shard in shards)}")
+                if not scopes:
+                    return "❌ No hay documentos cargados. Usa 'Cargar Papers en Paper-QA' primero."
+                
+                # Hacer pregunta a Paper-QA en todas las bibliotecas a la vez
+                answer, budget = await self.run_query(scopes, question)
+                if details is not None:
+                    details.update(self.answer_record(answer, dockeys, budget))
+                return self.format_answer(question, answer, collection_filter, tag_filter, dockeys, budget, shards)
+        
         except Exception as e:
             return f"❌ Error: {str(e)}"
+    
+    @tracked("query_stream")
+    async def stream_question(self, question: str, collection_filter: str = None, tag_filter: str = None,
+                              libraries: List[str] = None):
+        """Versión en streaming: progreso de recuperación, evidencias, tokens de la respuesta y fuentes"""
+        if not self.ready.is_set():
+            yield "⏳ Cargando el índice guardado..."
+        error = await self.wait_ready()
+        if error:
+            yield error
+            return
+        try:
+            shards = self.select_shards(libraries)
+        except ValueError as e:
+            yield str(e)
+            return
+        if not any(shard.stats().get('files') for shard in shards):
+            yield "❌ No hay documentos cargados. Usa 'Cargar Papers en Paper-QA' primero."
+            return
+        
+        cache_key = AnswerCache.make_key(question, collection_filter, tag_filter, self.index_version_of(shards))
+        cached = self.cached_answer(cache_key)
+        if cached:
+            yield cached
+            return
+        
+        linked = self.linked_documents(shards)
+        async with self.query_semaphore, self.use_shards(shards + list(linked)):
+            scopes, dockeys = self.query_scopes(shards, collection_filter, tag_filter, linked)
+            if dockeys is not None and not dockeys:
+                yield "❌ Ningún documento cargado coincide con los filtros seleccionados."
+                return
+            if not scopes:
+                yield "❌ No hay documentos cargados. Usa 'Cargar Papers en Paper-QA' primero."
+                return
+            
+            evidence = []
+            answer_tokens = []
+            
+            async def on_llm_result(result):
+                # Cada resumen de evidencia llega en cuanto el LLM lo puntúa
+                if result.name and result.name.startswith("evidence:"):
+                    if "not applicable" not in result.text.lower() and "not relevant" not in result.text.lower():
+                        evidence.append((result.name[len("evidence:"):], result.text))
+            
+            def get_callbacks(name):
+                # Solo la respuesta final se pide en streaming, token a token
+                return [answer_tokens.append] if name == "answer" else None
+            
+            task = asyncio.create_task(self.run_query(scopes, question, get_callbacks, on_llm_result))
+            candidates = len(dockeys) if dockeys is not None else sum(len(shard.docs.docs) for shard, *_ in scopes)
+            
+            try:
+                while not task.done():
+                    partial = f"## 🎯 Pregunta: {question}\n\n"
+                    if not answer_tokens:
+                        partial += f"⏳ *Recuperando y evaluando evidencia entre {candidates} documentos... ({len(evidence)} fragmentos evaluados)*\n\n"
+                    if evidence:
+                        partial += f"### 🔍 Evidencia encontrada ({len(evidence)}):\n"
+                        for name, summary in evidence[-5:]:
+                            snippet = summary.strip().replace("\n", " ")
+                            partial += f"- **{name}**: {snippet[:200]}{'...' if len(snippet) > 200 else ''}\n"
+                    if answer_tokens:
+                        partial += f"\n### 📝 Respuesta (generando...):\n\n{''.join(answer_tokens)}"
+                    yield partial
+                    await asyncio.wait({task}, timeout=0.2)
+                
+                answer, budget = task.result()
+            except Exception as e:
+                yield f"❌ Error: {str(e)}"
+                return
+            finally:
+                # Si el cliente se desconecta, no seguir gastando llamadas LLM
+                if not task.done():
+                    task.cancel()
+            
+            response = self.format_answer(question, answer, collection_filter, tag_filter, dockeys, budget, shards)
+            self.answer_cache.put(cache_key, response, self.answer_record(answer, dockeys, budget))
+            yield response
 
-# Inicializar integración
-integration = ZoteroPaperQAIntegration()
+# La integración se crea al arrancar la aplicación, no al importar el módulo
+integration: Optional[ZoteroPaperQAIntegration] = None
 
 # Funciones para Gradio
 def detect_user():
-    return integration.detect_user_id()
+    import gradio as gr
+    status = integration.detect_user_id()
+    # La detección descubre los grupos Zotero: se añaden como bibliotecas consultables
+    return status, gr.update(choices=integration.library_choices())
 
 def get_collections():
-    return integration.get_collections()
+    import gradio as gr
+    status = integration.get_collections()
+    names = integration.collection_names()
+    return (
+        status,
+        gr.update(choices=["Ninguna"] + list(integration.collections)),
+        gr.update(choices=["Todas"] + names),
+        gr.update(choices=["Todas"] + names)
+    )
 
 def add_by_doi(doi, collection):
     if not doi.strip():
         return "❌ Ingresa un DOI válido"
     return integration.add_item_by_doi(doi.strip(), collection if collection != "Ninguna" else None)
 
-def sync_zotero(collection):
-    return integration.sync_zotero_to_paperqa(collection if collection != "Todas" else None)
+def bulk_import(doi_text, bib_file, collection):
+    text = doi_text or ""
+    if bib_file:
+        with open(bib_file, encoding='utf-8', errors='ignore') as f:
+            text += "\n" + f.read()
+    dois = extract_dois(text)
+    if not dois:
+        return "❌ No se encontraron DOIs en el texto ni en el archivo"
+    return integration.import_dois(dois, collection if collection != "Ninguna" else None)
 
-def load_papers_sync():
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(integration.load_papers_to_paperqa())
-            return result
-        finally:
-            loop.close()
-    except Exception as e:
-        return f"❌ Error: {str(e)}"
+# Los handlers async se ejecutan en el event loop persistente de Gradio,
+# que comparte el índice y las conexiones HTTP entre consultas.
+# Sincronizar y cargar son tareas en segundo plano: el clic vuelve enseguida y el
+# temporizador de tareas muestra el progreso hasta que terminan.
+async def sync_zotero(collection):
+    import gradio as gr
+    collection_name = collection if collection != "Todas" else None
+    job = integration.jobs.start(
+        "sync", "Sincronización Zotero",
+        lambda job: integration.sync_zotero_and_update_index(collection_name, job)
+    )
+    return job.progress(), gr.Timer(active=True)
+
+async def load_papers():
+    import gradio as gr
+    job = integration.jobs.start("load", "Carga de la biblioteca", integration.load_papers_to_paperqa)
+    return job.progress(), gr.Timer(active=True)
+
+def cancel_job(kind):
+    return integration.jobs.cancel(kind)
 
-def ask_with_filters(question, collection, tag):
+def jobs_status():
+    """Progreso de sincronización y carga; al terminar actualiza etiquetas y detiene el temporizador"""
+    import gradio as gr
+    running = any(integration.jobs.running(kind) for kind in ("sync", "load"))
+    tags = gr.update() if running else gr.update(choices=["Todas"] + integration.tag_names())
+    return integration.jobs.status("sync"), integration.jobs.status("load"), tags, gr.Timer(active=running)
+
+async def ask_with_filters(question, collection, tag, libraries=None, streaming=True):
     if not question.strip():
-        return "❓ Ingresa una pregunta"
+        yield "❓ Ingresa una pregunta"
+        return
     
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            collection_filter = collection if collection != "Todas" else None
-            tag_filter = tag if tag != "Todas" else None
-            result = loop.run_until_complete(
-                integration.ask_question_with_filters(question, collection_filter, tag_filter)
-            )
-            return result
-        finally:
-            loop.close()
+        collection_filter = collection if collection != "Todas" else None
+        tag_filter = tag if tag != "Todas" else None
+        if streaming:
+            async for partial in integration.stream_question(question, collection_filter, tag_filter, libraries):
+                yield partial
+        else:
+            yield await integration.ask_question_with_filters(question, collection_filter, tag_filter, libraries=libraries)
     except Exception as e:
-        return f"❌ Error: {str(e)}"
+        yield f"❌ Error: {str(e)}"
 
 # Interfaz Gradio
-with gr.Blocks(title="PaperMind - Biblioteca Académica Inteligente", theme=gr.themes.Soft()) as demo:
-    gr.Markdown("# 🧠 PaperMind: Biblioteca Académica Inteligente")
-    gr.Markdown("*Zotero + Papers Locales + IA: La evolución de la gestión bibliográfica académica*")
-    
-    # Configuración Zotero
-    with gr.Tab("🔧 Configuración Zotero"):
-        with gr.Row():
-            detect_btn = gr.Button("🔍 Detectar Usuario Zotero", variant="primary")
-            collections_btn = gr.Button("📚 Obtener Colecciones", variant="secondary")
-        
-        status_config = gr.Textbox(label="📋 Estado de Configuración", interactive=False, max_lines=10)
-        
-        detect_btn.click(fn=detect_user, outputs=[status_config])
-        collections_btn.click(fn=get_collections, outputs=[status_config])
-    
-    # Añadir papers
-    with gr.Tab("➕ Añadir Papers"):
-        with gr.Row():
-            doi_input = gr.Textbox(label="📄 DOI/PMID", placeholder="10.1038/nature12373 o PMC4234567")
-            collection_dropdown = gr.Dropdown(
-                label="📁 Colección", 
-                choices=["Ninguna"], 
-                value="Ninguna"
-            )
+def readiness_status():
+    """Estado de carga del índice; al terminar actualiza etiquetas y detiene el temporizador"""
+    import gradio as gr
+    ready = integration.ready.is_set()
+    tags = gr.update(choices=["Todas"] + integration.tag_names()) if ready else gr.update()
+    return integration.readiness(), tags, gr.Timer(active=not ready)
+
+def build_ui():
+    # Gradio se importa aquí: el módulo se puede usar sin interfaz (benchmark, scripts)
+    import gradio as gr
+    with gr.Blocks(title="PaperMind - Biblioteca Académica Inteligente", theme=gr.themes.Soft()) as demo:
+        gr.Markdown("# 🧠 PaperMind: Biblioteca Académica Inteligente")
+        gr.Markdown("*Zotero + Papers Locales + IA: La evolución de la gestión bibliográfica académica*")
+        readiness_output = gr.Markdown(integration.readiness())
+        readiness_timer = gr.Timer(1.0)
+    
+        # Configuración Zotero
+        with gr.Tab("🔧 Configuración Zotero"):
+            with gr.Row():
+                detect_btn = gr.Button("🔍 Detectar Usuario Zotero", variant="primary")
+                collections_btn = gr.Button("📚 Obtener Colecciones", variant="secondary")
         
-        add_btn = gr.Button("🚀 Añadir a Zotero + Descargar PDF", variant="primary")
-        status_add = gr.Textbox(label="📋 Estado de Descarga", interactive=False, max_lines=8)
+            status_config = gr.Textbox(label="📋 Estado de Configuración", interactive=False, max_lines=10)
         
-        add_btn.click(fn=add_by_doi, inputs=[doi_input, collection_dropdown], outputs=[status_add])
     
-    # Sincronización
-    with gr.Tab("🔄 Sincronización"):
-        with gr.Row():
-            sync_collection = gr.Dropdown(
-                label="📁 Sincronizar Colección", 
-                choices=["Todas"], 
-                value="Todas"
-            )
-            sync_btn = gr.Button("🔄 Sincronizar Zotero → Paper-QA", variant="primary")
+        # Añadir papers
+        with gr.Tab("➕ Añadir Papers"):
+            with gr.Row():
+                doi_input = gr.Textbox(label="📄 DOI/PMID", placeholder="10.1038/nature12373 o PMC4234567")
+                collection_dropdown = gr.Dropdown(
+                    label="📁 Colección", 
+                    choices=["Ninguna"] + list(integration.collections), 
+                    value="Ninguna"
+                )
         
-        status_sync = gr.Textbox(label="📋 Estado de Sincronización", interactive=False, max_lines=10)
+            add_btn = gr.Button("🚀 Añadir a Zotero + Descargar PDF", variant="primary")
+            status_add = gr.Textbox(label="📋 Estado de Descarga", interactive=False, max_lines=8)
         
-        load_btn = gr.Button("📚 Cargar Biblioteca Completa (Zotero + Local)", variant="secondary")
-        status_load = gr.Textbox(label="📋 Estado de Carga Unificada", interactive=False, max_lines=8)
+            add_btn.click(fn=add_by_doi, inputs=[doi_input, collection_dropdown], outputs=[status_add])
         
-        sync_btn.click(fn=sync_zotero, inputs=[sync_collection], outputs=[status_sync])
-        load_btn.click(fn=load_papers_sync, outputs=[status_load])
+            # Importación masiva
+            with gr.Row():
+                bulk_dois = gr.Textbox(label="📋 Lista de DOIs (uno por línea)", lines=4)
+                bulk_file = gr.File(label="📎 Bibliografía BibTeX / RIS", file_types=[".bib", ".ris", ".txt"], type="filepath")
+        
+            bulk_btn = gr.Button("📚 Importar en bloque a Zotero", variant="secondary")
+            status_bulk = gr.Textbox(label="📋 Estado de Importación", interactive=False, max_lines=12)
+        
+            bulk_btn.click(fn=bulk_import, inputs=[bulk_dois, bulk_file, collection_dropdown], outputs=[status_bulk])
     
-    # Consultas inteligentes
-    with gr.Tab("🎯 Consultas Inteligentes"):
-        with gr.Row():
-            question_input = gr.Textbox(
-                label="🤔 Tu pregunta", 
-                placeholder="¿Qué metodologías de investigación aparecen en mis papers de Zotero y locales?",
-                lines=2
-            )
+        # Sincronización
+        with gr.Tab("🔄 Sincronización"):
+            with gr.Row():
+                sync_collection = gr.Dropdown(
+                    label="📁 Sincronizar Colección", 
+                    choices=["Todas"] + integration.collection_names(), 
+                    value="Todas"
+                )
+                sync_btn = gr.Button("🔄 Sincronizar Zotero → Paper-QA", variant="primary")
+                sync_cancel_btn = gr.Button("⏹️ Cancelar", variant="stop", scale=0)
         
-        with gr.Row():
-            filter_collection = gr.Dropdown(
-                label="📁 Filtrar por Colección", 
-                choices=["Todas"], 
-                value="Todas"
-            )
-            filter_tag = gr.Dropdown(
-                label="🏷️ Filtrar por Etiqueta", 
-                choices=["Todas"], 
-                value="Todas"
-            )
+            status_sync = gr.Textbox(label="📋 Estado de Sincronización", value=integration.jobs.status("sync"), interactive=False, max_lines=10)
+        
+            with gr.Row():
+                load_btn = gr.Button("📚 Cargar Biblioteca Completa (Zotero + Local)", variant="secondary")
+                load_cancel_btn = gr.Button("⏹️ Cancelar", variant="stop", scale=0)
+            status_load = gr.Textbox(label="📋 Estado de Carga Unificada", value=integration.jobs.status("load"), interactive=False, max_lines=8)
+            jobs_timer = gr.Timer(1.0, active=False)
+        
+            load_btn.click(fn=load_papers, outputs=[status_load, jobs_timer])
+            sync_cancel_btn.click(fn=lambda: cancel_job("sync"), outputs=[status_sync])
+            load_cancel_btn.click(fn=lambda: cancel_job("load"), outputs=[status_load])
+    
+        # Consultas inteligentes
+        with gr.Tab("🎯 Consultas Inteligentes"):
+            with gr.Row():
+                question_input = gr.Textbox(
+                    label="🤔 Tu pregunta", 
+                    placeholder="¿Qué metodologías de investigación aparecen en mis papers de Zotero y locales?",
+                    lines=2
+                )
         
-        ask_btn = gr.Button("🚀 Consultar Biblioteca Unificada", variant="primary")
-        answer_output = gr.Markdown(label="🎯 Respuesta Enriquecida")
+            with gr.Row():
+                filter_collection = gr.Dropdown(
+                    label="📁 Filtrar por Colección", 
+                    choices=["Todas"] + integration.collection_names(), 
+                    value="Todas"
+                )
+                filter_tag = gr.Dropdown(
+                    label="🏷️ Filtrar por Etiqueta", 
+                    choices=["Todas"] + integration.tag_names(), 
+                    value="Todas"
+                )
+                filter_libraries = gr.CheckboxGroup(
+                    label="🗂️ Bibliotecas (ninguna = todas)",
+                    choices=integration.library_choices(),
+                    value=[]
+                )
         
-        ask_btn.click(fn=ask_with_filters, inputs=[question_input, filter_collection, filter_tag], outputs=[answer_output])
-        question_input.submit(fn=ask_with_filters, inputs=[question_input, filter_collection, filter_tag], outputs=[answer_output])
+                streaming_checkbox = gr.Checkbox(label="⚡ Respuesta en streaming", value=True)
+        
+            ask_btn = gr.Button("🚀 Consultar Biblioteca Unificada", variant="primary")
+            answer_output = gr.Markdown(label="🎯 Respuesta Enriquecida")
+        
+            ask_btn.click(
+                fn=ask_with_filters, inputs=[question_input, filter_collection, filter_tag, filter_libraries, streaming_checkbox], outputs=[answer_output],
+                concurrency_limit=QUERY_CONCURRENCY, concurrency_id="consultas"
+            )
+            question_input.submit(
+                fn=ask_with_filters, inputs=[question_input, filter_collection, filter_tag, filter_libraries, streaming_checkbox], outputs=[answer_output],
+                concurrency_id="consultas"
+            )
+    
+        # Eventos que actualizan los filtros de otras pestañas
+        detect_btn.click(fn=detect_user, outputs=[status_config, filter_libraries])
+        collections_btn.click(fn=get_collections, outputs=[status_config, collection_dropdown, sync_collection, filter_collection])
+        sync_btn.click(fn=sync_zotero, inputs=[sync_collection], outputs=[status_sync, jobs_timer])
+        jobs_timer.tick(fn=jobs_status, outputs=[status_sync, status_load, filter_tag, jobs_timer])
+        readiness_timer.tick(fn=readiness_status, outputs=[readiness_output, filter_tag, readiness_timer])
+    
+        # Información del sistema
+        gr.Markdown(f"""    
+        ### 🔬 Características del Sistema:
+        - **📚 Biblioteca unificada**: Combina papers Zotero + papers locales
+        - **🔗 Gestión automática**: Metadatos normalizados desde Crossref
+        - **📥 Descarga inteligente**: PDFs automáticos desde DOI/PMID
+        - **📁 Organización**: Colecciones y etiquetas de Zotero
+        - **🔍 Consultas filtradas**: Busca en ambas fuentes simultáneamente
+        - **👥 Bibliotecas de grupo**: Cada biblioteca Zotero (personal y grupos) tiene su propio índice y se consultan a la vez
+        - **📖 Citaciones**: Referencias automáticas en formato académico
+        - **🎯 Identificación de origen**: Distingue fuentes Zotero vs locales
+    
+        ### 📂 Directorios:
+        - **Zotero**: {PAPERS_DIR}
+        - **Local**: {LOCAL_PAPERS_DIR}
+    
+        ### 🎯 Flujo de trabajo:
+        1. **Configurar**: Detecta usuario y obtén colecciones Zotero
+        2. **Añadir**: Introduce DOIs para descarga automática en Zotero
+        3. **Sincronizar**: Conecta ambas bibliotecas con Paper-QA
+        4. **Consultar**: Haz preguntas sobre toda tu biblioteca académica
+    
+        ### 💡 Ventajas de la biblioteca unificada:
+        - ✅ **Acceso total**: Consulta papers de ambas fuentes en una sola búsqueda
+        - ✅ **Flexibilidad**: Mantén papers locales separados de Zotero
+        - ✅ **Metadatos enriquecidos**: Papers Zotero con información completa
+        - ✅ **Identificación clara**: Distingue origen de cada respuesta
+    
+        ---
+    
+        ### 👨‍💻 Desarrollado por
+        **PaperMind v1.0** - Creado con ❤️ por **{os.getenv('USER', 'Usuario')}**
+    
+        *🚀 Potenciando la investigación académica con IA desde 2024*
     
-    # Información del sistema
-    gr.Markdown(f"""    
-    ### 🔬 Características del Sistema:
-    - **📚 Biblioteca unificada**: Combina papers Zotero + papers locales
-    - **🔗 Gestión automática**: Metadatos normalizados desde Crossref
-    - **📥 Descarga inteligente**: PDFs automáticos desde DOI/PMID
-    - **📁 Organización**: Colecciones y etiquetas de Zotero
-    - **🔍 Consultas filtradas**: Busca en ambas fuentes simultáneamente
-    - **📖 Citaciones**: Referencias automáticas en formato académico
-    - **🎯 Identificación de origen**: Distingue fuentes Zotero vs locales
+        📧 ¿Sugerencias o mejoras? ¡Abre un issue en el repositorio!
+        """)
+    return demo
+
+@asynccontextmanager
+async def watcher_lifespan(app):
+    """Arrancar el vigilante de directorios junto al servidor, en su mismo event loop"""
+    watcher = integration.start_watching() if WATCH_DIRS else None
+    try:
+        yield
+    finally:
+        if watcher:
+            watcher.stop()
+        integration.shutdown_parse_pool()
+
+# Modo por lotes (sin interfaz): muchas preguntas contra la biblioteca, resultados en JSONL
+def load_questions(path: str, collection_filter: str = None, tag_filter: str = None,
+                   libraries: List[str] = None) -> List[Dict]:
+    """Preguntas de un .txt (una por línea, '#' para comentarios) o de un .jsonl.
     
-    ### 📂 Directorios:
-    - **Zotero**: {PAPERS_DIR}
-    - **Local**: {LOCAL_PAPERS_DIR}
+    En JSONL cada línea lleva "question" y, opcionalmente, "collection", "tag", "libraries"
+    (ids o nombres de biblioteca) e "id"; los filtros de la línea de comandos se aplican
+    a las que no los indican.
+    """
+    questions = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith('.jsonl'):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"❌ Línea {number} de {path} no es JSON válido: {e}")
+                if not entry.get('question'):
+                    raise ValueError(f"❌ Línea {number} de {path} sin campo 'question'")
+            else:
+                entry = {'question': line}
+            entry.setdefault('collection', collection_filter)
+            entry.setdefault('tag', tag_filter)
+            entry.setdefault('libraries', libraries)
+            entry.setdefault('id', question_id(entry['question'], entry['collection'], entry['tag'], entry['libraries']))
+            questions.append(entry)
+    return questions
+
+def question_id(question: str, collection_filter: str = None, tag_filter: str = None, libraries: List[str] = None) -> str:
+    """Identificador estable de una pregunta con sus filtros (para reanudar lotes)"""
+    key = [question.strip(), collection_filter or '', tag_filter or '']
+    if libraries:
+        # Sin bibliotecas el identificador no cambia: los lotes anteriores se siguen reanudando
+        key.append(sorted(libraries))
+    raw = json.dumps(key, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def completed_ids(output: str) -> set:
+    """Preguntas ya respondidas en un archivo de salida previo (los errores se repiten)"""
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Última línea a medio escribir si el lote se interrumpió
+            if isinstance(record, dict) and not record.get('error'):
+                done.add(record.get('id'))
+    return done
+
+async def run_batch(questions_path: str, output: str, collection_filter: str = None, tag_filter: str = None,
+                    concurrency: int = QUERY_CONCURRENCY, libraries: List[str] = None) -> int:
+    """Responder un archivo de preguntas y añadir un registro JSONL por respuesta.
     
-    ### 🎯 Flujo de trabajo:
-    1. **Configurar**: Detecta usuario y obtén colecciones Zotero
-    2. **Añadir**: Introduce DOIs para descarga automática en Zotero
-    3. **Sincronizar**: Conecta ambas bibliotecas con Paper-QA
-    4. **Consultar**: Haz preguntas sobre toda tu biblioteca académica
+    Usa la misma lógica que la interfaz (ask_question_with_filters): caché de respuestas,
+    preguntas repetidas compartidas y, como mucho, `concurrency` consultas a la vez.
+    Devuelve el código de salida del proceso (1 si alguna pregunta falló).
+    """
+    try:
+        questions = load_questions(questions_path, collection_filter, tag_filter, libraries)
+    except (OSError, ValueError) as e:
+        print(e if str(e).startswith("❌") else f"❌ No se pudo leer {questions_path}: {e}")
+        return 2
+    done = completed_ids(output)
+    pending, seen = [], set(done)
+    for entry in questions:
+        if entry['id'] not in seen:
+            seen.add(entry['id'])
+            pending.append(entry)
+    print(f"📋 {len(questions)} preguntas: {len(questions) - len(pending)} ya respondidas, {len(pending)} pendientes")
+    if not pending:
+        return 0
     
-    ### 💡 Ventajas de la biblioteca unificada:
-    - ✅ **Acceso total**: Consulta papers de ambas fuentes en una sola búsqueda
-    - ✅ **Flexibilidad**: Mantén papers locales separados de Zotero
-    - ✅ **Metadatos enriquecidos**: Papers Zotero con información completa
-    - ✅ **Identificación clara**: Distingue origen de cada respuesta
+    integration.query_semaphore = asyncio.Semaphore(max(1, concurrency))
+    error = await integration.wait_ready()
+    if error:
+        print(error)
+        return 2
+    print(integration.readiness())
     
-    ---
+    # Si el lote anterior se cortó a mitad de línea, empezar en una línea nueva
+    if os.path.exists(output) and os.path.getsize(output):
+        with open(output, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
     
-    ### 👨‍💻 Desarrollado por
-    **PaperMind v1.0** - Creado con ❤️ por **{os.getenv('USER', 'Usuario')}**
+    queue = asyncio.Queue()
+    for entry in pending:
+        queue.put_nowait(entry)
+    counts = Counter()
+    start = time.perf_counter()
     
-    *🚀 Potenciando la investigación académica con IA desde 2024*
+    with open(output, 'a', encoding='utf-8') as out:
+        if needs_newline:
+            out.write("\n")
+        
+        async def worker():
+            while not queue.empty():
+                entry = queue.get_nowait()
+                details = {}
+                question_start = time.perf_counter()
+                try:
+                    response = await integration.ask_question_with_filters(
+                        entry['question'], entry['collection'], entry['tag'], details, entry['libraries'])
+                    error = response[2:].strip() if response.startswith("❌") else None
+                except Exception as e:
+                    response, error = "", str(e)
+                record = {
+                    'id': entry['id'],
+                    'question': entry['question'],
+                    'collection': entry['collection'],
+                    'tag': entry['tag'],
+                    'libraries': entry['libraries'],
+                    **details,
+                    'markdown': response,
+                    'seconds': round(time.perf_counter() - question_start, 3),
+                    'index_version': integration.index_version,
+                    'error': error,
+                }
+                # Una línea completa por respuesta: lo escrito sobrevive a una interrupción
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+                counts['errores' if error else 'cacheadas' if details.get('cached') else 'respondidas'] += 1
+                finished = sum(counts.values())
+                print(f"{'❌' if error else '✅'} [{finished}/{len(pending)}] {entry['question'][:80]}")
+        
+        # Tantos trabajadores como consultas simultáneas: el resto espera en la cola, no en memoria
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
     
-    📧 ¿Sugerencias o mejoras? ¡Abre un issue en el repositorio!
-    """)
+    elapsed = time.perf_counter() - start
+    print(f"🏁 Lote terminado en {elapsed:.1f} s: {counts['respondidas']} respondidas, "
+          f"{counts['cacheadas']} desde caché, {counts['errores']} con error → {output}")
+    return 1 if counts['errores'] else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PaperMind: interfaz web o preguntas por lotes sin interfaz")
+    parser.add_argument("--batch", metavar="PREGUNTAS", help="archivo .txt (una pregunta por línea) o .jsonl a responder sin interfaz")
+    parser.add_argument("--output", default="respuestas.jsonl", help="archivo JSONL de resultados; si existe, se reanuda (por defecto: %(default)s)")
+    parser.add_argument("--collection", help="filtro de colección para las preguntas que no indican otro")
+    parser.add_argument("--tag", help="filtro de etiqueta para las preguntas que no indican otro")
+    parser.add_argument("--library", action="append", dest="libraries", metavar="BIBLIOTECA",
+                        help="biblioteca a consultar (id o nombre; repetible, por defecto todas)")
+    parser.add_argument("--concurrency", type=int, default=QUERY_CONCURRENCY, help="consultas simultáneas (por defecto: %(default)s)")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    demo.launch(share=False, server_name="localhost", server_port=7860) 
\ No newline at end of file
+    args = parse_args()
+    if args.batch:
+        # Sin interfaz ni /metrics: solo hace falta el índice local (Zotero no se consulta)
+        check_api_keys(require_zotero=False)
+        start_observability(serve_metrics=False)
+        integration = ZoteroPaperQAIntegration()
+        sys.exit(asyncio.run(run_batch(args.batch, args.output, args.collection, args.tag, args.concurrency, args.libraries)))
+    
+    check_api_keys()
+    start_observability()
+    integration = ZoteroPaperQAIntegration()
+    integration.start_warm_up()
+    demo = build_ui()
+    demo.queue(default_concurrency_limit=QUERY_CONCURRENCY)
+    demo.launch(share=False, server_name="localhost", server_port=7860, app_kwargs={"lifespan": watcher_lifespan}) 
\ No newline at end of file
@@ -0,0 +1,1001 @@
+"""Benchmark offline de PaperMind.
+
+Levanta servidores locales que imitan la API v3 de Zotero (paginación, versiones,
+cabeceras Backoff), Crossref (/works) y OpenAI (chat y embeddings), genera un
+corpus sintético de PDFs y mide:
+
+- Ingesta: documentos/segundo al cargar el corpus (y re-escaneo sin cambios)
+- Sincronización Zotero según el tamaño de la biblioteca (completa e incremental)
+- Emparejamiento item ↔ PDF: precisión y exhaustividad frente a la verdad conocida
+- Importación masiva de DOIs (Crossref + escrituras por lotes)
+- Descarga de adjuntos guardados en Zotero: MB/s, memoria máxima y reanudación de cortes
+- Almacén vectorial mapeado en memoria: búsqueda top-k con muchos fragmentos por formato
+- Consultas: latencia p50/p95, llamadas LLM por consulta y aciertos de caché
+
+Uso:
+    python benchmark_papermind.py
+    python benchmark_papermind.py --docs 200 --library-sizes 100,1000,10000 --queries 60
+    python benchmark_papermind.py --json actual.json --baseline anterior.json
+
+Cada fase se ejecuta en un proceso aparte con su propio directorio de trabajo y
+se configura con las mismas variables de entorno que la aplicación.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+SEED = 1729
+RESULT_PREFIX = "BENCH_RESULT "
+INGEST_LIBRARY = 900001  # userID de la biblioteca usada en la fase de ingesta
+IMPORT_LIBRARY = 900002  # userID de la biblioteca (vacía) de la importación masiva
+ATTACHMENT_LIBRARY = 900003  # userID de la biblioteca con PDFs guardados en Zotero
+SYLLABLES = [
+    "ka", "lo", "mi", "ne", "su", "ta", "ri", "vo", "xe", "zu", "pra", "dor",
+    "len", "mis", "tal", "ver", "gen", "bio", "cel", "syn", "tro", "phy", "qua", "mon"
+]
+GENERIC_WORDS = [
+    "cells", "protein", "expression", "samples", "analysis", "model", "response", "tissue",
+    "levels", "pathway", "activity", "treatment", "control", "results", "data", "effect"
+]
+QUERY_STOPWORDS = {"what", "which", "about", "role", "does", "with", "from", "this", "that", "have"}
+
+# Corpus sintético
+
+def pseudo_word(rng: random.Random, syllables: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+def synthetic_paper(index: int) -> Dict:
+    """Paper sintético determinista: el mismo índice produce siempre los mismos datos"""
+    rng = random.Random(SEED * 1_000_003 + index)
+    return {
+        'index': index,
+        'key': f"B{index:07d}",
+        'title': " ".join(pseudo_word(rng).capitalize() for _ in range(rng.randint(6, 10))),
+        'doi': f"10.5555/bench.{index:07d}",
+        'authors': [(pseudo_word(rng, 2).capitalize(), pseudo_word(rng).capitalize()) for _ in range(rng.randint(1, 4))],
+        'year': 1990 + rng.randrange(35),
+        'gene': f"{pseudo_word(rng, 2).upper()}{rng.randint(1, 99)}",
+        'topic': [pseudo_word(rng) for _ in range(8)],
+        'collection': f"C{index % 5:07d}",
+    }
+
+def paper_pages(paper: Dict, pages: int = 3, lines_per_page: int = 40) -> List[List[str]]:
+    """Texto de las páginas: título y autores al principio, frases con el vocabulario del paper"""
+    rng = random.Random(SEED + paper['index'])
+    authors = ", ".join(f"{first} {last}" for first, last in paper['authors'])
+    result = []
+    for page in range(pages):
+        lines = [paper['title'], authors, f"doi: {paper['doi']} ({paper['year']})", ""] if page == 0 else []
+        while len(lines) < lines_per_page:
+            words = [rng.choice(paper['topic']) for _ in range(3)] + [rng.choice(GENERIC_WORDS) for _ in range(3)]
+            lines.append(
+                f"The {paper['gene']} gene modulates {words[0]} {words[3]} in {words[1]} {words[4]} "
+                f"and {words[2]} {words[5]}."
+            )
+        result.append(lines)
+    return result
+
+def preprint_pages(paper: Dict) -> List[List[str]]:
+    """Otra versión del mismo paper (preprint): cabecera distinta y ~10 % de las frases reescritas"""
+    rng = random.Random(SEED * 7 + paper['index'])
+    pages = [list(lines) for lines in paper_pages(paper)]
+    pages[0][2] = "Preprint - not peer reviewed"
+    for lines in pages:
+        for number in range(4, len(lines)):
+            if rng.random() < 0.1:
+                lines[number] = f"We also observed {rng.choice(GENERIC_WORDS)} {rng.choice(paper['topic'])} {rng.choice(GENERIC_WORDS)}."
+    return pages
+
+def build_duplicates(directory: Path, papers_dir: Path, papers: List[Dict], truth: Dict[str, Optional[str]], count: int):
+    """Copias exactas y versiones preprint de `count` papers del corpus en otro directorio"""
+    directory.mkdir(parents=True, exist_ok=True)
+    by_key = {paper['key']: paper for paper in papers}
+    for name, key in list(truth.items())[:count]:
+        shutil.copyfile(papers_dir / name, directory / f"copia {name}")
+        write_pdf(directory / f"preprint {key}.pdf", preprint_pages(by_key[key]))
+
+def pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: Path, pages: List[List[str]]):
+    """PDF mínimo (Helvetica, una línea de texto por renglón) sin dependencias externas"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        stream = ("BT /F1 9 Tf 16 TL 40 800 Td " + " ".join(f"({pdf_escape(line)}) '" for line in lines) + " ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{k} 0 R" for k in kids).encode(), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+def pdf_filename(paper: Dict, allow_missing: bool = True) -> Optional[str]:
+    """Nombre de archivo como lo dejaría un usuario: por DOI, por título, recortado o con erratas"""
+    rng = random.Random(SEED ^ paper['index'])
+    styles = ["doi", "titulo", "recortado", "errata"] + (["sin_pdf"] if allow_missing else [])
+    style = rng.choices(styles, weights=[30, 30, 15, 15, 10][:len(styles)])[0]
+    words = paper['title'].split()
+    if style == "doi":
+        return paper['doi'].replace("/", "_") + ".pdf"
+    if style == "titulo":
+        return f"{paper['authors'][0][1]} {paper['year']} - {paper['title']}.pdf"
+    if style == "recortado":
+        return "_".join(words[:5]).lower() + ".pdf"
+    if style == "errata":
+        target = rng.randrange(len(words))
+        cut = rng.randrange(1, len(words[target]))
+        words[target] = words[target][:cut] + words[target][cut + 1:]
+        return " ".join(words) + ".pdf"
+    return None
+
+def build_corpus(directory: Path, papers: List[Dict], real_pdfs: bool, distractors: int = 0) -> Dict[str, Optional[str]]:
+    """Crear los archivos del corpus y devolver la verdad conocida: nombre de archivo → key del item"""
+    directory.mkdir(parents=True, exist_ok=True)
+    truth = {}
+    for paper in papers:
+        name = pdf_filename(paper, allow_missing=not real_pdfs)
+        if name is None or name in truth:
+            continue
+        truth[name] = paper['key']
+        if real_pdfs:
+            write_pdf(directory / name, paper_pages(paper))
+        else:
+            (directory / name).touch()
+    # PDFs que no corresponden a ningún item de la biblioteca
+    for offset in range(distractors):
+        paper = synthetic_paper(500_000 + offset)
+        name = f"{paper['title']}.pdf"
+        truth[name] = None
+        (directory / name).touch()
+    return truth
+
+def attachment_bytes(key: str, size: int) -> bytes:
+    """Contenido determinista de un adjunto PDF del tamaño pedido (termina en %%EOF)"""
+    seed = zlib.crc32(key.encode())
+    block = random.Random(seed).randbytes(64 * 1024)
+    body = b"%PDF-1.4\n" + block * (size // len(block) + 1)
+    return body[:max(0, size - 6)] + b"%%EOF\n"
+
+# Servicios simulados
+
+def words_of(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]{4,}", text.lower())) - QUERY_STOPWORDS
+
+def fake_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """Bolsa de palabras con hashing, normalizada: textos parecidos dan vectores parecidos"""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"[a-z0-9]{3,}", text.lower()):
+        vector[zlib.crc32(word.encode()) % dimensions] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+def fake_chat_reply(prompt: str) -> str:
+    """Respuesta determinista según la plantilla de Paper-QA usada en el prompt"""
+    if prompt.startswith("Summarize the excerpt"):
+        question = re.search(r"Question: (.*)", prompt)
+        excerpt = prompt.split("----")[1] if "----" in prompt else prompt
+        shared = words_of(question.group(1) if question else "") & words_of(excerpt)
+        if not shared:
+            return "Not applicable"
+        return f"The excerpt reports findings on {', '.join(sorted(shared)[:5])}.\n\nRelevance score: {min(10, 3 + 2 * len(shared))}"
+    if prompt.startswith("Answer the question"):
+        keys = re.search(r"Valid keys: (.*)", prompt)
+        first_key = keys.group(1).split(", ")[0] if keys else ""
+        return f"According to the retrieved evidence, the question is addressed in the corpus ({first_key})."
+    if prompt.startswith("Provide the citation"):
+        lines = [line for line in prompt.split("\n")[2:] if line.strip()]
+        title = lines[0].strip() if lines else "Untitled"
+        return f'Bench, A. "{title}." Journal of Synthetic Results, 2020.'
+    if prompt.startswith("Select papers"):
+        return "None"
+    return "OK"
+
+class FakeLibrary:
+    """Biblioteca Zotero simulada: items versionados, eliminaciones y colecciones"""
+
+    def __init__(self, papers: List[Dict], attachment_size: int = 0):
+        self.version = 0
+        self.items = {}
+        self.attachments = {}
+        self.files = {}
+        self.deleted = {}
+        self.write_tokens = set()
+        self.collections = [
+            {'key': f"C{i:07d}", 'version': 1, 'data': {'key': f"C{i:07d}", 'name': f"Colección {i}", 'parentCollection': False}}
+            for i in range(5)
+        ]
+        for paper in papers:
+            self.add(self.item_data(paper))
+            if attachment_size:
+                self.attach(paper, attachment_size)
+
+    @staticmethod
+    def item_data(paper: Dict) -> Dict:
+        return {
+            'key': paper['key'],
+            'itemType': 'journalArticle',
+            'title': paper['title'],
+            'creators': [{'creatorType': 'author', 'firstName': first, 'lastName': last} for first, last in paper['authors']],
+            'date': str(paper['year']),
+            'DOI': paper['doi'],
+            'tags': [{'tag': paper['gene']}, {'tag': 'benchmark'}],
+            'collections': [paper['collection']],
+        }
+
+    def add(self, data: Dict) -> Dict:
+        self.version += 1
+        data = dict(data, version=self.version)
+        self.items[data['key']] = {'key': data['key'], 'version': self.version, 'data': data}
+        return self.items[data['key']]
+
+    def attach(self, paper: Dict, size: int):
+        """Adjuntar un PDF guardado en Zotero (linkMode imported_file) al item del paper"""
+        self.version += 1
+        key = "A" + paper['key'][1:]
+        self.files[key] = size
+        data = {
+            'key': key, 'version': self.version, 'itemType': 'attachment', 'parentItem': paper['key'],
+            'linkMode': 'imported_file', 'contentType': 'application/pdf', 'filename': f"{paper['title'][:60]}.pdf",
+            'md5': hashlib.md5(attachment_bytes(key, size)).hexdigest(), 'mtime': 1700000000000,
+        }
+        self.attachments[key] = {'key': key, 'version': self.version, 'data': data}
+
+    def touch(self, modified: int, deleted: int):
+        """Modificar y eliminar algunos items (cambios entre sincronizaciones)"""
+        keys = sorted(self.items)
+        self.version += 1
+        for key in keys[:modified]:
+            item = self.items[key]
+            item['version'] = item['data']['version'] = self.version
+        for key in keys[len(keys) - deleted:]:
+            del self.items[key]
+            self.deleted[key] = self.version
+
+class FakeServices:
+    """Estado y rutas de los servicios simulados (Zotero, Crossref y OpenAI)"""
+
+    def __init__(self, llm_latency: float, embed_latency: float, zotero_latency: float,
+                 backoff_every: int, backoff_seconds: float, interrupt_every: int = 0):
+        self.libraries: Dict[int, FakeLibrary] = {}
+        self.llm_latency = llm_latency
+        self.embed_latency = embed_latency
+        self.zotero_latency = zotero_latency
+        self.backoff_every = backoff_every
+        self.backoff_seconds = backoff_seconds
+        self.interrupt_every = interrupt_every
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def route(self, method: str, path: str, query: Dict, headers, body):
+        if path.startswith("/zotero/"):
+            time.sleep(self.zotero_latency)
+            return self.zotero(method, path[len("/zotero"):], query, headers, body)
+        if path.startswith("/crossref/works/"):
+            return self.crossref(path[len("/crossref/works/"):])
+        if path == "/openai/v1/embeddings":
+            return self.embeddings(body)
+        if path == "/openai/v1/chat/completions":
+            return self.chat(body)
+        if path == "/_bench/stats":
+            return 200, {}, dict(self.counts)
+        if path == "/_bench/touch":
+            with self.lock:
+                self.libraries[int(query['user'])].touch(int(query['modified']), int(query['deleted']))
+            return 200, {}, {}
+        return 404, {}, {"error": "Not found"}
+
+    def zotero(self, method: str, path: str, query: Dict, headers, body):
+        with self.lock:
+            self.counts['zotero'] += 1
+            backoff = self.backoff_every and self.counts['zotero'] % self.backoff_every == 0
+        extra = {'Backoff': str(self.backoff_seconds)} if backoff else {}
+
+        parts = path.strip("/").split("/")
+        if parts[0] == "keys":
+            user_id = int(parts[1].rsplit("-", 1)[-1])
+            return 200, extra, {'key': parts[1], 'userID': user_id, 'username': f"bench{user_id}",
+                                'access': {'user': {'library': True, 'files': True, 'write': True}}}
+        if parts[0] != "users" or int(parts[1]) not in self.libraries:
+            return 404, extra, "Not found"
+        library = self.libraries[int(parts[1])]
+        resource = parts[2] if len(parts) > 2 else ""
+
+        with self.lock:
+            extra['Last-Modified-Version'] = str(library.version)
+            if resource == "items" and method == "POST":
+                return self.zotero_write(library, headers, body, extra)
+            if resource == "deleted":
+                since = int(query.get('since', 0))
+                keys = [key for key, version in library.deleted.items() if version > since]
+                return 200, extra, {'items': keys, 'collections': [], 'searches': [], 'tags': [], 'settings': []}
+            if resource == "collections":
+                return self.zotero_page(path, query, library.collections, extra)
+            if resource == "groups":
+                return self.zotero_page(path, query, [], extra)  # Sin bibliotecas de grupo
+            if resource == "items" and parts[-1] == "file":
+                return self.zotero_file(library, parts[3], headers, extra)
+            if resource == "items":
+                since = int(query.get('since', 0))
+                if int(headers.get('If-Modified-Since-Version', -1)) >= library.version:
+                    return 304, extra, None
+                item_type = query.get('itemType', '')
+                pool = list(library.items.values()) if item_type != "attachment" else []
+                if item_type in ("", "attachment"):
+                    pool += list(library.attachments.values())
+                items = sorted((item for item in pool if item['version'] > since), key=lambda i: i['version'])
+                return self.zotero_page(path, query, items, extra)
+        return 404, extra, "Not found"
+
+    def zotero_file(self, library: FakeLibrary, key: str, headers, extra: Dict):
+        """Archivo de un adjunto con soporte de Range; cada N descargas se corta a la mitad"""
+        if key not in library.files:
+            return 404, extra, "Not found"
+        self.counts['files'] += 1
+        data = attachment_bytes(key, library.files[key])
+        status = 200
+        match = re.fullmatch(r"bytes=(\d+)-", headers.get('Range', ''))
+        if match:
+            offset = int(match.group(1))
+            if offset >= len(data):
+                return 416, dict(extra, **{'Content-Range': f"bytes */{len(data)}"}), b""
+            extra['Content-Range'] = f"bytes {offset}-{len(data) - 1}/{len(data)}"
+            data = data[offset:]
+            status = 206
+        extra['Content-Type'] = "application/pdf"
+        if self.interrupt_every and self.counts['files'] % self.interrupt_every == 0:
+            self.counts['interrupted'] += 1
+            extra['X-Bench-Truncate'] = str(len(data) // 2)
+        return status, extra, data
+
+    @staticmethod
+    def zotero_page(path: str, query: Dict, results: List, headers: Dict):
+        """Página de resultados con Total-Results y enlaces Link rel="next"/"last" como la API v3"""
+        limit = min(int(query.get('limit', 25)), 100)
+        start = int(query.get('start', 0))
+        headers['Total-Results'] = str(len(results))
+        links = []
+        if start + limit < len(results):
+            links.append(f'<{path}?{urlencode(dict(query, start=start + limit, limit=limit))}>; rel="next"')
+            last = (len(results) - 1) // limit * limit
+            links.append(f'<{path}?{urlencode(dict(query, start=last, limit=limit))}>; rel="last"')
+        if links:
+            headers['Link'] = ", ".join(links)
+        return 200, headers, results[start:start + limit]
+
+    @staticmethod
+    def zotero_write(library: FakeLibrary, headers, body, extra: Dict):
+        token = headers.get('Zotero-Write-Token')
+        if token in library.write_tokens:
+            return 412, extra, "Write token already used"
+        if token:
+            library.write_tokens.add(token)
+        if not isinstance(body, list) or len(body) > 50:
+            return 413, extra, "Too many items"
+        successful, failed = {}, {}
+        for index, data in enumerate(body):
+            if not data.get('title'):
+                failed[str(index)] = {'key': '', 'code': 400, 'message': "Missing title"}
+                continue
+            data = dict(data, key=f"N{len(library.items) + len(library.deleted):07d}")
+            successful[str(index)] = library.add(data)
+        extra['Last-Modified-Version'] = str(library.version)
+        return 200, extra, {
+            'successful': successful,
+            'success': {index: item['key'] for index, item in successful.items()},
+            'unchanged': {},
+            'failed': failed
+        }
+
+    @staticmethod
+    def crossref(doi: str):
+        match = re.fullmatch(r"10\.5555/bench\.(\d{7})", doi)
+        if not match:
+            return 404, {}, "Resource not found."
+        paper = synthetic_paper(int(match.group(1)))
+        return 200, {'X-Rate-Limit-Limit': "50", 'X-Rate-Limit-Interval': "1s"}, {
+            'status': "ok",
+            'message-type': "work",
+            'message': {
+                'DOI': paper['doi'],
+                'title': [paper['title']],
+                'author': [{'given': first, 'family': last} for first, last in paper['authors']],
+                'published-print': {'date-parts': [[paper['year']]]},
+                'container-title': ["Journal of Synthetic Results"],
+                'URL': f"https://doi.org/{paper['doi']}",
+                'type': "journal-article",
+            }
+        }
+
+    def embeddings(self, body: Dict):
+        with self.lock:
+            self.counts['embeddings'] += 1
+        time.sleep(self.embed_latency)
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text if isinstance(text, str) else " ".join(map(str, text)))
+            if body.get('encoding_format') == "base64":
+                vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
+            data.append({'object': "embedding", 'index': index, 'embedding': vector})
+        tokens = sum(len(str(text)) // 4 for text in inputs)
+        return 200, {}, {'object': "list", 'data': data, 'model': body.get('model', ''),
+                         'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+
+    def chat(self, body: Dict):
+        with self.lock:
+            self.counts['chat'] += 1
+        time.sleep(self.llm_latency)
+        prompt = body['messages'][-1]['content']
+        content = fake_chat_reply(prompt)
+        base = {'id': "chatcmpl-bench", 'created': int(time.time()), 'model': body.get('model', '')}
+        if not body.get('stream'):
+            prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+            return 200, {}, dict(base, object="chat.completion", choices=[
+                {'index': 0, 'message': {'role': "assistant", 'content': content}, 'finish_reason': "stop"}
+            ], usage={'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens})
+        # Streaming SSE: un fragmento por palabra y el marcador final [DONE]
+        events = []
+        for piece in re.findall(r"\S+\s*", content):
+            chunk = dict(base, object="chat.completion.chunk", choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}])
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        final = dict(base, object="chat.completion.chunk", choices=[{'index': 0, 'delta': {}, 'finish_reason': "stop"}])
+        events.append(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n")
+        return 200, {'Content-Type': "text/event-stream"}, "".join(events).encode()
+
+class FakeServicesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method: str):
+        url = urlsplit(self.path)
+        body = None
+        if method == "POST":
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b"null")
+        try:
+            status, headers, payload = self.server.services.route(method, url.path, dict(parse_qsl(url.query)), self.headers, body)
+        except Exception as e:
+            status, headers, payload = 500, {}, {"error": str(e)}
+
+        if payload is None:
+            data = b""
+        elif isinstance(payload, bytes):
+            data = payload
+        elif isinstance(payload, str):
+            data = payload.encode()
+            headers.setdefault('Content-Type', "text/plain")
+        else:
+            data = json.dumps(payload).encode()
+            headers.setdefault('Content-Type', "application/json")
+        # Enlaces Link relativos → absolutos, como los devuelve Zotero
+        if 'Link' in headers:
+            host = f"http://{self.headers.get('Host')}/zotero"
+            headers['Link'] = headers['Link'].replace("<", f"<{host}")
+
+        # Corte simulado de la conexión: se anuncia el tamaño completo y se envía solo una parte
+        truncate = headers.pop('X-Bench-Truncate', None)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if truncate is not None:
+            self.wfile.write(data[:int(truncate)])
+            self.close_connection = True
+            return
+        self.wfile.write(data)
+
+def start_services(services: FakeServices) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeServicesHandler)
+    server.daemon_threads = True
+    server.services = services
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Fases (cada una en su propio proceso)
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def bench_stats(server_url: str) -> Counter:
+    return Counter(requests.get(f"{server_url}/_bench/stats", timeout=10).json())
+
+def matching_accuracy(integration, truth: Dict[str, Optional[str]]) -> Dict:
+    """Precisión y exhaustividad de los enlaces PDF ↔ item frente a la verdad conocida"""
+    linked = {Path(path).name: metadata['key'] for path, metadata in integration.store.linked_metadata().items()}
+    correct = sum(1 for name, key in linked.items() if truth.get(name) == key)
+    expected = sum(1 for key in truth.values() if key)
+    return {
+        'links': len(linked),
+        'precision': correct / len(linked) if linked else 0.0,
+        'recall': correct / expected if expected else 0.0,
+    }
+
+def phase_sync(params: Dict) -> Dict:
+    import app_zotero_paperqa as app
+    integration = app.ZoteroPaperQAIntegration()
+    integration.detect_user_id()
+    integration.get_collections()
+
+    start = time.perf_counter()
+    status = integration.sync_zotero_to_paperqa()
+    full = time.perf_counter() - start
+    if status.startswith("❌"):
+        raise RuntimeError(status)
+    accuracy = matching_accuracy(integration, json.loads(Path(params['truth']).read_text()))
+
+    start = time.perf_counter()
+    integration.sync_zotero_to_paperqa()
+    unchanged = time.perf_counter() - start
+
+    size = params['size']
+    requests.get(f"{params['server']}/_bench/touch", params={
+        'user': integration.user_id, 'modified': max(1, size // 100), 'deleted': max(1, size // 200)
+    }, timeout=10)
+    start = time.perf_counter()
+    integration.sync_zotero_to_paperqa()
+    incremental = time.perf_counter() - start
+
+    return dict(accuracy, size=size, full_s=full, unchanged_s=unchanged, incremental_s=incremental)
+
+async def phase_ingest(params: Dict) -> Dict:
+    import app_zotero_paperqa as app
+    integration = app.ZoteroPaperQAIntegration()
+    integration.detect_user_id()
+    await integration.sync_zotero_and_update_index()
+
+    start = time.perf_counter()
+    before = bench_stats(params['server'])
+    status = await integration.load_papers_to_paperqa()
+    cold = time.perf_counter() - start
+    embedding_requests = bench_stats(params['server'])['embeddings'] - before['embeddings']
+    if status.startswith("❌"):
+        raise RuntimeError(status)
+    start = time.perf_counter()
+    await integration.load_papers_to_paperqa()
+    warm = time.perf_counter() - start
+    shards = [shard for shard in integration.shards.values() if shard.loaded]
+    manifest = [entry for shard in shards for entry in shard.manifest.values()]
+    result = {
+        'docs': sum(len(shard.docs.docs) for shard in shards), 'chunks': sum(len(shard.docs.texts) for shard in shards),
+        'cold_s': cold, 'warm_s': warm,
+        'files': len(manifest), 'embedding_requests': embedding_requests,
+        'near_duplicates': sum(1 for entry in manifest if 'dockey' in entry),
+        'expected_duplicates': 2 * params.get('duplicates', 0),
+    }
+    # Las copias (exactas o casi, en la misma biblioteca o en otra) no deben embeberse
+    if result['files'] - result['docs'] < result['expected_duplicates']:
+        raise RuntimeError(f"Deduplicación incompleta: {result['files'] - result['docs']}/"
+                           f"{result['expected_duplicates']} copias sin embeber")
+
+    # Preguntas únicas (sin aciertos de caché), cada una sobre el gen de un paper distinto
+    papers = [synthetic_paper(i) for i in range(params['docs'])]
+    rng = random.Random(SEED)
+    questions = [
+        f"What is the role of {paper['gene']} in {rng.choice(paper['topic'])} {rng.choice(GENERIC_WORDS)}?"
+        for paper in rng.choices(papers, k=params['queries'])
+    ]
+    questions = list(dict.fromkeys(questions))
+    semaphore = asyncio.Semaphore(params['concurrency'])
+
+    async def timed(question: str):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await integration.ask_question_with_filters(question)
+            return time.perf_counter() - start, response.startswith("❌")
+
+    before = bench_stats(params['server'])
+    measured = await asyncio.gather(*(timed(q) for q in questions))
+    after = bench_stats(params['server'])
+    cached = await asyncio.gather(*(timed(q) for q in questions))
+
+    latencies = [seconds for seconds, _ in measured]
+    result.update(
+        queries=len(questions),
+        query_errors=sum(1 for _, failed in measured if failed),
+        query_p50_ms=percentile(latencies, 50) * 1000,
+        query_p95_ms=percentile(latencies, 95) * 1000,
+        llm_calls_per_query=(after['chat'] - before['chat']) / max(1, len(questions)),
+        cached_p50_ms=percentile([seconds for seconds, _ in cached], 50) * 1000,
+    )
+    return result
+
+def phase_import(params: Dict) -> Dict:
+    import app_zotero_paperqa as app
+    integration = app.ZoteroPaperQAIntegration()
+    integration.detect_user_id()
+    # 90 % DOIs conocidos por Crossref, 10 % inexistentes (404)
+    dois = [synthetic_paper(600_000 + i)['doi'] if i % 10 else f"10.5555/missing.{i:07d}" for i in range(params['dois'])]
+
+    start = time.perf_counter()
+    status = integration.import_dois(dois)
+    cold = time.perf_counter() - start
+    if status.startswith("❌"):
+        raise RuntimeError(status)
+    added = int(re.search(r"(\d+)/\d+ DOIs", status).group(1))
+    start = time.perf_counter()
+    integration.import_dois(dois)
+    warm = time.perf_counter() - start
+    return {'dois': len(dois), 'added': added, 'cold_s': cold, 'warm_s': warm}
+
+def phase_attachments(params: Dict) -> Dict:
+    import resource
+    import app_zotero_paperqa as app
+    integration = app.ZoteroPaperQAIntegration()
+    integration.detect_user_id()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    status = integration.sync_zotero_to_paperqa()
+    full = time.perf_counter() - start
+    if status.startswith("❌"):
+        raise RuntimeError(status)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Cada adjunto debe estar completo y enlazado a su item padre
+    personal = integration.shards['personal']
+    stored = integration.store.attachments({data['key'] for data in integration.store.all_items()})
+    verified = sum(
+        1 for attachment in stored
+        if personal.attachment_path(attachment).exists()
+        and app.file_md5(personal.attachment_path(attachment)) == attachment['md5']
+    )
+    linked = integration.store.linked_metadata()
+    correct_links = sum(
+        1 for attachment in stored
+        if linked.get(str(personal.attachment_path(attachment)), {}).get('key') == attachment['parent']
+    )
+
+    start = time.perf_counter()
+    integration.sync_zotero_to_paperqa()
+    unchanged = time.perf_counter() - start
+
+    megabytes = params['attachments'] * params['attachment_kb'] / 1024
+    stats = bench_stats(params['server'])
+    return {
+        'attachments': params['attachments'], 'megabytes': megabytes, 'full_s': full, 'unchanged_s': unchanged,
+        'verified': verified, 'linked': correct_links, 'interrupted': stats['interrupted'],
+        # ru_maxrss está en KB en Linux
+        'peak_rss_mb': rss_after / 1024, 'rss_growth_mb': (rss_after - rss_before) / 1024,
+    }
+
+def phase_vectors(params: Dict) -> Dict:
+    import pickle
+    import resource
+    import numpy as np
+    from paperqa.types import Doc, Text
+    from papermind_vectors import MmapVectorStore
+
+    chunks, dimensions, dtype = params['chunks'], params['dimensions'], params['dtype']
+    rng = np.random.default_rng(SEED)
+    doc = Doc(docname="bench", citation="bench", dockey="bench")
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    store = MmapVectorStore(dtype=dtype).attach("vectors", fresh=True)
+    for offset in range(0, chunks, 10_000):
+        vectors = rng.standard_normal((min(10_000, chunks - offset), dimensions), dtype=np.float32)
+        store.add_texts_and_embeddings([
+            Text.model_construct(text="", name=f"t{offset + i}", doc=doc, embedding=vector)
+            for i, vector in enumerate(vectors)
+        ])
+    store.flush()
+    build = time.perf_counter() - start
+    Path("store.pkl").write_bytes(pickle.dumps(store))
+    rss_build = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Arranque: cargar el pickle y reabrir el mapa (sin leer los vectores)
+    start = time.perf_counter()
+    store = pickle.loads(Path("store.pkl").read_bytes()).attach("vectors")
+    store.matrix()
+    open_s = time.perf_counter() - start
+
+    queries = rng.standard_normal((params['searches'], dimensions), dtype=np.float32)
+    store.top_k(queries[0], 10)  # primera pasada: páginas del archivo en caché
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        store.top_k(query, 10)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    store.top_k(queries, 10)
+    batch = (time.perf_counter() - start) / len(queries)
+
+    # Exhaustividad frente a la búsqueda exacta en float32 (importa con float16/int8)
+    sample = rng.choice(chunks, size=min(chunks, 20_000), replace=False)
+    exact = store.vectors(sample)
+    probe = exact[:20] + 0.05 * rng.standard_normal((min(20, len(sample)), dimensions), dtype=np.float32)
+    recall = np.mean([
+        sample[i] in set(store.top_k(probe[i], 10)[0][0].tolist()) for i in range(len(probe))
+    ])
+    return {
+        'chunks': chunks, 'dimensions': dimensions, 'dtype': dtype, 'build_s': build, 'open_ms': open_s * 1000,
+        'search_p50_ms': percentile(latencies, 50) * 1000, 'search_p95_ms': percentile(latencies, 95) * 1000,
+        'batch_ms_per_query': batch * 1000, 'recall': float(recall),
+        'file_mb': sum(path.stat().st_size for path in Path("vectors").iterdir()) / 2**20,
+        'rss_growth_mb': (rss_build - rss_before) / 1024,
+    }
+
+def run_worker(phase: str):
+    params = json.loads(os.environ['BENCH_PARAMS'])
+    if phase == "ingest":
+        result = asyncio.run(phase_ingest(params))
+    elif phase == "sync":
+        result = phase_sync(params)
+    elif phase == "attachments":
+        result = phase_attachments(params)
+    elif phase == "vectors":
+        result = phase_vectors(params)
+    else:
+        result = phase_import(params)
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+def spawn(phase: str, workdir: Path, server_url: str, user_id: int, params: Dict, papers_dir: Path, timeout: float) -> Dict:
+    """Ejecutar una fase en un proceso nuevo, configurado solo con variables de entorno"""
+    index_dir = workdir / "index"
+    local_dir = workdir / "mis_papers"
+    local_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="bench",
+        OPENAI_BASE_URL=f"{server_url}/openai/v1",
+        ZOTERO_API_KEY=f"bench-{user_id}",
+        ZOTERO_API_URL=f"{server_url}/zotero",
+        CROSSREF_API_URL=f"{server_url}/crossref",
+        CROSSREF_MAILTO="bench@example.org",
+        PAPERS_DIR=str(papers_dir),
+        LOCAL_PAPERS_DIR=str(local_dir),
+        PAPERMIND_INDEX_DIR=str(index_dir),
+        PAPERMIND_QUERY_CONCURRENCY=str(params.get('concurrency', 4)),
+        BENCH_PARAMS=json.dumps(dict(params, server=server_url)),
+    )
+    completed = subprocess.run(
+        [sys.executable, "-W", "ignore", os.path.abspath(__file__), "--worker", phase],
+        env=env, cwd=workdir, capture_output=True, text=True, timeout=timeout
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"La fase '{phase}' falló:\n{completed.stderr[-2000:] or completed.stdout[-2000:]}")
+
+# Informe y comparación con una ejecución anterior
+
+METRICS = {
+    # métrica: (descripción, True si más alto es mejor)
+    'ingest.docs_per_s': ("Ingesta (docs/s)", True),
+    'ingest.warm_s': ("Re-escaneo sin cambios (s)", False),
+    'ingest.query_p50_ms': ("Consulta p50 (ms)", False),
+    'ingest.query_p95_ms': ("Consulta p95 (ms)", False),
+    'ingest.llm_calls_per_query': ("Llamadas LLM por consulta", False),
+    'ingest.embedding_requests': ("Peticiones de embeddings en la ingesta", False),
+    'import.dois_per_s': ("Importación (DOIs/s)", True),
+    'attachments.mb_per_s': ("Descarga de adjuntos (MB/s)", True),
+    'attachments.rss_growth_mb': ("Memoria extra al descargar (MB)", False),
+}
+for _dtype in ("float32", "float16", "int8"):
+    METRICS[f"vectors.{_dtype}.search_p50_ms"] = (f"Búsqueda vectorial {_dtype} p50 (ms)", False)
+
+def flat_metrics(results: Dict) -> Dict[str, float]:
+    metrics = {}
+    if 'ingest' in results:
+        ingest = results['ingest']
+        metrics.update({f"ingest.{k}": v for k, v in ingest.items() if isinstance(v, (int, float))})
+        metrics['ingest.docs_per_s'] = ingest['docs'] / ingest['cold_s'] if ingest['cold_s'] else 0.0
+    if 'import' in results:
+        metrics['import.dois_per_s'] = results['import']['dois'] / results['import']['cold_s'] if results['import']['cold_s'] else 0.0
+    if 'attachments' in results:
+        attachments = results['attachments']
+        metrics['attachments.mb_per_s'] = attachments['megabytes'] / attachments['full_s'] if attachments['full_s'] else 0.0
+        metrics['attachments.rss_growth_mb'] = attachments['rss_growth_mb']
+    for vectors in results.get('vectors', []):
+        for key in ('search_p50_ms', 'batch_ms_per_query', 'open_ms', 'recall'):
+            metrics[f"vectors.{vectors['dtype']}.{key}"] = vectors[key]
+    for sync in results.get('sync', []):
+        for key in ('full_s', 'incremental_s', 'precision', 'recall'):
+            metrics[f"sync.{sync['size']}.{key}"] = sync[key]
+    return metrics
+
+def print_report(results: Dict):
+    metrics = flat_metrics(results)
+    print("\n📊 PaperMind - benchmark offline")
+    if 'ingest' in results:
+        ingest = results['ingest']
+        print(f"📥 Ingesta: {ingest['docs']} docs ({ingest['chunks']} fragmentos) en {ingest['cold_s']:.2f} s "
+              f"→ {metrics['ingest.docs_per_s']:.1f} docs/s · re-escaneo sin cambios {ingest['warm_s']:.2f} s")
+        if ingest.get('expected_duplicates'):
+            print(f"🧬 Duplicados: {ingest['files']} archivos → {ingest['docs']} documentos · "
+                  f"{ingest['near_duplicates']} casi duplicados · {ingest['files'] - ingest['docs']}/{ingest['expected_duplicates']} "
+                  f"copias sin embeber · {ingest['embedding_requests']} peticiones de embeddings")
+        print(f"❓ Consultas: {ingest['queries']} · p50 {ingest['query_p50_ms']:.0f} ms · p95 {ingest['query_p95_ms']:.0f} ms · "
+              f"{ingest['llm_calls_per_query']:.1f} llamadas LLM/consulta · caché p50 {ingest['cached_p50_ms']:.1f} ms · "
+              f"errores {ingest['query_errors']}")
+    if results.get('sync'):
+        print("🔄 Sincronización Zotero:")
+        print(f"   {'items':>8} {'completa':>10} {'sin cambios':>12} {'incremental':>12} {'precisión':>10} {'exhaustividad':>14}")
+        for sync in results['sync']:
+            print(f"   {sync['size']:>8} {sync['full_s']:>9.2f}s {sync['unchanged_s']:>11.3f}s {sync['incremental_s']:>11.3f}s "
+                  f"{sync['precision']:>9.1%} {sync['recall']:>14.1%}")
+    if 'import' in results:
+        imported = results['import']
+        print(f"📚 Importación DOIs: {imported['added']}/{imported['dois']} añadidos en {imported['cold_s']:.2f} s "
+              f"({metrics['import.dois_per_s']:.1f} DOIs/s) · repetida con caché Crossref {imported['warm_s']:.2f} s")
+    if 'attachments' in results:
+        attachments = results['attachments']
+        print(f"📎 Adjuntos Zotero: {attachments['attachments']} ({attachments['megabytes']:.1f} MB) en {attachments['full_s']:.2f} s "
+              f"→ {metrics['attachments.mb_per_s']:.1f} MB/s · {attachments['interrupted']} cortes reanudados · "
+              f"verificados {attachments['verified']}/{attachments['attachments']} · enlazados {attachments['linked']} · "
+              f"memoria máx. {attachments['peak_rss_mb']:.0f} MB (+{attachments['rss_growth_mb']:.1f}) · "
+              f"re-sincronización {attachments['unchanged_s']:.2f} s")
+    if results.get('vectors'):
+        first = results['vectors'][0]
+        print(f"🧮 Almacén vectorial ({first['chunks']} fragmentos × {first['dimensions']} dimensiones):")
+        print(f"   {'formato':>8} {'archivo':>10} {'apertura':>9} {'p50':>9} {'p95':>9} {'lote/consulta':>14} {'exhaustividad':>14}")
+        for vectors in results['vectors']:
+            print(f"   {vectors['dtype']:>8} {vectors['file_mb']:>8.0f}MB {vectors['open_ms']:>7.1f}ms {vectors['search_p50_ms']:>7.1f}ms "
+                  f"{vectors['search_p95_ms']:>7.1f}ms {vectors['batch_ms_per_query']:>12.1f}ms {vectors['recall']:>14.1%}")
+
+def compare_baseline(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Métricas que empeoran más que la tolerancia respecto a la ejecución de referencia"""
+    current, previous = flat_metrics(results), flat_metrics(baseline)
+    regressions = []
+    for name, value in current.items():
+        if name not in previous or not previous[name]:
+            continue
+        label, higher_is_better = METRICS.get(name, (name, name.endswith(('precision', 'recall'))))
+        change = (value - previous[name]) / abs(previous[name])
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"⚠️ {label}: {previous[name]:.3g} → {value:.3g} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline de PaperMind con servicios simulados")
+    parser.add_argument("--docs", type=int, default=60, help="PDFs sintéticos para la ingesta")
+    parser.add_argument("--duplicates", type=int, default=10, help="Papers de la ingesta con copia exacta y versión preprint")
+    parser.add_argument("--library-sizes", default="100,1000,5000", help="Tamaños de biblioteca Zotero a sincronizar")
+    parser.add_argument("--queries", type=int, default=30, help="Consultas a medir")
+    parser.add_argument("--concurrency", type=int, default=4, help="Consultas simultáneas")
+    parser.add_argument("--dois", type=int, default=50, help="DOIs para la importación masiva (0 = omitir)")
+    parser.add_argument("--attachments", type=int, default=40, help="PDFs guardados en Zotero a descargar (0 = omitir)")
+    parser.add_argument("--attachment-kb", type=int, default=512, help="Tamaño de cada adjunto (KB)")
+    parser.add_argument("--interrupt-every", type=int, default=7, help="Cortar una de cada N descargas de adjuntos (0 = nunca)")
+    parser.add_argument("--vector-chunks", type=int, default=100_000, help="Fragmentos del almacén vectorial (0 = omitir)")
+    parser.add_argument("--vector-dim", type=int, default=1536, help="Dimensiones de los embeddings del almacén vectorial")
+    parser.add_argument("--vector-dtypes", default="float32,float16,int8", help="Formatos de fila a medir")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="Latencia simulada de cada llamada de chat")
+    parser.add_argument("--embed-latency-ms", type=float, default=10, help="Latencia simulada de cada petición de embeddings")
+    parser.add_argument("--zotero-latency-ms", type=float, default=5, help="Latencia simulada de cada petición a Zotero")
+    parser.add_argument("--backoff-every", type=int, default=50, help="Enviar cabecera Backoff cada N peticiones a Zotero (0 = nunca)")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--baseline", help="Resultados anteriores (--json) con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento relativo tolerado frente a --baseline")
+    parser.add_argument("--timeout", type=float, default=1800, help="Tiempo máximo por fase (s)")
+    parser.add_argument("--keep", action="store_true", help="No borrar el directorio de trabajo")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return run_worker(args.worker)
+
+    services = FakeServices(args.llm_latency_ms / 1000, args.embed_latency_ms / 1000,
+                            args.zotero_latency_ms / 1000, args.backoff_every, 0.1, args.interrupt_every)
+    server = start_services(services)
+    server_url = f"http://127.0.0.1:{server.server_address[1]}"
+    workdir = Path(tempfile.mkdtemp(prefix="papermind_bench_"))
+    results = {'config': {k: v for k, v in vars(args).items() if k not in ('worker', 'json', 'baseline', 'keep')}}
+
+    try:
+        print(f"🧪 Servicios simulados en {server_url} · directorio de trabajo {workdir}")
+
+        if args.docs:
+            print(f"📄 Generando {args.docs} PDFs sintéticos...")
+            papers = [synthetic_paper(i) for i in range(args.docs)]
+            services.libraries[INGEST_LIBRARY] = FakeLibrary(papers)
+            truth = build_corpus(workdir / "ingest" / "papers", papers, real_pdfs=True)
+            # Copias exactas y preprints en el directorio local (el mismo que usa spawn)
+            build_duplicates(workdir / "ingest" / "mis_papers", workdir / "ingest" / "papers", papers, truth, args.duplicates)
+            print("📥 Fase de ingesta y consultas...")
+            results['ingest'] = spawn("ingest", workdir / "ingest", server_url, INGEST_LIBRARY, {
+                'docs': args.docs, 'queries': args.queries, 'concurrency': args.concurrency, 'duplicates': args.duplicates
+            }, workdir / "ingest" / "papers", args.timeout)
+
+        results['sync'] = []
+        for size in [int(s) for s in args.library_sizes.split(",") if s.strip()]:
+            print(f"🔄 Sincronizando biblioteca de {size} items...")
+            papers = [synthetic_paper(i) for i in range(size)]
+            services.libraries[size] = FakeLibrary(papers)
+            phase_dir = workdir / f"sync_{size}"
+            truth = build_corpus(phase_dir / "papers", papers, real_pdfs=False, distractors=size // 10)
+            truth_path = phase_dir / "truth.json"
+            truth_path.write_text(json.dumps(truth))
+            results['sync'].append(spawn("sync", phase_dir, server_url, size, {
+                'size': size, 'truth': str(truth_path)
+            }, phase_dir / "papers", args.timeout))
+
+        if args.dois:
+            print(f"📚 Importación masiva de {args.dois} DOIs...")
+            services.libraries[IMPORT_LIBRARY] = FakeLibrary([])
+            results['import'] = spawn("import", workdir / "import", server_url, IMPORT_LIBRARY, {
+                'dois': args.dois
+            }, workdir / "import" / "papers", args.timeout)
+
+        if args.attachments:
+            print(f"📎 Descarga de {args.attachments} adjuntos de {args.attachment_kb} KB...")
+            papers = [synthetic_paper(700_000 + i) for i in range(args.attachments)]
+            services.libraries[ATTACHMENT_LIBRARY] = FakeLibrary(papers, attachment_size=args.attachment_kb * 1024)
+            results['attachments'] = spawn("attachments", workdir / "attachments", server_url, ATTACHMENT_LIBRARY, {
+                'attachments': args.attachments, 'attachment_kb': args.attachment_kb
+            }, workdir / "attachments" / "papers", args.timeout)
+
+        results['vectors'] = []
+        if args.vector_chunks:
+            for dtype in [d.strip() for d in args.vector_dtypes.split(",") if d.strip()]:
+                print(f"🧮 Almacén vectorial {dtype}: {args.vector_chunks} fragmentos...")
+                results['vectors'].append(spawn("vectors", workdir / f"vectors_{dtype}", server_url, 0, {
+                    'chunks': args.vector_chunks, 'dimensions': args.vector_dim, 'dtype': dtype, 'searches': 30
+                }, workdir / f"vectors_{dtype}" / "papers", args.timeout))
+                shutil.rmtree(workdir / f"vectors_{dtype}", ignore_errors=True)
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=1), encoding='utf-8')
+        print(f"💾 Resultados guardados en {args.json}")
+    if args.baseline:
+        regressions = compare_baseline(results, json.loads(Path(args.baseline).read_text(encoding='utf-8')), args.tolerance)
+        print("\n".join(regressions) if regressions else f"✅ Sin regresiones frente a {args.baseline} (tolerancia {args.tolerance:.0%})")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Almacén vectorial de PaperMind sobre archivos NumPy mapeados en memoria.
+
+Los embeddings de los fragmentos no viven en los objetos Text (listas de floats de
+Python, ~50 KB por fragmento) sino en una matriz contigua en disco, una fila por
+fragmento y en el mismo orden que la lista `texts`, que hace de tabla de metadatos.
+El sistema operativo pagina la matriz bajo demanda: arrancar no lee los vectores
+y la memoria residente no crece con la biblioteca.
+
+Formatos de fila (PAPERMIND_VECTOR_DTYPE):
+- float32: exacto; el más rápido (BLAS lee directamente del mapa)
+- float16: mitad de espacio, error despreciable, pero convertir a float32 es lento en CPU
+- int8: un cuarto de espacio, con una escala float32 por fila en un archivo aparte;
+  casi tan rápido como float32 y con la misma exhaustividad en la práctica
+
+Las filas se guardan normalizadas, así que la similitud coseno es un producto escalar.
+La búsqueda recorre la matriz por bloques (multiplicación matriz-vector vectorizada)
+y selecciona los k mejores con argpartition.
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+from paperqa.llms import EmbeddingModes, VectorStore
+from paperqa.types import Embeddable
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+BLOCK_ROWS = 8192  # Filas por bloque al puntuar o copiar
+CONVERT_BLOCK_ROWS = 512  # Bloques de float16/int8: la copia a float32 cabe en la caché de la CPU
+INITIAL_CAPACITY = 1024
+QUERY_CACHE_SIZE = 256  # Embeddings de consultas recientes (preguntas repetidas en lotes)
+
+class MmapVectorStore(VectorStore):
+    """VectorStore de Paper-QA con los embeddings en un archivo mapeado en memoria"""
+    texts: List[Embeddable] = []
+    dtype: str = "float32"
+    dimensions: int = 0
+    generation: int = 0
+    count: int = 0
+    # Directorio de los archivos: lo asigna la aplicación al crear o cargar el índice
+    # (no se guarda en el pickle para que el índice pueda moverse de sitio)
+    _directory: Optional[Path] = None
+    _matrix: Any = None
+    _scales: Any = None
+    _selection: Any = None
+    _rows: Any = None
+    _stale: Any = None
+    _queries: Any = None  # Compartido con las vistas (model_copy copia la referencia)
+
+    def attach(self, directory, fresh: bool = False) -> "MmapVectorStore":
+        """Asociar el almacén a su directorio (al crearlo o tras cargar el pickle).
+        
+        Con fresh=True (almacén nuevo) se usa una generación sin archivos y los que
+        hubiera de un índice anterior se borran al guardar (remove_stale).
+        """
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._matrix = None
+        self._scales = None
+        if fresh:
+            previous = list(self._directory.glob("embeddings.*"))
+            self._stale = previous
+            self.generation = 1 + max((int(path.name.split(".")[1]) for path in previous), default=-1)
+        return self
+
+    def __getstate__(self):
+        # Los mapas de memoria no se serializan: se reabren al primer uso
+        state = super().__getstate__()
+        state['__pydantic_private__'] = {name: None for name in state['__pydantic_private__']}
+        return state
+
+    def file_path(self, generation: int = None, suffix: str = "") -> Path:
+        generation = self.generation if generation is None else generation
+        return self._directory / f"embeddings.{generation}.{self.dtype}{suffix}"
+
+    def open(self, capacity: int = 0):
+        """Mapear los archivos de la generación actual con al menos `capacity` filas"""
+        if self._directory is None:
+            raise RuntimeError("MmapVectorStore sin directorio: llama a attach() primero")
+        path = self.file_path()
+        row_bytes = self.dimensions * np.dtype(DTYPES[self.dtype]).itemsize
+        existing = path.stat().st_size // row_bytes if path.exists() else 0
+        capacity = max(capacity, existing, self.count, 1)
+        # El modo r+ amplía el archivo si hace falta; w+ solo si aún no existe
+        mode = "r+" if path.exists() else "w+"
+        self._matrix = np.memmap(path, dtype=DTYPES[self.dtype], mode=mode, shape=(capacity, self.dimensions))
+        if self.dtype == "int8":
+            scales = self.file_path(suffix=".scale")
+            self._scales = np.memmap(scales, dtype=np.float32, mode="r+" if scales.exists() else "w+", shape=(capacity,))
+
+    def matrix(self):
+        if self._matrix is None and self.count:
+            self.open()
+        return self._matrix
+
+    def row_map(self) -> dict:
+        """Fila de cada Text (por identidad: los Text se comparten con Docs.texts)"""
+        if self._rows is None:
+            self._rows = {id(text): row for row, text in enumerate(self.texts)}
+        return self._rows
+
+    def encode(self, vectors: np.ndarray):
+        """Normalizar y convertir al formato de almacenamiento: (filas, escalas o None)"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype != "int8":
+            return vectors.astype(DTYPES[self.dtype]), None
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def add_texts_and_embeddings(self, texts: Sequence[Embeddable]) -> None:
+        if not texts:
+            return
+        if any(text.embedding is None for text in texts):
+            raise ValueError("MmapVectorStore necesita los embeddings de los textos nuevos")
+        vectors = np.asarray([text.embedding for text in texts], dtype=np.float32)
+        if not self.dimensions:
+            self.dimensions = vectors.shape[1]
+        rows, scales = self.encode(vectors)
+
+        start = self.count
+        matrix = self.matrix()
+        if matrix is None or len(matrix) < start + len(rows):
+            capacity = max(INITIAL_CAPACITY, 2 * (start + len(rows)))
+            self.open(capacity)
+        self._matrix[start:start + len(rows)] = rows
+        if scales is not None:
+            self._scales[start:start + len(rows)] = scales
+
+        rows_map = self.row_map()
+        for offset, text in enumerate(texts):
+            rows_map[id(text)] = start + offset
+            # El vector ya está en disco: liberar la lista de floats
+            text.embedding = None
+        self.texts.extend(texts)
+        self.count += len(texts)
+
+    def clear(self) -> None:
+        """Vaciar el almacén; los archivos anteriores se borran en remove_stale()"""
+        self.retire_files()
+        self.texts = []
+        self.count = 0
+        self._rows = None
+
+    def retire_files(self):
+        if self._directory is not None:
+            self._stale = (self._stale or []) + [self.file_path(), self.file_path(suffix=".scale")]
+        self.generation += 1
+        self._matrix = None
+        self._scales = None
+
+    def compact(self, texts: Sequence[Embeddable]):
+        """Reescribir la matriz con solo las filas de `texts`, en ese orden (tras eliminar documentos)"""
+        rows_map = self.row_map()
+        rows = np.fromiter((rows_map[id(text)] for text in texts), dtype=np.int64, count=len(texts))
+        old_matrix, old_scales = self.matrix(), self._scales
+        self.retire_files()
+        self.texts = list(texts)
+        self.count = len(texts)
+        self._rows = None
+        if not self.count:
+            return
+        self.open(max(INITIAL_CAPACITY, self.count))
+        for start in range(0, self.count, BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            self._matrix[start:start + len(block)] = old_matrix[block]
+            if old_scales is not None:
+                self._scales[start:start + len(block)] = old_scales[block]
+
+    def flush(self):
+        """Asegurar en disco las filas escritas (antes de guardar el índice)"""
+        if self._matrix is not None:
+            self._matrix.flush()
+        if self._scales is not None:
+            self._scales.flush()
+
+    def remove_stale(self):
+        """Borrar los archivos de generaciones anteriores (tras guardar el índice).
+        
+        En Windows no se puede borrar un archivo que sigue mapeado en memoria (p. ej. por una
+        vista de una consulta en curso): se deja y se reintenta en el siguiente guardado.
+        """
+        pending = []
+        for path in self._stale or []:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                pending.append(path)
+        self._stale = pending or None
+
+    def astype(self, dtype: str) -> "MmapVectorStore":
+        """Copia del almacén con otro formato de fila (p. ej. al cambiar PAPERMIND_VECTOR_DTYPE)"""
+        store = MmapVectorStore(embedding_model=self.embedding_model, mmr_lambda=self.mmr_lambda, dtype=dtype,
+                                dimensions=self.dimensions)
+        store.attach(self._directory, fresh=True)
+        store.texts = list(self.texts)
+        store.count = self.count
+        if self.count:
+            store.open(max(INITIAL_CAPACITY, self.count))
+            for start in range(0, self.count, BLOCK_ROWS):
+                stop = min(start + BLOCK_ROWS, self.count)
+                rows, scales = store.encode(self.vectors(np.arange(start, stop)))
+                store._matrix[start:stop] = rows
+                if scales is not None:
+                    store._scales[start:stop] = scales
+        return store
+
+    def view(self, texts: Sequence[Embeddable]) -> "MmapVectorStore":
+        """Almacén de solo lectura restringido a `texts` (comparte la matriz, sin copiarla)"""
+        rows_map = self.row_map()
+        if self._queries is None:
+            self._queries = OrderedDict()
+        view = self.model_copy(update={'texts': list(texts)})
+        view._matrix, view._scales = self.matrix(), self._scales
+        view._selection = np.fromiter((rows_map[id(text)] for text in texts), dtype=np.int64, count=len(texts))
+        view._rows = None
+        return view
+
+    def vectors(self, positions, snapshot: tuple = None) -> np.ndarray:
+        """Vectores float32 (normalizados) en las posiciones indicadas de `texts`"""
+        _, matrix, scales, selection, _ = snapshot or self.snapshot()
+        positions = np.asarray(positions, dtype=np.int64)
+        rows = positions if selection is None else selection[positions]
+        vectors = np.asarray(matrix[rows], dtype=np.float32)
+        if scales is not None:
+            vectors *= scales[rows][:, None]
+        return vectors
+
+    def snapshot(self) -> tuple:
+        """Estado a puntuar (textos, matriz, escalas, selección, filas).
+        
+        Las búsquedas corren en un hilo: añadir o compactar en el event loop mientras tanto
+        no altera la instantánea (compactar crea otra lista y otro archivo).
+        """
+        return self.texts, self.matrix(), self._scales, self._selection, len(self.texts)
+
+    def scores(self, queries: np.ndarray, snapshot: tuple = None) -> np.ndarray:
+        """Similitud coseno de cada consulta (filas de `queries`) con cada texto, por bloques"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        _, matrix, scales, selection, total = snapshot or self.snapshot()
+        scores = np.empty((len(queries), total), dtype=np.float32)
+        block_rows = BLOCK_ROWS if self.dtype == "float32" else CONVERT_BLOCK_ROWS
+        for start in range(0, total, block_rows):
+            stop = min(start + block_rows, total)
+            rows = slice(start, stop) if selection is None else selection[start:stop]
+            # float32: vista directa del mapa, sin copia; float16/int8: se convierte solo el bloque
+            block = np.asarray(matrix[rows], dtype=np.float32)
+            block_scores = queries @ block.T
+            if scales is not None:
+                block_scores *= scales[rows]
+            scores[:, start:stop] = block_scores
+        return scores
+
+    def top_k(self, queries: np.ndarray, k: int, snapshot: tuple = None):
+        """Las k mejores posiciones por consulta (argpartition + orden solo de esas k)"""
+        scores = self.scores(queries, snapshot)
+        k = min(k, scores.shape[1])
+        if k == 0:
+            return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=np.float32)
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    async def embed_query(self, client: Any, query: str) -> np.ndarray:
+        if self._queries is None:
+            self._queries = OrderedDict()
+        key = (self.embedding_model.name, query)
+        vector = self._queries.get(key)
+        if vector is not None:
+            self._queries.move_to_end(key)
+            return vector
+        # Solo afecta a los modelos que usan un prompt distinto para consultas
+        self.embedding_model.set_mode(EmbeddingModes.QUERY)
+        vector = (await self.embedding_model.embed_documents(client, [query]))[0]
+        self.embedding_model.set_mode(EmbeddingModes.DOCUMENT)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._queries[key] = vector
+        while len(self._queries) > QUERY_CACHE_SIZE:
+            self._queries.popitem(last=False)
+        return vector
+
+    async def similarity_search(self, client: Any, query: str, k: int):
+        if not self.texts or k <= 0:
+            return [], []
+        query_vector = await self.embed_query(client, query)
+        snapshot = self.snapshot()
+        # El recorrido de la matriz libera el GIL (BLAS): no bloquea el event loop
+        positions, scores = await asyncio.to_thread(self.top_k, query_vector, k, snapshot)
+        texts = snapshot[0]
+        return [texts[i] for i in positions[0]], scores[0].tolist()
+
+    async def max_marginal_relevance_search(self, client: Any, query: str, k: int, fetch_k: int):
+        """MMR como Paper-QA, leyendo los vectores de la matriz en vez de Text.embedding"""
+        if fetch_k < k:
+            raise ValueError("fetch_k must be greater or equal to k")
+        if not self.texts:
+            return [], []
+        query_vector = await self.embed_query(client, query)
+        snapshot = self.snapshot()
+        positions, scores = await asyncio.to_thread(self.top_k, query_vector, fetch_k, snapshot)
+        positions, scores = positions[0], scores[0]
+        texts = snapshot[0]
+        if len(positions) <= k or self.mmr_lambda >= 1.0:
+            return [texts[i] for i in positions], scores.tolist()
+
+        vectors = self.vectors(positions, snapshot)
+        similarity = vectors @ vectors.T
+        selected = [0]
+        while len(selected) < k:
+            mmr_scores = self.mmr_lambda * scores - (1 - self.mmr_lambda) * similarity[:, selected].max(axis=1)
+            mmr_scores[selected] = -np.inf
+            selected.append(int(mmr_scores.argmax()))
+        return [texts[positions[i]] for i in selected], [float(scores[i]) for i in selected]